@@ -18,6 +18,17 @@ profiles_dictionary = {
 }
 
 
+# Folders which must not be deployed anymore -> why
+retired_folders = {
+    # Both read nutrition_users days as one 'value' list and save them with
+    # put_item of the whole day. Since meals are saved one per row with
+    # running totals in the row of the day (nutrition_dialog
+    # update_user_table), they don't see the meals and wipe the totals
+    'nutrition_dialog_old': 'it cannot read the days of nutrition_users',
+    'nutrition_dialog_2019': 'it cannot read the days of nutrition_users',
+}
+
+
 def print_info(info_str):
     print(info_str)
 
@@ -102,6 +113,11 @@ working_folder = sys.argv[1]
 if not os.path.isdir(working_folder):
     print_error('Cannot find folder %s' % working_folder)
     exit(1)
+folder_name = os.path.basename(os.path.normpath(working_folder))
+if folder_name in retired_folders:
+    print_error('%s is retired, %s' % (
+        folder_name, retired_folders[folder_name]))
+    exit(1)
 
 aws_profile_name = ''
 if len(sys.argv) > 2:
@@ -0,0 +1,131 @@
+import collections
+import math
+import os
+import threading
+import time
+import typing
+
+# Health of every upstream host, see http_sessions.request. Breakers are
+# module globals, so AWS lambda keeps them between calls like the HTTP
+# sessions, and all the requests of the container know that the host is
+# down once any of them found it out
+window_size = int(os.getenv('BreakerWindow', '50'))  # last calls remembered
+min_calls = 10  # fewer calls in the window tell nothing
+error_rate_to_open = 0.5
+consecutive_errors_to_open = 5
+open_seconds = float(os.getenv('BreakerOpenSeconds', '10'))
+timeout_factor = 2.0  # adaptive timeout is p95 of the window multiplied so
+min_timeout = 0.1  # seconds, the adaptive timeout is not less
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go as usual, their latency and result are remembered.
+    Open (too many errors in the window): calls fail at once with
+    CircuitOpen for open_seconds. Then one trial call is let through,
+    the breaker is closed if it succeeds and is opened again if not
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls: typing.Deque[typing.Tuple[float, bool]] = \
+            collections.deque(maxlen=window_size)  # (seconds, succeeded)
+        self.consecutive_errors = 0
+        self.opened_at: typing.Optional[float] = None  # monotonic, None
+        # if closed
+        self.trial_running = False
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'errors': 0, 'rejected': 0, 'opened': 0}
+
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if self.trial_running or \
+                time.monotonic() - self.opened_at < open_seconds:
+            return 'open'
+        return 'half-open'
+
+    def before_call(self) -> bool:
+        """
+        :return: True if the call is the trial one, its result decides
+        whether the breaker is closed
+        :raises CircuitOpen: if the call must not be made
+        """
+        with self.lock:
+            state = self.state()
+            if state == 'closed':
+                return False
+            if state == 'open':
+                self.stats['rejected'] += 1
+                raise CircuitOpen(f'{self.name} is unavailable')
+            self.trial_running = True
+            return True
+
+    def record(self, seconds: float, *, succeeded: bool, trial: bool):
+        """
+        :param seconds: how long the call took
+        :param succeeded: False for timeouts, connection errors and 5xx
+        :param trial: returned by before_call
+        """
+        with self.lock:
+            self.calls.append((seconds, succeeded))
+            self.stats['calls'] += 1
+            if succeeded:
+                self.consecutive_errors = 0
+            else:
+                self.stats['errors'] += 1
+                self.consecutive_errors += 1
+            if trial:
+                self.trial_running = False
+                if succeeded:
+                    print(f'{self.name} is available again')
+                    self.opened_at = None
+                else:
+                    self.opened_at = time.monotonic()
+            elif not succeeded and self.opened_at is None and \
+                    self.too_many_errors():
+                self.open()
+
+    def too_many_errors(self) -> bool:
+        if self.consecutive_errors >= consecutive_errors_to_open:
+            return True
+        if len(self.calls) < min_calls:
+            return False
+        errors = sum(1 for _, succeeded in self.calls if not succeeded)
+        return errors / len(self.calls) >= error_rate_to_open
+
+    def open(self) -> None:
+        print(f'{self.name} is unavailable, {self.stats}')
+        self.opened_at = time.monotonic()
+        self.stats['opened'] += 1
+        # Latency before the failures doesn't tell what it is now
+        self.calls.clear()
+
+    def timeout(self, own_timeout: float) -> float:
+        """
+        :param own_timeout: seconds, the usual timeout of the call
+        :return: p95 latency of successful calls in the window multiplied
+        by timeout_factor, but not more than own_timeout. own_timeout if
+        there are too few calls to know
+        """
+        with self.lock:
+            latencies = sorted(s for s, succeeded in self.calls if succeeded)
+        if len(latencies) < min_calls:
+            return own_timeout
+        p95 = latencies[math.ceil(len(latencies) * 0.95) - 1]
+        return min(own_timeout, max(min_timeout, p95 * timeout_factor))
+
+
+global_breakers: typing.Dict[str, CircuitBreaker] = {}
+global_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with global_breakers_lock:
+        if name not in global_breakers:
+            global_breakers[name] = CircuitBreaker(name)
+    return global_breakers[name]
@@ -0,0 +1,117 @@
+import concurrent.futures
+import math
+import os
+import time
+import typing
+import io_pipeline
+
+# Alice waits for the answer not longer than 3 seconds, part of it is
+# spent on the network
+response_seconds = float(os.getenv('ResponseDeadline', '2.5'))
+lambda_margin_seconds = 0.1  # to return before AWS lambda is killed
+min_io_seconds = 0.05  # I/O isn't started if less time is left
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """
+    Time left to answer the request. Created once in the handler and shared
+    by all copies of YandexRequest, every I/O call waits not longer than
+    min(own timeout, remaining time). When no time is left DeadlineExceeded
+    is raised and the handler answers with a fallback phrase
+    """
+
+    def __init__(self, *, seconds: float, lambda_context=None):
+        """
+        :param seconds: from now
+        :param lambda_context: AWS lambda context, its remaining time is
+        used if it is less
+        """
+        if hasattr(lambda_context, 'get_remaining_time_in_millis'):
+            seconds = min(
+                seconds,
+                lambda_context.get_remaining_time_in_millis() / 1000 -
+                lambda_margin_seconds,
+            )
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """
+        :return: seconds, 0 if expired
+        """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() < min_io_seconds
+
+    def check(self, stage: str) -> None:
+        """
+        :param stage: what was going to be done, for the log
+        :raises DeadlineExceeded: if there is no time for any I/O
+        """
+        if self.expired():
+            raise DeadlineExceeded(f'No time left for {stage}')
+
+    def timeout(self, own_timeout: float, *, stage: str) -> float:
+        """
+        For I/O which takes timeout, like http_sessions.request. If the
+        call fails, check tells whether it is because the time is out
+        :param own_timeout: seconds, the usual timeout of the call
+        :param stage: for the log
+        :return: min(own_timeout, remaining time)
+        """
+        self.check(stage)
+        return min(own_timeout, self.remaining())
+
+    def call(
+            self,
+            own_timeout: float,
+            target_function: typing.Callable,
+            *args,
+            **kwargs,
+    ) -> typing.Any:
+        """
+        For I/O with timeouts which can't be changed per call (boto3
+        client). If there is enough time, the function is called as is,
+        otherwise it goes to io_pipeline thread and is waited only for the
+        remaining time
+        :param own_timeout: seconds, the usual timeout of the call
+        :param target_function:
+        :raises DeadlineExceeded: if no time is left before or during the
+        call
+        """
+        stage = target_function.__name__
+        self.check(stage)
+        if self.remaining() >= own_timeout:
+            return target_function(*args, **kwargs)
+        return self.wait(
+            io_pipeline.submit(target_function, *args, **kwargs),
+            stage=stage,
+        )
+
+    def wait(
+            self,
+            future: concurrent.futures.Future,
+            *,
+            stage: str,
+    ) -> typing.Any:
+        """
+        :param future: io_pipeline task, which has its own timeout
+        :param stage: for the log
+        :return: result of the future
+        :raises DeadlineExceeded: if it isn't done in the remaining time
+        """
+        self.check(stage)
+        remaining = self.remaining()
+        try:
+            return future.result(
+                timeout=None if remaining == math.inf else remaining)
+        except concurrent.futures.TimeoutError:
+            raise DeadlineExceeded(
+                f'{stage} took longer than {remaining:.3f} seconds left')
+
+
+no_deadline = Deadline(seconds=math.inf)  # for requests not from Alice
@@ -9,15 +9,41 @@ from DialogContext import DialogContext
 from yandex_types import YandexRequest, \
     YandexResponse, construct_yandex_response_from_yandex_request
 import sys
-import inspect
 import random
-from dynamodb_functions import fetch_context_from_dynamo_database, \
+from dynamodb_functions import load_context, \
     get_from_cache_table, update_user_table, \
-    find_all_food_names_for_day, delete_food, write_keys_to_cache_table
+    find_all_food_names_for_day, delete_food, \
+    get_food_items_from_cache_table, write_food_items_to_cache_table, \
+    read_user_day_totals, food_in_l1
 import typing
 import requests
+import concurrent.futures
+import http_sessions
+import io_pipeline
+from request_metrics import count
+from CircuitBreaker import CircuitOpen
+from key_scheduler import choose_key, record_key_usage, \
+    mark_key_exhausted
 from dates_transformations import transform_yandex_datetime_value_to_datetime
-from dataclasses import replace
+from intents_index import IntentsIndex, fits_triggers, request_phrases
+from food_items import FoodItem, split_into_food_items, find_cached_food, \
+    foods_to_cache
+from translation_cache import normalize_tokens, get_translation, \
+    save_translation, save_failed_translation, failed_translation, \
+    translation_in_l1
+
+# Priority tiers for time_to_evaluate. Intents are evaluated tier by tier,
+# inside one tier in alphabetical order of their class names
+TIER_INSTANT = 0  # Only the request itself is checked
+TIER_CONTEXT = 100  # Context is read from database
+TIER_FOOD_SEARCH = 9999  # Always fits, so should be evaluated the last
+TIER_DEFAULT = 99999  # Fallback if nothing else fits
+
+# Every DialogIntent subclass gets here when it is defined
+_intents_registry: typing.List[type] = []
+registered_intents: typing.Tuple[type, ...] = ()  # Frozen at the end of
+# the module, intents should not be defined after that
+registered_intents_by_name: typing.Dict[str, type] = {}
 
 
 class DialogIntent:
@@ -39,10 +65,42 @@ class DialogIntent:
     should_read_context: bool = False  # Whether read context
 
     # from database. Costs 100 units (database READ)
+    should_read_food_cache: bool = False  # Whether cached food and API keys
+    # are needed, so they can be prefetched together with context
+    should_read_user_day: bool = False  # Whether today's foods of the user
+    # are needed (to list or delete them for example)
+    trigger_tokens: typing.Tuple[str, ...] = ()  # If any of these tokens is
+    # in request, the intent can fit
+    trigger_phrases: typing.Tuple[str, ...] = ()  # Whole lowercased phrases
+    # which can fit the intent
+    trigger_parts: typing.Tuple[str, ...] = ()  # Parts of words (or
+    # phrases) which can fit the intent, 'погод' for example
+    blocking_tokens: typing.Tuple[str, ...] = ()  # If any of these tokens
+    # is in request, the intent doesn't fit whatever else is there
+    always_evaluate: bool = False  # If intent rules cannot be expressed by
+    # triggers above (context, length of the phrase etc), it is evaluated
+    # for every request. Otherwise it is evaluated only if IntentsIndex
+    # finds one of its triggers in the request
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if registered_intents:
+            raise Exception(f'Intent {cls.__name__} is defined after the '
+                            f'registry was frozen')
+        _intents_registry.append(cls)
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        raise NotImplemented
+        """
+        By default the intent fits if one of its triggers is in request.
+        Override if something more complicated is needed, but keep the
+        triggers, so IntentsIndex knows when to call it
+        """
+        if fits_triggers(cls, request):
+            request.intents_matching_dict[cls] = 100
+        else:
+            request.intents_matching_dict[cls] = 0
+        return request
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -50,9 +108,10 @@ class DialogIntent:
 
 
 class Intent00001StartingMessage(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Clear context
     should_clear_context = True
+    always_evaluate = True
     name = 'Первое сообщение'
     description = 'Когда пользователь только открывает навык, ' \
                   'ему следует написать приветственное сообщение'
@@ -75,19 +134,11 @@ class Intent00001StartingMessage(DialogIntent):
 
 
 class Intent00002Ping(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 0
     name = 'Ответ на пинг'
     description = 'Яндекс пингует навык каждую минуту. Отвечаем понг'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance
-        if full_phrase.lower() in ('ping', 'пинг'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('ping', 'пинг')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -98,8 +149,9 @@ class Intent00002Ping(DialogIntent):
 
 
 class Intent00003TextTooLong(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 0
+    always_evaluate = True
     name = 'Текст слишком длинный'
     description = 'Мы будем отбрасывать длинные запросы, ' \
                   'потому что не хватит времени найти на них ответ. ' \
@@ -124,11 +176,13 @@ class Intent00003TextTooLong(DialogIntent):
 
 
 class Intent00004Help(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Текст помощи'
     should_clear_context = True
     description = 'Объясняем пользователю как работает навык'
+    trigger_tokens = ('помощь', 'справка', 'хелп', 'информация', 'умеешь',
+                      'скучно', 'help', 'что', 'как')
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
@@ -167,26 +221,20 @@ class Intent00004Help(DialogIntent):
 
 
 class Intent00005ThankYou(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Ответ на благодарность'
     should_clear_context = True
     description = 'Если пользователь похвалил навык, надо сказать ему спасибо'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        if request.original_utterance.lower().strip() in (
-                'спасибо', 'молодец', 'отлично', 'ты классная',
-                'классная штука',
-                'классно', 'ты молодец', 'круто', 'обалдеть', 'прикольно',
-                'клево', 'ништяк', 'класс', 'спасибо алиса',
-                'спасибо моя дорогая', 'благодарю', 'спасибо спасибо',
-                'окей спасибо', 'хорошо', 'прекрасно',
-        ) or 'лайк' in request.tokens:
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_tokens = ('лайк',)
+    trigger_phrases = (
+        'спасибо', 'молодец', 'отлично', 'ты классная',
+        'классная штука',
+        'классно', 'ты молодец', 'круто', 'обалдеть', 'прикольно',
+        'клево', 'ништяк', 'класс', 'спасибо алиса',
+        'спасибо моя дорогая', 'благодарю', 'спасибо спасибо',
+        'окей спасибо', 'хорошо', 'прекрасно',
+    )
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -203,22 +251,14 @@ class Intent00005ThankYou(DialogIntent):
 
 
 class Intent00006Hello(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Ответ на приветствие'
     should_clear_context = True
     description = 'Если пользователь сказал Привет, надо ' \
                   'сказать ему привет в ответ'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        if request.original_utterance.lower().strip() in (
-                'привет', 'здравствуй', 'здравствуйте', 'хелло',
-                'приветик', 'hello',):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('привет', 'здравствуй', 'здравствуйте', 'хелло',
+                       'приветик', 'hello',)
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -231,25 +271,15 @@ class Intent00006Hello(DialogIntent):
 
 
 class Intent00007HumanMeat(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Ответ на человечину'
     should_clear_context = True
     should_save_context = True
     description = 'Если пользователь сказал что он поел ' \
                   'человечины, надо спросить его не доктор ли он Лектер'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        tokens = request.tokens
-        full_phrase = request.original_utterance
-        if [t for t in tokens if 'человеч' in t] or \
-                tokens == ['мясо', 'человека'] or \
-                full_phrase.lower() in ('человек',):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_parts = ('человеч',)
+    trigger_phrases = ('мясо человека', 'человек')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -279,31 +309,16 @@ class Intent00007HumanMeat(DialogIntent):
 
 
 class Intent00008Goodbye(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'До свидания'
     should_clear_context = True
     description = 'Если пользователь попрощался, надо сказать ему до ' \
                   'свидания и закрыть навык'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        tokens = request.tokens
-        full_phrase = request.original_utterance
-        if (
-                'выход' in tokens or
-                'выйти' in tokens or
-                'выйди' in tokens or
-                'до свидания' in full_phrase.lower() or
-                'всего доброго' in full_phrase.lower() or
-                full_phrase in ('иди на хуй', 'стоп', 'пока', 'выходить',
-                                'отключись', 'закройся', 'ладно пока')
-
-        ):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_tokens = ('выход', 'выйти', 'выйди')
+    trigger_parts = ('до свидания', 'всего доброго')
+    trigger_phrases = ('иди на хуй', 'стоп', 'пока', 'выходить',
+                       'отключись', 'закройся', 'ладно пока')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -315,22 +330,14 @@ class Intent00008Goodbye(DialogIntent):
 
 
 class Intent00009EatCat(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Съел кота'
     should_clear_context = True
     description = 'Если пользователь говорит что съел кота, ' \
                   'надо предложить ему падумоть'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance
-        if full_phrase in ('кошка', 'кошку', 'кот',
-                           'кота', 'котенок', 'котенка'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('кошка', 'кошку', 'кот',
+                       'кота', 'котенок', 'котенка')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -341,29 +348,21 @@ class Intent00009EatCat(DialogIntent):
 
 
 class Intent00010LaunchAgain(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Повторный запуск'
     should_clear_context = True
     description = 'Если пользователь уже в навыке, но ' \
                   'просит Алису его запустить'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance
-        if full_phrase.lower().strip() in (
-                'запусти навык умный счетчик калорий',
-                'запустить навык умный счетчик калорий',
-                'алиса запусти умный счетчик калорий',
-                'запустить умный счетчик калорий',
-                'запусти умный счетчик калорий', 'счетчик калорий',
-                'запусти счетчик калорий',
-                '',
-        ):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = (
+        'запусти навык умный счетчик калорий',
+        'запустить навык умный счетчик калорий',
+        'алиса запусти умный счетчик калорий',
+        'запустить умный счетчик калорий',
+        'запусти умный счетчик калорий', 'счетчик калорий',
+        'запусти счетчик калорий',
+        '',
+    )
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -374,24 +373,16 @@ class Intent00010LaunchAgain(DialogIntent):
 
 
 class Intent00011EatPoop(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Съел какаху'
     should_clear_context = True
     should_save_context = True
     description = 'Почему-то пользователи иногда любят заявлять что съели ' \
                   'говно. Что ж, сделаем отсылку к Зеленому Слонику'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance.lower()
-        if full_phrase in ('говно', 'какашка', 'кака', 'дерьмо',
-                           'фекалии', 'какахе', 'какахи', 'какаха', 'какаху',
-                           'какашку', 'какашки'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('говно', 'какашка', 'кака', 'дерьмо',
+                       'фекалии', 'какахе', 'какахи', 'какаха', 'какаху',
+                       'какашку', 'какашки')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -402,8 +393,8 @@ class Intent00011EatPoop(DialogIntent):
                 should_clear_context=True)
 
         if 'answer' in kwargs and kwargs['answer'] == 'Intent00022Agree':
-            request = replace(request, original_utterance='сладкий хлеб',
-                              command='сладкий хлеб')
+            request = request.replace(original_utterance='сладкий хлеб',
+                                      command='сладкий хлеб')
             request = Intent01000SearchForFood.evaluate(request=request)
             return Intent01000SearchForFood.respond(request=request)
 
@@ -423,23 +414,15 @@ class Intent00011EatPoop(DialogIntent):
 
 
 class Intent00012ThinkTooMuch(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Кажется, слишком много'
     should_clear_context = True
     description = 'Пользователь думает что навык насчитал слишком много ' \
                   'калорий. Попросим его написать мне'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance.lower()
-        if full_phrase in ('это много', 'это мало', 'что-то много',
-                           'что-то мало', 'так много', 'а почему так много',
-                           'неправильно', 'мало', "маловато",):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('это много', 'это мало', 'что-то много',
+                       'что-то мало', 'так много', 'а почему так много',
+                       'неправильно', 'мало', "маловато",)
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -451,20 +434,12 @@ class Intent00012ThinkTooMuch(DialogIntent):
 
 
 class Intent00013Dick(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Съел МПХ'
     should_clear_context = True
     description = 'Пользователь говорит что съел член. Спросим, с солью или без'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance.lower()
-        if full_phrase in ('хуй', 'моржовый хуй', 'хер', 'хуй моржовый'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('хуй', 'моржовый хуй', 'хер', 'хуй моржовый')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -475,24 +450,16 @@ class Intent00013Dick(DialogIntent):
 
 
 class Intent00014NothingToAdd(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Не надо мне никакой еды'
     should_clear_context = True
     description = 'На вопрос какую еду записать, пользователь отвечает что ' \
                   'никакой не надо'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance.lower()
-        if full_phrase in ('никакую', 'ничего', 'никакой', 'все', 'всё',
-                           'я не знаю что сказать', 'я не знаю',
-                           'да никакой не надо', 'да никакую', 'а я не знаю',
-                           'никакую не надо', 'не знаю'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('никакую', 'ничего', 'никакой', 'все', 'всё',
+                       'я не знаю что сказать', 'я не знаю',
+                       'да никакой не надо', 'да никакую', 'а я не знаю',
+                       'никакую не надо', 'не знаю')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -503,23 +470,15 @@ class Intent00014NothingToAdd(DialogIntent):
 
 
 class Intent00031AnyFood(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Любую еду'
     should_clear_context = True
     description = 'Пользователь не хочет думать и говорит: Любую. Не будем ' \
                   'решать за него'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance.lower()
-        if full_phrase in ('любую', 'любую еду',
-                           'какую сама хочешь', 'ну любую', 'вкусную',
-                           'какую угодно', 'какую хочешь', ):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('любую', 'любую еду',
+                       'какую сама хочешь', 'ну любую', 'вкусную',
+                       'какую угодно', 'какую хочешь', )
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -531,21 +490,13 @@ class Intent00031AnyFood(DialogIntent):
 
 
 class Intent00031Inache(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Иначе'
     should_clear_context = True
     description = 'Навык говорит: попробуйте сказать иначе. Пользователь ' \
                   'говорит иначе'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance.lower()
-        if full_phrase in ('иначе',):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('иначе',)
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -556,18 +507,20 @@ class Intent00031Inache(DialogIntent):
 
 
 class Intent00015WhatIsYourName(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Как тебя зовут?'
     should_clear_context = True
     description = 'Пользователь спрашивает как зовут счетчика'
+    trigger_tokens = ('как',)
+    trigger_phrases = ('какое у тебя имя',)
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
         tokens = request.tokens
         if 'как' in tokens and ('зовут' in tokens or 'имя' in tokens):
             request.intents_matching_dict[cls] = 100
-        elif request.command in ('какое у тебя имя',):
+        elif request.command in cls.trigger_phrases:
             request.intents_matching_dict[cls] = 100
         else:
             request.intents_matching_dict[cls] = 0
@@ -583,22 +536,14 @@ class Intent00015WhatIsYourName(DialogIntent):
 
 
 class Intent00016CalledAgain(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Обращение к навыку из навыка'
     should_clear_context = True
     description = 'Пользователь внутри навыка снова говорит "Умный счетчик ' \
                   'калорий". Нужно дать ему знать, что мы его все еще слушаем'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance
-        if full_phrase in ('умный счетчик калорий',
-                           'алиса умный счетчик калорий', 'умный счетчик'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('умный счетчик калорий',
+                       'алиса умный счетчик калорий', 'умный счетчик')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -609,24 +554,16 @@ class Intent00016CalledAgain(DialogIntent):
 
 
 class Intent00017WhereIsSaved(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Куда ты сохраняешь?'
     should_clear_context = True
     description = 'Пользователь может спросить куда сохраняются данные'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance
-        if full_phrase in ('а где сохраняются', 'где сохраняются',
-                           'где сохранить', 'а зачем сохранять',
-                           'зачем сохранять', 'куда', 'а куда сохранила',
-                           'где сохранено', 'где', 'зачем сохранить',
-                           'что сохранить'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('а где сохраняются', 'где сохраняются',
+                       'где сохранить', 'а зачем сохранять',
+                       'зачем сохранять', 'куда', 'а куда сохранила',
+                       'где сохранено', 'где', 'зачем сохранить',
+                       'что сохранить')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -639,23 +576,15 @@ class Intent00017WhereIsSaved(DialogIntent):
 
 
 class Intent00018Angry(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Пользователь злится'
     should_clear_context = True
     description = 'Пользователь ругает навык'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance
-        if full_phrase in (
-                'дура', 'дурочка', 'иди на хер', 'пошла нахер', 'тупица',
-                'идиотка', 'тупорылая', 'тупая', 'ты дура', 'плохо',
-                'ты тупая', 'ты дурочка', 'пошла на хуй', 'да ты врешь'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = (
+        'дура', 'дурочка', 'иди на хер', 'пошла нахер', 'тупица',
+        'идиотка', 'тупорылая', 'тупая', 'ты дура', 'плохо',
+        'ты тупая', 'ты дурочка', 'пошла на хуй', 'да ты врешь')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -668,32 +597,22 @@ class Intent00018Angry(DialogIntent):
 
 
 class Intent00019NotImplemented(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Эта функция пока не реализована'
     should_clear_context = True
     description = 'Пользователь запросил функцию, которая пока не ' \
                   'реализована, но у меня в планах она есть'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance.lower()
-        tokens = request.tokens
-        if full_phrase in ('норма калорий',
-                           'сколько я набрала калорий',
-                           'сколько я набрал калорий',
-                           'сколько в день нужно калорий',
-                           'норма потребления',
-                           'сколько нужно съесть калорий в день',
-                           'дневная норма калорий',
-                           'сколько калорий можно употреблять в сутки',
-                           'сколько калорий в день можно'
-                           ) or 'норма' in tokens or \
-                'меню' in tokens:
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_tokens = ('норма', 'меню')
+    trigger_phrases = ('норма калорий',
+                       'сколько я набрала калорий',
+                       'сколько я набрал калорий',
+                       'сколько в день нужно калорий',
+                       'норма потребления',
+                       'сколько нужно съесть калорий в день',
+                       'дневная норма калорий',
+                       'сколько калорий можно употреблять в сутки',
+                       'сколько калорий в день можно')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -705,21 +624,13 @@ class Intent00019NotImplemented(DialogIntent):
 
 
 class Intent00021ShutUp(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Заткнись'
     should_clear_context = True
     description = 'Пользователь говорит навыку заткнуться.'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance
-        if full_phrase in ('заткнись', 'замолчи', 'молчи', 'молчать',
-                           'иди нахуй', 'не говори ничего', 'иди в жопу'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('заткнись', 'замолчи', 'молчи', 'молчать',
+                       'иди нахуй', 'не говори ничего', 'иди в жопу')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -731,26 +642,23 @@ class Intent00021ShutUp(DialogIntent):
 
 
 class Intent00022Agree(DialogIntent):
-    time_to_evaluate = 100  # Need to check context
+    time_to_evaluate = TIER_CONTEXT  # Need to check context
     time_to_respond = 0  # Need to clear context
     name = 'Ответ ДА'
     should_clear_context = True
+    should_read_context = True
     description = 'Пользователь отвечает согласием. Нужно посмотреть в ' \
                   'контексте, на что было дано согласие и передать ' \
                   'управление этому интенту'
+    trigger_phrases = ('да', 'ну да', 'ага', 'конечно')
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        r = request
-        if not request.context:
-            r = r.set_context(
-                fetch_context_from_dynamo_database(
-                    session_id=r.session_id,
-                    lambda_mode=r.aws_lambda_mode))
+        r = load_context(yandex_request=request)
 
         # tokens = request.tokens
         full_phrase = request.original_utterance.lower().strip()
-        if full_phrase in ('да', 'ну да', 'ага', 'конечно'):
+        if full_phrase in cls.trigger_phrases:
             r.intents_matching_dict[cls] = 100
             r = r.set_chosen_intent(cls)
         else:
@@ -763,7 +671,8 @@ class Intent00022Agree(DialogIntent):
                 and cls.__name__ in request.context.matching_intents_names:
             print(f'Getting answer from originating '
                   f'intent {request.context.intent_originator_name}')
-            return globals()[request.context.intent_originator_name].respond(
+            return intent_by_name(
+                request.context.intent_originator_name).respond(
                 request=request,
                 answer=cls.__name__)
 
@@ -774,26 +683,23 @@ class Intent00022Agree(DialogIntent):
 
 
 class Intent00023Disagree(DialogIntent):
-    time_to_evaluate = 100  # Need to check context
+    time_to_evaluate = TIER_CONTEXT  # Need to check context
     time_to_respond = 0  # Need to clear context
     name = 'Ответ НЕТ'
     should_clear_context = True
+    should_read_context = True
     description = 'Пользователь отвечает отказом. Нужно посмотреть в ' \
                   'контексте, на что было дан отказ и передать ' \
                   'управление этому интенту'
+    trigger_phrases = ('нет', 'ну нет', 'неа', 'ни за что')
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        r = request
-        if not request.context:
-            r = r.set_context(
-                fetch_context_from_dynamo_database(
-                    session_id=r.session_id,
-                    lambda_mode=r.aws_lambda_mode))
+        r = load_context(yandex_request=request)
 
         # tokens = request.tokens
         full_phrase = request.original_utterance.lower().strip()
-        if full_phrase in ('нет', 'ну нет', 'неа', 'ни за что'):
+        if full_phrase in cls.trigger_phrases:
             r.intents_matching_dict[cls] = 100
             r = r.set_chosen_intent(cls)
         else:
@@ -806,7 +712,8 @@ class Intent00023Disagree(DialogIntent):
                 and cls.__name__ in request.context.matching_intents_names:
             print(f'Getting answer from originating '
                   f'intent {request.context.intent_originator_name}')
-            return globals()[request.context.intent_originator_name].respond(
+            return intent_by_name(
+                request.context.intent_originator_name).respond(
                 request=request,
                 answer=cls.__name__)
 
@@ -818,44 +725,28 @@ class Intent00023Disagree(DialogIntent):
 
 
 class Intent00024SaveFood(DialogIntent):
-    time_to_evaluate = 100  # Need to check context
+    time_to_evaluate = TIER_CONTEXT  # Need to check context
     time_to_respond = 0  # Need to clear context
     name = 'Да, сохранить еду'
     should_clear_context = True
+    should_read_context = True
     description = 'У пользователя в контексте есть еда, и он подтверждает ' \
                   'свое согласие записать ее в базу данных'
+    trigger_tokens = ('хранить', 'сохранить', 'сохраняй', 'сохрани', 'храни',
+                      'да')
+    trigger_phrases = ('ну давай', 'давай', 'давай сохраняй', 'ладно')
+    blocking_tokens = ('не', 'нет')
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        r = request
-        if not request.context:
-            r = r.set_context(
-                fetch_context_from_dynamo_database(
-                    session_id=r.session_id,
-                    lambda_mode=r.aws_lambda_mode))
-        if not request.context or request.context.user_initial_phrase == \
-                'Empty context' or not request.context.food_dict:  # if
+        r = load_context(yandex_request=request)
+        if not r.context or r.context.user_initial_phrase == \
+                'Empty context' or not r.context.food_dict:  # if
             # no context found, no way it is save food
             r.intents_matching_dict[cls] = 0
             return r
 
-        tokens = request.tokens
-        full_phrase = request.original_utterance.lower().strip()
-        if 'не' in tokens or 'нет' in tokens:
-            r.intents_matching_dict[cls] = 0
-            return r
-        if ('хранить' in tokens or
-                'сохранить' in tokens or
-                'сохраняй' in tokens or
-                'сохрани' in tokens or
-                'храни' in tokens or
-                'сохранить' in tokens or
-                'да' in tokens or full_phrase in (
-                        'ну давай',
-                        'давай',
-                        'давай сохраняй',
-                        'ладно',
-                )):
+        if fits_triggers(cls, r):
             r.intents_matching_dict[cls] = 100
             r = r.set_chosen_intent(cls)
         else:
@@ -868,7 +759,8 @@ class Intent00024SaveFood(DialogIntent):
                 and cls.__name__ in request.context.matching_intents_names:
             print(f'Getting answer from originating '
                   f'intent {request.context.intent_originator_name}')
-            return globals()[request.context.intent_originator_name].respond(
+            return intent_by_name(
+                request.context.intent_originator_name).respond(
                 request=request,
                 answer=cls.__name__)
 
@@ -880,34 +772,25 @@ class Intent00024SaveFood(DialogIntent):
 
 
 class Intent00025DoNotSaveFood(DialogIntent):
-    time_to_evaluate = 100  # Need to check context
+    time_to_evaluate = TIER_CONTEXT  # Need to check context
     time_to_respond = 0  # Need to clear context
     name = 'Нет, не надо сохранять еду'
     should_clear_context = True
+    should_read_context = True
     description = 'У пользователя в контексте есть еда, но он говорит что не ' \
                   'надо записывать ее в базу данных'
+    trigger_tokens = ('не', 'нет', 'забудь', 'забыть')
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        r = request
-        if not request.context:
-            r = r.set_context(
-                fetch_context_from_dynamo_database(
-                    session_id=r.session_id,
-                    lambda_mode=r.aws_lambda_mode))
-
-        if not request.context or request.context.user_initial_phrase == \
-                'Empty context' or not request.context.food_dict:
+        r = load_context(yandex_request=request)
+
+        if not r.context or r.context.user_initial_phrase == \
+                'Empty context' or not r.context.food_dict:
             r.intents_matching_dict[cls] = 0
             return r
 
-        tokens = request.tokens
-        if (
-                'не' in tokens or
-                'нет' in tokens or
-                'забудь' in tokens or
-                'забыть' in tokens
-        ):
+        if fits_triggers(cls, r):
             r.intents_matching_dict[cls] = 100
             r = r.set_chosen_intent(cls)
         else:
@@ -920,7 +803,8 @@ class Intent00025DoNotSaveFood(DialogIntent):
                 and cls.__name__ in request.context.matching_intents_names:
             print(f'Getting answer from originating '
                   f'intent {request.context.intent_originator_name}')
-            return globals()[request.context.intent_originator_name].respond(
+            return intent_by_name(
+                request.context.intent_originator_name).respond(
                 request=request,
                 answer=cls.__name__)
 
@@ -932,11 +816,60 @@ class Intent00025DoNotSaveFood(DialogIntent):
 
 
 class Intent00026WhatIAte(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 110  # Read user database and clear context
     name = 'Что я ел?'
     should_clear_context = True
     description = 'Пользователь просит вспомнить что он ел'
+    trigger_tokens = ('что', 'сколько')
+    trigger_phrases = (
+        'покажи результат',
+        'открыть список сохранения',
+        'скажи результат',
+        'общий результат',
+        'общий итог',
+        'какой итог',
+        'сколько всего',
+        'сколько калорий',
+        'какой результат',
+        'сколько в общем калорий',
+        'сколько всего калорий',
+        'сколько калорий в общей сумме',
+        'сколько я съел калорий',
+        'сколько я съела калорий',
+        'покажи сохраненную',
+        'покажи сколько калорий',
+        'сколько я съел',
+        'сколько всего калорий было',
+        'сколько всего калорий было в день',
+        'список сохраненные еды',
+        'список сохраненной еды',
+        'общая сумма калорий за день',
+        'посчитай все калории за сегодня',
+        'сколько все вместе за весь день',
+        'ну посчитай сколько всего калорий',
+        'посчитай сколько всего калорий',
+        'подсчитать калории',
+        'сколько калорий у меня сегодня',
+        'подсчитать все',
+        'сколько всего получилось',
+        'сколько за день',
+        'сколько калорий за день',
+        'сколько сегодня калорий',
+        'сколько было сегодня калорий',
+        'сколько сегодня калорий было',
+        'общее количество',
+        'посчитай калории',
+        'итог',
+        'наели калорий за сегодня',
+        'итого', 'посчитай все', 'мой список продуктов',
+        'общий счет', 'что уже записано',
+        'сложить все калории сегодняшние',
+        'почитай калории за весь день',
+        'сумма калорий за весь день', 'посчитай все вместе',
+        'всего калорий в день', 'сколько уже всего',
+        'сколько получилось всего',
+    )
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
@@ -947,54 +880,7 @@ class Intent00026WhatIAte(DialogIntent):
                      in full_phrase):
             request.intents_matching_dict[cls] = 100
             return request
-        if full_phrase in ('покажи результат',
-                           'открыть список сохранения',
-                           'скажи результат',
-                           'общий результат',
-                           'общий итог',
-                           'какой итог',
-                           'сколько всего',
-                           'сколько калорий',
-                           'какой результат',
-                           'сколько в общем калорий',
-                           'сколько всего калорий',
-                           'сколько калорий в общей сумме',
-                           'сколько я съел калорий',
-                           'сколько я съела калорий',
-                           'покажи сохраненную',
-                           'покажи сколько калорий',
-                           'сколько я съел',
-                           'сколько всего калорий было',
-                           'сколько всего калорий было в день',
-                           'список сохраненные еды',
-                           'список сохраненной еды',
-                           'общая сумма калорий за день',
-                           'посчитай все калории за сегодня',
-                           'сколько все вместе за весь день',
-                           'ну посчитай сколько всего калорий',
-                           'посчитай сколько всего калорий',
-                           'подсчитать калории',
-                           'сколько калорий у меня сегодня',
-                           'подсчитать все',
-                           'сколько всего получилось',
-                           'сколько за день',
-                           'сколько калорий за день',
-                           'сколько сегодня калорий',
-                           'сколько было сегодня калорий',
-                           'сколько сегодня калорий было',
-                           'общее количество',
-                           'посчитай калории',
-                           'итог',
-                           'наели калорий за сегодня',
-                           'итого', 'посчитай все', 'мой список продуктов',
-                           'общий счет', 'что уже записано',
-                           'сложить все калории сегодняшние',
-                           'почитай калории за весь день',
-                           'сумма калорий за весь день', 'посчитай все вместе',
-                           'всего калорий в день', 'сколько уже всего',
-                           'сколько получилось всего',
-
-                           ):
+        if any(p in cls.trigger_phrases for p in request_phrases(request)):
             request.intents_matching_dict[cls] = 100
         else:
             request.intents_matching_dict[cls] = 0
@@ -1024,6 +910,8 @@ class Intent00026WhatIAte(DialogIntent):
             lambda_mode=request.aws_lambda_mode,
             date=target_date,
             user_id=request.user_guid,
+            prefetched=request.prefetched,
+            deadline=request.deadline,
         )
         if len(all_food_for_date) == 0:
             return construct_yandex_response_from_yandex_request(
@@ -1039,7 +927,15 @@ class Intent00026WhatIAte(DialogIntent):
         food_total_text, food_total_tts = total_calories_text(
             food_dicts_list=all_food_for_date,
             target_date=target_date,
-            timezone=request.timezone)
+            timezone=request.timezone,
+            day_totals=read_user_day_totals(
+                lambda_mode=request.aws_lambda_mode,
+                date=target_date,
+                user_id=request.user_guid,
+                prefetched=request.prefetched,
+                deadline=request.deadline,
+            ),
+        )
 
         return construct_yandex_response_from_yandex_request(
             yandex_request=request,
@@ -1050,13 +946,15 @@ class Intent00026WhatIAte(DialogIntent):
 
 
 class Intent00027DeleteSavedFood(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 120  # Read user database, write to user database
     # and clear context
     name = 'Удалить сохраненную еду по названию'
     should_clear_context = True
     description = 'Пользователь просит удалить еду, которую он сохранял ' \
                   'до этого'
+    trigger_tokens = ('удалить', 'удали', 'удалите', 'убери', 'убрать')
+    trigger_phrases = ('сбросить все', 'сбрось все')
 
     @staticmethod
     def define_deletion_date(request: YandexRequest) -> datetime.date:
@@ -1076,17 +974,12 @@ class Intent00027DeleteSavedFood(DialogIntent):
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        for t in ['удалить',
-                  'удали',
-                  'удалите',
-                  'убери',
-                  'убрать',
-                  ]:
+        for t in cls.trigger_tokens:
             if t in request.tokens and 'номер' not in request.tokens:
                 # if number speficied, then
                 # Intent00028DeleteSavedFoodByNumber fits better
                 request.intents_matching_dict[cls] = 100
-        if request.command.lower() in ('сбросить все', 'сбрось все'):
+        if request.command.lower() in cls.trigger_phrases:
             request.intents_matching_dict[cls] = 100
         if cls not in request.intents_matching_dict:
             request.intents_matching_dict[cls] = 0
@@ -1129,6 +1022,8 @@ class Intent00027DeleteSavedFood(DialogIntent):
                 list_of_all_food_dicts=[],
                 user_id=request.user_guid,
                 lambda_mode=request.aws_lambda_mode,
+                prefetched=request.prefetched,
+                deadline=request.deadline,
             )
             return construct_yandex_response_from_yandex_request(
                 yandex_request=request,
@@ -1141,6 +1036,8 @@ class Intent00027DeleteSavedFood(DialogIntent):
             lambda_mode=request.aws_lambda_mode,
             date=target_date,
             user_id=request.user_guid,
+            prefetched=request.prefetched,
+            deadline=request.deadline,
         )
         today_names_list = [food['utterance'] for food in all_food_for_date]
         if len(all_food_for_date) == 0:
@@ -1176,6 +1073,8 @@ class Intent00027DeleteSavedFood(DialogIntent):
                 list_of_all_food_dicts=all_food_for_date,
                 user_id=request.user_guid,
                 lambda_mode=request.aws_lambda_mode,
+                prefetched=request.prefetched,
+                deadline=request.deadline,
             )
             return construct_yandex_response_from_yandex_request(
                 yandex_request=request,
@@ -1186,23 +1085,19 @@ class Intent00027DeleteSavedFood(DialogIntent):
 
 
 class Intent00028DeleteSavedFoodByNumber(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 120  # Read user database, write to user database
     # and clear context
     name = 'Удалить сохраненную еду по номеру в списку'
     should_clear_context = True
     description = 'Пользователь просит удалить еду, которую он сохранял ' \
                   'до этого, называя ее по номеру'
+    trigger_tokens = ('удалить', 'удали', 'удалите', 'убери', 'убрать')
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
         request.intents_matching_dict[cls] = 0
-        for t in ['удалить',
-                  'удали',
-                  'удалите',
-                  'убери',
-                  'убрать',
-                  ]:
+        for t in cls.trigger_tokens:
             if t in request.tokens:
                 request.intents_matching_dict[cls] += 80
                 break
@@ -1221,6 +1116,8 @@ class Intent00028DeleteSavedFoodByNumber(DialogIntent):
             lambda_mode=request.aws_lambda_mode,
             date=target_date,
             user_id=request.user_guid,
+            prefetched=request.prefetched,
+            deadline=request.deadline,
         )
         if len(all_food_for_date) == 0:
             return construct_yandex_response_from_yandex_request(
@@ -1268,6 +1165,8 @@ class Intent00028DeleteSavedFoodByNumber(DialogIntent):
             ],
             lambda_mode=request.aws_lambda_mode,
             user_id=request.user_guid,
+            prefetched=request.prefetched,
+            deadline=request.deadline,
         )
 
         return construct_yandex_response_from_yandex_request(
@@ -1281,21 +1180,13 @@ class Intent00028DeleteSavedFoodByNumber(DialogIntent):
 
 
 class Intent00029Glibberish(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Всякая чушь'
     should_clear_context = True
     description = 'Пользователь говорит всякую чушь, о которой я точно знаю, ' \
                   'что это не еда.'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance
-        if full_phrase in ('тарелка', 'ложка'):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_phrases = ('тарелка', 'ложка')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -1308,19 +1199,12 @@ class Intent00029Glibberish(DialogIntent):
 
 
 class Intent00030Weather(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Какая погода'
     should_clear_context = True
     description = 'Пользователь пытается узнать погоду в навыке'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        if part_of_the_word_in_at_least_one_tokens('погод', request.tokens):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_parts = ('погод',)
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -1332,23 +1216,13 @@ class Intent00030Weather(DialogIntent):
 
 
 class Intent00031Milligram(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Сколько миллиграмм'
     should_clear_context = True
     description = 'Пользователь пытается сломать навык, введя вес в ' \
                   'миллиграммах. Сообщить что такие единицы не поддерживаются'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        if part_of_the_word_in_at_least_one_tokens('миллиграм', request.tokens):
-            request.intents_matching_dict[cls] = 100
-        elif part_of_the_word_in_at_least_one_tokens('микрограм',
-                                                     request.tokens):
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_parts = ('миллиграм', 'микрограм')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -1359,13 +1233,14 @@ class Intent00031Milligram(DialogIntent):
 
 
 class Intent00001HowManyCaloriesIn(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 500  # Up to API calls
     name = 'Сколько калорий в...'
     should_clear_context = True
     description = 'Пользователь спрашивает сколько калорий в чем-нибудь. ' \
                   'Просто сообщим ему сколько в 100 граммах, и не будем ' \
                   'спрашивать о сохранении.'
+    trigger_tokens = ('калорий',)
 
     @classmethod
     def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
@@ -1379,13 +1254,13 @@ class Intent00001HowManyCaloriesIn(DialogIntent):
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
-        request = replace(request, command=request.command.lower().replace(
+        request = request.replace(command=request.command.lower().replace(
             'сколько', "").replace('калорий', '').replace(
             ' в ', '').strip())
         if request.command.endswith('е'):
-            request = replace(request, command=request.command[:-1])
+            request = request.replace(command=request.command[:-1])
 
-        request = replace(request, tokens=request.command.split())
+        request = request.replace(tokens=request.command.split())
 
         return Intent01000SearchForFood.respond(
             request=request,
@@ -1398,24 +1273,14 @@ class Intent00001HowManyCaloriesIn(DialogIntent):
 
 
 class Intent00180UseAsAlice(DialogIntent):
-    time_to_evaluate = 0
+    time_to_evaluate = TIER_INSTANT
     time_to_respond = 10  # Need to clear context
     name = 'Обращение к Алисе'
     should_clear_context = True
     description = 'Пользователь думает что говорит с Алисой и пытается ' \
                   'вызвать ее функции. Нужно сказать ему, что это Счетчик ' \
                   'и научить как выйти в Алису'
-
-    @classmethod
-    def evaluate(cls, *, request: YandexRequest, **kwargs) -> YandexRequest:
-        full_phrase = request.original_utterance.lower()
-        if 'запусти' in full_phrase or 'поиграем' in full_phrase or \
-                'алиса' in full_phrase or 'порно' in full_phrase or \
-                'доллар' in full_phrase:
-            request.intents_matching_dict[cls] = 100
-        else:
-            request.intents_matching_dict[cls] = 0
-        return request
+    trigger_parts = ('запусти', 'поиграем', 'алиса', 'порно', 'доллар')
 
     @classmethod
     def respond(cls, *, request: YandexRequest, **kwargs) -> YandexResponse:
@@ -1427,10 +1292,12 @@ class Intent00180UseAsAlice(DialogIntent):
 
 
 class Intent01000SearchForFood(DialogIntent):
-    time_to_evaluate = 9999  # Needs to be evaluated the last
+    time_to_evaluate = TIER_FOOD_SEARCH  # Needs to be evaluated the last
     time_to_respond = 500  # Save food context
     name = 'Найти еду'
     should_clear_context = False
+    should_read_food_cache = True
+    always_evaluate = True
     description = 'Пользователь сказал что он съел. Нужно посчитать калории'
 
     @classmethod
@@ -1450,6 +1317,8 @@ class Intent01000SearchForFood(DialogIntent):
                 foods_dict=request.context.food_dict,
                 utterance=request.context.user_initial_phrase,
                 user_id=request.user_guid,
+                prefetched=request.prefetched,
+                deadline=request.deadline,
             )
 
             return construct_yandex_response_from_yandex_request(
@@ -1464,28 +1333,62 @@ class Intent01000SearchForFood(DialogIntent):
                 text='Забыто',
                 should_clear_context=True)
 
+        translation = None
+        if request.use_food_cache and not request.food_dict and \
+                not request.translated_phrase and request.command and \
+                request.command not in request.prefetched.food_cache and \
+                io_pipeline.speculative_translation:
+            # Cache is not known yet, so translating while searching in it
+            translation = start_translation(yandex_request=request)
+
         if request.use_food_cache:
             request = get_from_cache_table(yandex_requext=request)
 
         if request.error:
             return Intent99999Default.respond(request=request)
 
+        food_source = 'phrase_cache'
+        food_items = split_into_food_items(request.command or '')
+        if not request.food_dict and request.use_food_cache:
+            food_source = 'food_items_cache'
+            request = search_food_items(
+                yandex_request=request,
+                food_items=food_items,
+            )
+
         if not request.food_dict and not request.translated_phrase:
-            request = russian_replacements_in_original_utterance(
-                yandex_request=request)
-            request = translate_into_english(yandex_request=request)
+            if translation is None:
+                translation = request.prefetched.translations.get(
+                    request.command)
+            if translation is not None:
+                translated = request.deadline.wait(
+                    translation, stage='translation')
+                request = request.replace(
+                    tokens=translated.tokens,
+                    translated_phrase=translated.translated_phrase,
+                )
+            else:
+                request = russian_replacements_in_original_utterance(
+                    yandex_request=request)
+                request = translate_into_english(yandex_request=request)
 
         if not request.translated_phrase and not request.food_dict:
+            count('food_source.not_translated')
             return Intent99999Default.respond(request=request)
 
         if not request.food_dict:  # trying to query API
+            food_source = 'api'
             request = query_api(yandex_request=request)
-            write_keys_to_cache_table(
-                keys_dict=request.api_keys,
-                lambda_mode=request.aws_lambda_mode)
+            save_food_items(
+                yandex_request=request,
+                food_items=food_items,
+                food_dict=request.food_dict,
+            )
 
         if not request.food_dict or 'foods' not in request.food_dict:
+            count(f'food_source.{food_source}_not_found')
             return Intent99999Default.respond(request=request)
+        count(f'food_source.{food_source}')
 
         include_grams = True
         foods_found = len(request.food_dict['foods'])
@@ -1530,6 +1433,8 @@ class Intent01000SearchForFood(DialogIntent):
                 foods_dict=request.food_dict,
                 utterance=request.original_utterance,
                 user_id=request.user_guid,
+                prefetched=request.prefetched,
+                deadline=request.deadline,
             )
             kwargs['do_not_ask_for_save'] = True
             should_clear_context = True
@@ -1573,10 +1478,11 @@ class Intent99999Default(DialogIntent):
     WARNING! This class should always be the last in the file
     This a default response in none of above fit
     """
-    time_to_evaluate = 99999
+    time_to_evaluate = TIER_DEFAULT
     time_to_respond = 0
     name = 'Дефолтный ответ'
     should_clear_context = False
+    always_evaluate = True
     description = 'Если ничего не подошло, ' \
                   'отвечаем пользователю что не знаем такой еды'
 
@@ -1627,17 +1533,18 @@ class Intent99999Default(DialogIntent):
         )
 
 
-def intents() -> list:
-    intents_to_return = []
-    for class_name, cl in inspect.getmembers(
-            sys.modules[__name__],
-            inspect.isclass):
-        # Excluding auxiliary classes
-        if class_name in ('DialogIntent', 'YandexRequest', 'YandexResponse',
-                          'DialogContext'):
-            continue
-        intents_to_return.append(cl)
-    return intents_to_return
+def intents() -> typing.Tuple[type, ...]:
+    """
+    All intents, sorted by time_to_evaluate tier and then by name
+    """
+    return registered_intents
+
+
+def intent_by_name(name: str) -> type:
+    """
+    To find the intent which asked the question saved in context
+    """
+    return registered_intents_by_name[name]
 
 
 def make_final_text(
@@ -1729,13 +1636,31 @@ def choose_case(*, amount: float, round_to_int=False, tts_mode=False) -> str:
 @timeit
 def translate_into_english(*, yandex_request: YandexRequest) -> YandexRequest:
     russian_phrase = ' '.join(yandex_request.tokens)
+    cache_key = normalize_tokens(yandex_request.tokens)
+    cached_translation = get_translation(
+        phrase=cache_key,
+        lambda_mode=yandex_request.aws_lambda_mode,
+        deadline=yandex_request.deadline,
+    )
+    if cached_translation is failed_translation:
+        print(f'"{russian_phrase}" failed to be translated recently')
+        count('translation.failed_recently')
+        return yandex_request
+    if cached_translation is not None:
+        count('translation.cache')
+        print(f'Translation of "{russian_phrase}" found in cache: '
+              f'"{cached_translation}"')
+        return yandex_request.set_translated_phrase(cached_translation)
+
     if yandex_request.aws_lambda_mode:
         timeout = 1.0
     else:
         timeout = 10
+    timeout = yandex_request.deadline.timeout(timeout, stage='translation')
     print(f'Translating "{russian_phrase}" into English')
+    count('translation.api')
     try:
-        response = requests.get(
+        response = http_sessions.get(
             'https://translate.yandex.net/api/v1.5/tr.json/translate',
             params={
                 'key':  os.getenv('YandexTranslate'),
@@ -1744,56 +1669,123 @@ def translate_into_english(*, yandex_request: YandexRequest) -> YandexRequest:
             },
             timeout=timeout,
         )
-    except requests.ReadTimeout:
-        print(f'Timeout during Yandex Translate')
+    except CircuitOpen:
+        raise
+    except requests.RequestException as e:
+        # The timeout could be cut by the deadline, then Yandex Translate is
+        # not to blame and there is no time to answer without translation
+        yandex_request.deadline.check('translation')
+        print(f'Exception when translating: {e}')
         return yandex_request
 
     if not response:
         print(f'Response not received from Yandex Translate: {response.text}')
+        save_failed_translation(phrase=cache_key)
         return yandex_request
 
     try:
         json_dict = json.loads(response.text)
     except Exception as e:
         print(f'Cannot parse response from yandex translate: {e}')
+        save_failed_translation(phrase=cache_key)
         return yandex_request
 
     if 'text' not in json_dict or len(json_dict['text']) < 1:
         print(f'Cannot parse response from yandex translate: {json_dict}')
+        save_failed_translation(phrase=cache_key)
         return yandex_request
 
     translated_text = json_dict['text'][0].lower(). \
         replace('bisque', 'soup')
     translated_text = re.sub(r'without (\w+)', '', translated_text)
     print(f'Translated: "{translated_text}"')
+    save_translation(
+        phrase=cache_key,
+        translation=translated_text,
+        lambda_mode=yandex_request.aws_lambda_mode,
+    )
 
     yandex_request = yandex_request.set_translated_phrase(translated_text)
     return yandex_request
 
 
+def start_translation(
+        *,
+        yandex_request: YandexRequest,
+) -> typing.Optional[concurrent.futures.Future]:
+    """
+    Starts translate_into_english in a separate thread, so it goes in
+    parallel with the food cache lookup. Started only once per command and
+    not started if the food or the translation is in memory: then the
+    translation is not needed or takes no I/O. The handler cancels or waits
+    for translations which were not used, see finish_translations
+    :return: None if not started
+    """
+    translations = yandex_request.prefetched.translations
+    if yandex_request.command in translations:
+        return translations[yandex_request.command]
+    if food_in_l1(yandex_request.command):
+        return None
+    replaced = russian_replacements_in_original_utterance(
+        yandex_request=yandex_request)
+    if translation_in_l1(normalize_tokens(replaced.tokens)):
+        return None
+    count('translation.speculative')
+    translations[yandex_request.command] = io_pipeline.submit(
+        translate_into_english, yandex_request=replaced)
+    return translations[yandex_request.command]
+
+
+def finish_translations(*, yandex_request: YandexRequest) -> None:
+    """
+    Translations started by start_translation and not used are cancelled
+    if they haven't started yet, otherwise they are waited for with the
+    background tasks. So their metrics go to this invocation and their
+    writes are flushed with the writes of this request
+    """
+    for translation in yandex_request.prefetched.translations.values():
+        if not translation.cancel() and not translation.done():
+            io_pipeline.add_background_task(translation)
+
+
 @timeit
 def query_api(*, yandex_request: YandexRequest) -> YandexRequest:
-    login, password, keys_dict = choose_key(yandex_request.api_keys)
-    yandex_request = yandex_request.set_api_keys(api_keys=keys_dict)
+    login, password = choose_key(
+        yandex_request.api_keys,
+        lambda_mode=yandex_request.aws_lambda_mode,
+    )
     link = yandex_request.api_keys['link']
     if not yandex_request.aws_lambda_mode:  # while testing locally it
         # doesn't matter how long the script executed
         timeout = 10
     else:
         timeout = 0.5
+    timeout = yandex_request.deadline.timeout(timeout, stage='API request')
     try:
-        response = requests.post(link,
-                                 data=json.dumps({
-                                     'query':
-                                         yandex_request.translated_phrase}),
-                                 headers={'content-type': 'application/json',
-                                          'x-app-id':     login,
-                                          'x-app-key':    password},
-                                 timeout=timeout,
-                                 )
+        response = http_sessions.post(
+            link,
+            data=json.dumps({'query': yandex_request.translated_phrase}),
+            headers={'content-type': 'application/json',
+                     'x-app-id':     login,
+                     'x-app-key':    password},
+            timeout=timeout,
+        )
+    except CircuitOpen:
+        raise
     except Exception as e:
+        yandex_request.deadline.check('API request')  # see translation
         print(f'Exception when querying API: {e}')
         return yandex_request
+    io_pipeline.run_in_background(
+        record_key_usage,
+        key_name=login,
+        lambda_mode=yandex_request.aws_lambda_mode)
+
+    if response.status_code in (401, 403, 429):  # usage limits exceeded
+        io_pipeline.run_in_background(
+            mark_key_exhausted,
+            key_name=login,
+            lambda_mode=yandex_request.aws_lambda_mode)
 
     if response.status_code not in (200, 404):  # 404 means food just not
         # found in database
@@ -1822,35 +1814,111 @@ def query_api(*, yandex_request: YandexRequest) -> YandexRequest:
     return yandex_request
 
 
-def choose_key(keys_dict):
-    min_usage_value = 90000
-    key_with_minimal_usages = None
-    limit_date = str(datetime.datetime.now() - datetime.timedelta(hours=24))
-    for k in keys_dict['keys']:
-        # deleting keys usages if they are older than 24 hours
-        # k = {'name': 'xxxx', 'pass': 'xxxx', 'dates': [list of strings]}
-        k['dates'] = [d for d in k['dates'] if d > limit_date]
-        if key_with_minimal_usages is None:
-            key_with_minimal_usages = k
-        if min_usage_value > len(k['dates']):
-            key_with_minimal_usages = k
-            min_usage_value = len(k['dates'])
+def save_food_items(
+        *,
+        yandex_request: YandexRequest,
+        food_items: typing.List[FoodItem],
+        food_dict: typing.Optional[dict],
+) -> None:
+    """
+    Saves foods returned by API one by one, so they can be reused in other
+    phrases. Compact copies are queued now, because food_dict is changed
+    later
+    """
+    if not food_dict or 'foods' not in food_dict:
+        return
+    items = foods_to_cache(food_items, food_dict['foods'])
+    if items:
+        write_food_items_to_cache_table(
+            items=items,
+            lambda_mode=yandex_request.aws_lambda_mode)
 
-    key_with_minimal_usages['dates'].append(str(datetime.datetime.now()))
-    print(f"Key {key_with_minimal_usages['name']} with "
-          f"{len(key_with_minimal_usages['dates'])} usages for last 24 hours")
 
-    return \
-        key_with_minimal_usages['name'], \
-        key_with_minimal_usages['pass'], \
-        keys_dict
+@timeit
+def search_food_items(
+        *,
+        yandex_request: YandexRequest,
+        food_items: typing.List[FoodItem],
+) -> YandexRequest:
+    """
+    If the whole phrase is not in cache, composes food_dict from the foods
+    cached one by one. Only unknown foods are translated and sent to API,
+    if nothing is known the phrase is searched as a whole as before
+    :param yandex_request:
+    :param food_items: split_into_food_items of the command
+    :return: request with food_dict if all the foods were found
+    """
+    if not food_items:
+        return yandex_request
+    cached = get_food_items_from_cache_table(
+        item_keys=[k for i in food_items
+                   for k in (i.key, i.per_100_grams_key)],
+        lambda_mode=yandex_request.aws_lambda_mode,
+        deadline=yandex_request.deadline,
+    )
+    foods = [find_cached_food(i, cached) for i in food_items]
+    if all(f is not None for f in foods):
+        print(f'All {len(foods)} foods found in cache one by one')
+        count('food_items_cache.all')
+        return yandex_request.set_food_dict(food_dict={'foods': foods})
+    if not any(foods):
+        count('food_items_cache.none')
+        return yandex_request
+    count('food_items_cache.some')
+
+    unknown_items = [i for i, f in zip(food_items, foods) if f is None]
+    print(f'{len(foods) - len(unknown_items)} foods found in cache, '
+          f'querying API for {len(unknown_items)}')
+    unknown_words = []
+    for food_item in unknown_items:
+        if unknown_words:
+            unknown_words.append('и')
+        unknown_words += food_item.words
+    unknown_request = yandex_request.replace(
+        command=' '.join(unknown_words),
+        tokens=unknown_words,
+        translated_phrase='',
+    )
+    unknown_request = russian_replacements_in_original_utterance(
+        yandex_request=unknown_request)
+    unknown_request = translate_into_english(yandex_request=unknown_request)
+    if not unknown_request.translated_phrase:
+        return yandex_request
+    unknown_request = query_api(yandex_request=unknown_request)
+    if not unknown_request.food_dict or \
+            'foods' not in unknown_request.food_dict:
+        return yandex_request
+
+    api_foods = unknown_request.food_dict['foods']
+    save_food_items(
+        yandex_request=yandex_request,
+        food_items=unknown_items,
+        food_dict=unknown_request.food_dict,
+    )
+    if len(api_foods) == len(unknown_items):
+        api_foods_iterator = iter(api_foods)
+        foods = [f if f is not None else next(api_foods_iterator)
+                 for f in foods]
+    else:  # Can't tell which is which, known foods go first
+        foods = [f for f in foods if f is not None] + api_foods
+    return yandex_request.set_food_dict(food_dict={'foods': foods})
 
 
 def total_calories_text(
         *,
         food_dicts_list: typing.List[dict],
         target_date: datetime.date,
-        timezone: str) -> typing.Tuple[str, str]:
+        timezone: str,
+        day_totals: typing.Optional[dict] = None,
+) -> typing.Tuple[str, str]:
+    """
+    :param food_dicts_list:
+    :param target_date:
+    :param timezone:
+    :param day_totals: running totals of the day (see day_totals), if they
+    are known, only calories of every meal are summed for its line
+    :return: text and tts
+    """
     total_calories = 0
     total_fat = 0.0
     total_carbohydrates = 0.0
@@ -1870,6 +1938,8 @@ def total_calories_text(
         for f in nutrition_dict['foods']:
             calories = f.get("nf_calories", 0) or 0
             this_food_calories += calories
+            if day_totals is not None:
+                continue
             total_calories += calories
             protein = f.get("nf_protein", 0) or 0
             total_protein += protein
@@ -1882,6 +1952,13 @@ def total_calories_text(
         full_text += f'[{food_time.strftime("%H:%M")}] ' \
                      f'{food["utterance"]} ({round(this_food_calories, 2)})\n'
 
+    if day_totals is not None:
+        total_calories = day_totals['total_calories']
+        total_protein = day_totals['total_protein']
+        total_fat = day_totals['total_fat']
+        total_carbohydrates = day_totals['total_carbohydrates']
+        total_sugar = day_totals['total_sugar']
+
     all_total = total_protein + total_fat + total_carbohydrates
     if all_total == 0:
         return f'Не могу ничего найти за {target_date}. Я сохраняю еду в ' \
@@ -2151,14 +2228,22 @@ def russian_replacements_in_original_utterance(
             if token in phrase:
                 phrase = phrase.replace(token, replacement['replacement'])
 
-    return replace(
-            yandex_request,
+    return yandex_request.replace(
             # original_utterance=phrase,
             # command=phrase,
             tokens=phrase.split(),
     )
 
 
+# Built once, when the module is loaded (AWS lambda keeps it between calls)
+registered_intents = tuple(sorted(
+    _intents_registry,
+    key=lambda x: (x.time_to_evaluate, x.__name__),
+))
+registered_intents_by_name = {i.__name__: i for i in registered_intents}
+compiled_intents_index = IntentsIndex(intents=registered_intents)
+
+
 if __name__ == '__main__':
     print(sys.modules[__name__])
     print(intents())
@@ -0,0 +1,67 @@
+import collections
+import threading
+import time
+import typing
+
+
+class LruCache:
+    """
+    In-process cache which AWS lambda keeps between calls (like
+    global_client). Bounded by the number of items, the least recently used
+    item is removed first, every item lives not longer than its TTL.
+    Thread safe, because io_pipeline threads use it too
+    """
+
+    def __init__(self, *, max_items: int, ttl_seconds: float):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._items: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+    def get(self, key: str, default: typing.Any = None) -> typing.Any:
+        with self._lock:
+            if key not in self._items:
+                self.stats['misses'] += 1
+                return default
+            expires_at, value = self._items[key]
+            if expires_at < time.monotonic():
+                del self._items[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return default
+            self._items.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def put(
+            self,
+            key: str,
+            value: typing.Any,
+            *,
+            ttl_seconds: typing.Optional[float] = None,
+    ) -> None:
+        """
+        :param key:
+        :param value:
+        :param ttl_seconds: if not set, the one of the cache is used
+        """
+        if ttl_seconds is None:
+            ttl_seconds = self.ttl_seconds
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.stats['evicted'] += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+    def hit_rate(self) -> float:
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
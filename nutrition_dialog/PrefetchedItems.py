@@ -0,0 +1,38 @@
+from dataclasses import dataclass, field
+import concurrent.futures
+import typing
+from DialogContext import DialogContext
+
+
+@dataclass()
+class PrefetchedItems:
+    """
+    Items loaded from DynamoDB with a single batch request before the
+    intents which need database are evaluated. The object is shared by all
+    copies of YandexRequest made with replace, so whatever is loaded once
+    is reused by all the intents during the request
+    """
+    attempted: bool = False  # Whether prefetch was already tried, not to
+    # try it twice during one request
+    context: typing.Optional[DialogContext] = None  # nutrition_sessions
+    # row, None if not fetched
+    context_status: str = ''  # 'hit', 'miss' or 'timeout' after the
+    # context was loaded, empty if it wasn't requested yet
+    context_stored: typing.Optional[bool] = None  # whether nutrition_sessions
+    # has a row of the session, None if unknown. Not to clear the context
+    # when nothing is stored
+    food_cache: typing.Dict[str, dict] = field(default_factory=dict)  #
+    # phrase -> food_dict from nutrition_cache, empty dict if the phrase was
+    # fetched but not found
+    api_keys: typing.Optional[dict] = None  # '_key' row from nutrition_cache
+    user_days: typing.Dict[str, list] = field(default_factory=dict)  #
+    # date string -> list of foods from nutrition_users
+    user_day_keys: typing.Dict[str, list] = field(default_factory=dict)  #
+    # date string -> date key of nutrition_users row of every food in
+    # user_days, to delete them
+    user_day_totals: typing.Dict[str, typing.Optional[dict]] = field(
+        default_factory=dict)  # date string -> running totals of the day,
+    # see day_totals, None if they were never saved
+    translations: typing.Dict[str, concurrent.futures.Future] = field(
+        default_factory=dict)  # command -> translation started in
+    # parallel with the cache lookup
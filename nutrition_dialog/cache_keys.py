@@ -0,0 +1,174 @@
+import re
+import typing
+
+# Canonical key of nutrition_cache row. Phrases which mean the same food
+# should get the same key, so "200 грамм гречки", "гречки 200 грамм" and
+# "гречка двести грамм" are one cache row instead of three API calls.
+# There is no morphology library in the lambda, so words are stemmed by
+# cutting common endings, the same way the intents check parts of words.
+# A key shared by different foods gives wrong nutrients, which is worse than
+# a cache miss, so the word order is kept ("суп из сыра" is not "сыр из
+# супа") and short words are not stemmed ("сало" is not "салями")
+
+# Words which don't change the food
+filler_words = frozenset((
+    'а', 'ах', 'в', 'во', 'вот', 'ел', 'ела', 'за', 'и', 'или', 'на', 'ну',
+    'плюс', 'пожалуйста', 'сколько', 'съел', 'съела', 'скушал', 'скушала',
+    'выпил', 'выпила', 'я', 'мы', 'еще', 'сохрани', 'сохранить',
+    'запиши', 'записать', 'добавь', 'добавить', 'алиса', 'содержится',
+    'есть', 'было', 'был', 'была', 'ли',
+))
+
+# Words separating several foods in one phrase
+separator_words = frozenset(('и', 'плюс', 'а', 'также', ',', ';'))
+
+units = {
+    'г': ('г', 'гр', 'грамм', 'грамма', 'граммов', 'граммы'),
+    'кг': ('кг', 'кило', 'килограмм', 'килограмма', 'килограммов'),
+    'мл': ('мл', 'миллилитр', 'миллилитра', 'миллилитров'),
+    'л': ('л', 'литр', 'литра', 'литров'),
+    'шт': ('шт', 'штука', 'штуки', 'штук', 'штуку'),
+    'ккал': ('ккал', 'калория', 'калории', 'калорий'),
+    'ложка': ('ложка', 'ложки', 'ложек', 'ложку'),
+    'стакан': ('стакан', 'стакана', 'стаканов'),
+    'чашка': ('чашка', 'чашки', 'чашек', 'чашку'),
+    'кусок': ('кусок', 'куска', 'кусков', 'кусочек', 'кусочка',
+              'кусочков'),
+    'тарелка': ('тарелка', 'тарелки', 'тарелок', 'тарелку'),
+    '%': ('%', 'процент', 'процента', 'процентов'),  # 'молоко 3.2%'
+}
+unit_by_word = {word: unit for unit, words in units.items() for word in words}
+
+numbers = {
+    'ноль': 0, 'один': 1, 'одна': 1, 'одну': 1, 'два': 2, 'две': 2,
+    'три': 3, 'четыре': 4, 'пять': 5, 'шесть': 6, 'семь': 7, 'восемь': 8,
+    'девять': 9, 'десять': 10, 'одиннадцать': 11, 'двенадцать': 12,
+    'пятнадцать': 15, 'двадцать': 20, 'тридцать': 30, 'сорок': 40,
+    'пятьдесят': 50, 'шестьдесят': 60, 'семьдесят': 70, 'восемьдесят': 80,
+    'девяносто': 90, 'сто': 100, 'двести': 200, 'триста': 300,
+    'четыреста': 400, 'пятьсот': 500, 'шестьсот': 600, 'семьсот': 700,
+    'восемьсот': 800, 'девятьсот': 900, 'тысяча': 1000, 'полтора': 1.5,
+    'полторы': 1.5, 'пол': 0.5, 'половина': 0.5, 'половину': 0.5,
+}
+
+# Longest first, so 'ами' is cut before 'и'
+endings = sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ой', 'ей',
+    'ом', 'ем', 'ах', 'ях', 'ов', 'ев', 'ую', 'юю', 'ая', 'яя', 'ые', 'ие',
+    'ое', 'ее', 'ый', 'ий', 'ым', 'им', 'а', 'я', 'у', 'ю', 'ы', 'и', 'е',
+    'о',
+), key=len, reverse=True)
+minimal_stem_length = 4  # 3 letters make 'сал' of 'сало' and 'салями'
+
+words_regexp = re.compile(r'\d+(?:[.,]\d+)?|[^\W\d_]+|[,;%]')
+number_regexp = re.compile(r'\d+(?:[.,]\d+)?')
+
+
+def stem(word: str) -> str:
+    """
+    :param word: 'гречки'
+    :return: 'гречк'
+    """
+    if not word.isalpha() or not re.match(r'[а-я]', word):
+        return word  # numbers and latin words as is
+    for ending in endings:
+        if word.endswith(ending) and \
+                len(word) - len(ending) >= minimal_stem_length:
+            return word[:-len(ending)]
+    return word
+
+
+def format_number(number: float) -> str:
+    return str(int(number)) if number == int(number) else str(number)
+
+
+def is_number(word: str) -> bool:
+    return word in numbers or bool(number_regexp.fullmatch(word))
+
+
+def split_into_items(words: typing.List[str]) -> typing.List[typing.List[str]]:
+    """
+    :param words: ['2', 'банана', '1', 'яблоко', 'и', 'чай']
+    :return: [['2', 'банана'], ['1', 'яблоко'], ['чай']]
+    """
+    items = [[]]
+    for number, word in enumerate(words):
+        item = items[-1]
+        new_quantity = is_number(word) and number > 0 and \
+            not is_number(words[number - 1]) and \
+            any(is_number(w) for w in item) and \
+            any(not is_number(w) and w not in unit_by_word for w in item)
+        if word in separator_words or new_quantity:
+            items.append([])
+        if word not in separator_words:
+            items[-1].append(word)
+
+    # 'гречка, 200 грамм': quantity without food belongs to previous food
+    merged = []
+    for item in items:
+        only_quantity = all(is_number(w) or w in unit_by_word for w in item)
+        if merged and only_quantity:
+            merged[-1].extend(item)
+        elif item:
+            merged.append(item)
+    return merged
+
+
+def canonical_item(words: typing.List[str]) -> str:
+    """
+    Food words stemmed in the order they were said, followed by quantity
+    :param words: ['200', 'грамм', 'гречки']
+    :return: 'гречк 200 г'
+    """
+    food, quantity = canonical_food_and_quantity(words)
+    return ' '.join(food + quantity)
+
+
+def canonical_food_and_quantity(
+        words: typing.List[str],
+) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """
+    :param words: ['200', 'грамм', 'гречки']
+    :return: (['гречк'], ['200', 'г'])
+    """
+    food = []
+    quantity = []
+    number = None
+    for word in words:
+        if is_number(word):
+            value = numbers.get(word)
+            if value is None:
+                value = float(word.replace(',', '.'))
+            # 'двести пятьдесят' is one number
+            number = value if number is None else number + value
+            continue
+        after_number = number is not None
+        if after_number:
+            quantity.append(format_number(number))
+            number = None
+        if word in unit_by_word:
+            # 'сколько калорий в банане' is the same as 'банан'
+            if after_number or unit_by_word[word] != 'ккал':
+                quantity.append(unit_by_word[word])
+        elif word not in filler_words:
+            food.append(stem(word))
+    if number is not None:
+        quantity.append(format_number(number))
+    return food, quantity
+
+
+def phrase_words(phrase: str) -> typing.List[str]:
+    return words_regexp.findall(phrase.lower().replace('ё', 'е'))
+
+
+def canonical_cache_key(phrase: str) -> str:
+    """
+    :param phrase: 'Гречки 200 грамм и банан'
+    :return: 'банан | гречк 200 г'
+    """
+    words = phrase_words(phrase)
+    items = [canonical_item(i) for i in split_into_items(words)]
+    key = ' | '.join(sorted(i for i in items if i))
+    # Phrases of filler words only are kept as they are, not to make all of
+    # them one row
+    return key or phrase.lower().strip()
@@ -0,0 +1,63 @@
+import json
+import typing
+import zlib
+
+# Format of food rows of nutrition_cache.
+# 1: 'response' is a string with JSON exactly as Nutritionix returned it
+# 2: 'data' is zlib compressed JSON with only projected_food_fields of every
+#    food, 'format' is 2
+# Rows of both formats can be read, only the second one is written
+cache_record_format = 2
+
+projected_food_fields = (
+    # used in responses
+    'food_name', 'nf_calories', 'nf_protein', 'nf_total_fat',
+    'nf_total_carbohydrate', 'nf_sugars', 'serving_weight_grams',
+    # not used yet
+    'serving_qty', 'serving_unit', 'nf_saturated_fat', 'nf_cholesterol',
+    'nf_sodium', 'nf_dietary_fiber', 'nf_potassium',
+)
+
+
+def compact_food(food: dict) -> dict:
+    """
+    :param food: one element of food_dict['foods']
+    :return: only projected_food_fields of it
+    """
+    return {k: food[k] for k in projected_food_fields if k in food}
+
+
+def compact_food_dict(food_dict: dict) -> dict:
+    """
+    :param food_dict: Nutritionix response
+    :return: the same with projected foods, 'message' is kept for not found
+    foods
+    """
+    compact = {k: v for k, v in food_dict.items() if k == 'message'}
+    if 'foods' in food_dict:
+        compact['foods'] = [compact_food(f) for f in food_dict['foods']]
+    return compact
+
+
+def encode_cache_record(value: typing.Any) -> dict:
+    """
+    :param value: compacted food_dict or food
+    :return: DynamoDB attributes of the row, except initial_phrase
+    """
+    data = json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+    return {
+        'format': {'N': str(cache_record_format)},
+        'data': {'B': zlib.compress(data.encode('utf-8'))},
+    }
+
+
+def decode_cache_record(item: dict) -> typing.Optional[typing.Any]:
+    """
+    :param item: nutrition_cache row of any format
+    :return: food_dict or food, None if the row has no food
+    """
+    if 'data' in item:
+        return json.loads(zlib.decompress(item['data']['B']).decode('utf-8'))
+    if 'response' in item:
+        return json.loads(item['response']['S'])
+    return None
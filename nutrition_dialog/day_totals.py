@@ -0,0 +1,86 @@
+import typing
+
+# Running totals of the day are kept in the row of the whole day of
+# nutrition_users (id, date='2019-05-12'), next to the rows of meals. They
+# are changed with ADD in the same transaction the meal is saved or deleted,
+# so "сколько я съел" doesn't have to sum all the foods again
+
+# total name -> field of Nutritionix food
+nutrients_by_total = {
+    'total_calories': 'nf_calories',
+    'total_protein': 'nf_protein',
+    'total_fat': 'nf_total_fat',
+    'total_carbohydrates': 'nf_total_carbohydrate',
+    'total_sugar': 'nf_sugars',
+}
+meals_count = 'meals_count'
+totals_attributes = tuple(nutrients_by_total) + (meals_count,)
+
+# Rows of whole days with totals also have totals_date, the same as their
+# date. Rows of meals don't, so the sparse global secondary index
+# totals_index of nutrition_users (partition id, sort totals_date,
+# projection INCLUDE totals_attributes) has only the rows with totals, and
+# a Query of it reads nothing else
+totals_date = 'totals_date'
+totals_index = 'totals_by_date'
+
+
+def meal_totals(meal: dict) -> typing.Dict[str, float]:
+    """
+    :param meal: {'time': ..., 'foods': food_dict, 'utterance': ...}
+    :return: {'total_calories': 120.5, ..., 'meals_count': 1}
+    """
+    totals = {name: 0.0 for name in nutrients_by_total}
+    totals[meals_count] = 1
+    foods = meal.get('foods') or {}
+    for food in foods.get('foods') or []:
+        for name, nutrient in nutrients_by_total.items():
+            totals[name] += food.get(nutrient, 0) or 0
+    return totals
+
+
+def sum_totals(
+        totals_list: typing.Iterable[typing.Dict[str, float]],
+) -> typing.Dict[str, float]:
+    result = {name: 0.0 for name in nutrients_by_total}
+    result[meals_count] = 0
+    for totals in totals_list:
+        for name in totals_attributes:
+            result[name] += totals.get(name, 0)
+    return result
+
+
+def add_totals_expression(
+        totals: typing.Dict[str, float],
+        *,
+        sign: int,
+        date: str,
+        also_set: typing.Sequence[str] = (),
+) -> typing.Tuple[str, typing.Dict[str, dict]]:
+    """
+    :param totals: see meal_totals
+    :param sign: 1 when meals are saved, -1 when deleted
+    :param date: of the row of the day, '2019-05-12'
+    :param also_set: other actions of SET, '#value = :value'
+    :return: ('SET totals_date = :totals_date ADD total_calories
+    :total_calories, ...', values)
+    """
+    sets = ', '.join((f'{totals_date} = :{totals_date}',) + tuple(also_set))
+    expression = f'SET {sets} ADD ' + ', '.join(
+        f'{n} :{n}' for n in totals_attributes)
+    # + 0 not to send -0.0
+    values = {f':{n}': {'N': repr(sign * totals.get(n, 0) + 0)}
+              for n in totals_attributes}
+    values[f':{totals_date}'] = {'S': date}
+    return expression, values
+
+
+def totals_from_item(item: dict) -> typing.Optional[typing.Dict[str, float]]:
+    """
+    :param item: row of the whole day
+    :return: None if the totals were never saved in the row
+    """
+    if meals_count not in item:
+        return None
+    return {name: round(float(item[name]['N']), 6) if name in item else 0.0
+            for name in totals_attributes}
@@ -1,20 +1,56 @@
+import concurrent.futures
+import copy
 import datetime
 import json
+import os
+import time
+import uuid
 from decorators import timeit
 from botocore.vendored.requests.exceptions import ReadTimeout, ConnectTimeout
 import botocore.client
 import boto3
 import typing
+from storage_backends import create_storage
 from DialogContext import DialogContext
-from dataclasses import replace
+from PrefetchedItems import PrefetchedItems
+from LruCache import LruCache
+from cache_keys import canonical_cache_key
+from cache_records import compact_food, compact_food_dict, \
+    encode_cache_record, decode_cache_record
+import io_pipeline
+import write_behind
+from request_metrics import MeteredClient, count
+from day_totals import meal_totals, sum_totals, add_totals_expression, \
+    totals_from_item
 
 
 # This cache is useful because AWS lambda can keep it's state, so no
 # need to restantiate connections again. It is used in get_boto3_client
 # function, I know it is a mess, but 100 ms are 100 ms
 from yandex_types import YandexResponse, YandexRequest
+from Deadline import Deadline, no_deadline
 
 global_client = None
+database_timeout = 0.6  # connect_timeout + read_timeout of get_dynamo_client
+
+# L1 in front of nutrition_cache table, kept between lambda calls. Holds
+# already parsed food_dicts. '_key' row lives shorter, so changed keys are
+# picked up soon (their usages are in key_scheduler)
+food_cache_l1 = LruCache(
+    max_items=int(os.getenv('FoodCacheSize', '1000')),
+    ttl_seconds=float(os.getenv('FoodCacheTtl', '3600')),
+)
+api_keys_ttl_seconds = 300
+
+# Rows of nutrition_sessions are removed by DynamoDB TTL on this attribute
+# (see enable_sessions_ttl), a session doesn't need its row for longer
+session_ttl_attribute = 'expires_at'
+session_ttl_seconds = int(os.getenv('SessionTtl', '3600'))
+# session id -> (message_id, whether the row is stored) after the message
+# was handled by this container. Alice sends messages of a session one by
+# one, so if the previous one was handled here, the row is known without
+# reading it
+session_rows_l1 = LruCache(max_items=1000, ttl_seconds=session_ttl_seconds)
 
 
 def get_dynamo_client(
@@ -24,12 +60,24 @@ def get_dynamo_client(
         connect_timeout: float = 0.2,
         read_timeout: float = 0.4,
 ) -> boto3.client:
+    """
+    Client of DynamoDB or of the storage set by StorageBackend environment
+    variable: 'memory' or 'sqlite' (file SqliteDatabase), see
+    storage_backends. They take the same calls, so the skill can be run and
+    load tested without AWS
+    """
     global global_client
 
     if global_client:
         # print('Dynamo client fetched from CACHE!')
         return global_client
-    if lambda_mode:
+    backend = os.getenv('StorageBackend', 'dynamodb')
+    if backend != 'dynamodb':
+        new_client = create_storage(
+            backend,
+            sqlite_path=os.getenv('SqliteDatabase', '/tmp/nutrition.sqlite3'),
+        )
+    elif lambda_mode:
         new_client = boto3.client(
                 'dynamodb',
                 config=botocore.client.Config(
@@ -45,10 +93,23 @@ def get_dynamo_client(
         # return new_client
 
     # saving to cache to to spend time to create it next time
-    global_client = new_client
+    global_client = MeteredClient(new_client)
     return global_client
 
 
+def meal_sort_key(event_time: datetime.datetime) -> str:
+    """
+    Every saved meal is a separate row of nutrition_users, date of which
+    starts with the day, so all the meals of the day are read with one
+    Query by begins_with. Rows of the whole day saved before that have
+    just the day as date and are read by the same Query
+    :param event_time:
+    :return: '2019-05-12#13:45:01.123456#1f2e3d4c'
+    """
+    return f'{event_time.date()}#{event_time.strftime("%H:%M:%S.%f")}#' \
+        f'{uuid.uuid4().hex[:8]}'
+
+
 @timeit
 def update_user_table(
         *,
@@ -56,32 +117,53 @@ def update_user_table(
         event_time: datetime.datetime,
         foods_dict: dict,
         utterance: str,
-        user_id: str):
+        user_id: str,
+        prefetched: typing.Optional[PrefetchedItems] = None,
+        deadline: Deadline = no_deadline):
+    """
+    Saves one meal with a single write of constant size, nothing is read.
+    Two meals saved at the same time don't overwrite each other. The write
+    is not started if the deadline is exceeded, but once started it is not
+    abandoned: the user would not know whether the meal was saved
+    """
+    deadline.check('saving food')
     print(f'Saving food for user: "{utterance}"')
     database_client = get_dynamo_client(lambda_mode=lambda_mode)
-    result = database_client.get_item(
-            TableName='nutrition_users',
-            Key={'id': {'S': user_id}, 'date': {'S': str(event_time.date())}})
-    item_to_save = []
-    if 'Item' in result:
-        item_to_save = json.loads(result['Item']['value']['S'])
-    item_to_save.append({
+    date = str(event_time.date())
+    sort_key = meal_sort_key(event_time)
+    meal = {
         'time': event_time.strftime('%Y-%m-%d %H:%M:%S'),
         'foods': foods_dict,
-        'utterance': utterance})
+        'utterance': utterance}
+    totals_expression, totals_values = add_totals_expression(
+        meal_totals(meal), sign=1, date=date)
     try:
-        database_client.put_item(TableName='nutrition_users',
-                                 Item={
-                                     'id': {
-                                         'S': user_id,
-                                     },
-                                     'date': {'S': str(event_time.date())},
-                                     'value': {
-                                         'S': json.dumps(item_to_save),
-                                     }})
+        # Meal and totals of the day are saved together or not at all
+        database_client.transact_write_items(TransactItems=[
+            {'Put': {
+                'TableName': 'nutrition_users',
+                'Item': {
+                    'id': {'S': user_id},
+                    'date': {'S': sort_key},
+                    'meal': {'S': json.dumps(meal)},
+                }}},
+            {'Update': {
+                'TableName': 'nutrition_users',
+                'Key': {'id': {'S': user_id}, 'date': {'S': date}},
+                'UpdateExpression': totals_expression,
+                'ExpressionAttributeValues': totals_values,
+            }},
+        ])
 
     except (ReadTimeout, ConnectTimeout):
-        pass
+        return
+    if prefetched is not None and date in prefetched.user_days:
+        prefetched.user_days[date] = prefetched.user_days[date] + [meal]
+        prefetched.user_day_keys[date] = \
+            prefetched.user_day_keys[date] + [sort_key]
+        prefetched.user_day_totals[date] = sum_totals((
+            prefetched.user_day_totals.get(date) or {},
+            meal_totals(meal)))
 
 
 @timeit
@@ -93,10 +175,9 @@ def save_session(
         utterance: str,
         lambda_mode: bool,
 ) -> None:
-    database_client = get_dynamo_client(lambda_mode=lambda_mode)
-    database_client.put_item(
-            TableName='nutrition_sessions',
-            Item={
+    write_behind.put_item(
+            table='nutrition_sessions',
+            item={
                 'id': {
                     'S': session_id,
                 },
@@ -105,96 +186,520 @@ def save_session(
                         'time': event_time.strftime('%Y-%m-%d %H:%M:%S'),
                         'foods': foods_dict,
                         'utterance': utterance}),
-                }})
+                },
+                **session_expiry(),
+            },
+            deferrable=False,
+    )
+
+
+def session_expiry() -> dict:
+    """
+    :return: TTL attribute of nutrition_sessions row saved now
+    """
+    return {session_ttl_attribute: {
+        'N': str(int(time.time()) + session_ttl_seconds)}}
+
+
+def session_item_expired(item: dict) -> bool:
+    """
+    DynamoDB deletes expired rows not at once, until then they are ignored
+    """
+    return session_ttl_attribute in item and \
+        float(item[session_ttl_attribute]['N']) < time.time()
 
 
 @timeit
 def write_to_cache_table(
         *,
         yandex_response: YandexResponse) -> None:
-    database_client = get_dynamo_client(
-        lambda_mode=yandex_response.initial_request.aws_lambda_mode)
-    initial_phrase = yandex_response.initial_request.original_utterance
-    nutrition_dict = yandex_response.initial_request.food_dict
-    keys_dict = yandex_response.initial_request.api_keys
+    # The same key as get_from_cache_table reads
+    initial_phrase = canonical_cache_key(
+        yandex_response.initial_request.command)
+    nutrition_dict = compact_food_dict(
+        yandex_response.initial_request.food_dict)
     print(f'Saving into cache table nutrients for the following: '
           f'{initial_phrase}')
-    database_client.put_item(TableName='nutrition_cache',
-                             Item={
-                                 'initial_phrase': {
-                                     'S': initial_phrase,
-                                 },
-                                 'response': {
-                                     'S': json.dumps(nutrition_dict),
-                                 }})
-    if keys_dict:  # Only if we have updated key dict. NOT to overwrite with
-        # empty dict
-        database_client.put_item(TableName='nutrition_cache',
-                                 Item={
-                                     'initial_phrase': {
-                                         'S': '_key',
-                                     },
-                                     'response': {
-                                         'S': json.dumps(keys_dict),
-                                     }})
-
-
-def write_keys_to_cache_table(*, keys_dict: dict, lambda_mode: bool):
-    if not keys_dict:
-        return
+    put_into_food_cache_l1(
+        phrase=initial_phrase,
+        food_dict=nutrition_dict,
+    )
+    write_behind.put_item(table='nutrition_cache',
+                          item={
+                              'initial_phrase': {
+                                  'S': initial_phrase,
+                              },
+                              **encode_cache_record(nutrition_dict),
+                          },
+                          deferrable=True)
+
+
+@timeit
+def get_food_items_from_cache_table(
+        *,
+        item_keys: typing.List[str],
+        lambda_mode: bool,
+        deadline: Deadline = no_deadline,
+) -> typing.Dict[str, dict]:
+    """
+    Nutrients of single foods saved by write_food_items_to_cache_table
+    :param item_keys: keys of food_items.split_into_food_items
+    :param lambda_mode:
+    :param deadline: of the request
+    :return: key -> food (one element of food_dict['foods'])
+    """
+    found = {}
+    keys_to_read = []
+    for key in dict.fromkeys(item_keys):
+        food = food_cache_l1.get(key)
+        if food is not None:
+            found[key] = copy.deepcopy(food)
+        else:
+            keys_to_read.append(key)
+    if not keys_to_read:
+        return found
+
     database_client = get_dynamo_client(lambda_mode=lambda_mode)
-    database_client.put_item(TableName='nutrition_cache',
-                             Item={
-                                 'initial_phrase': {
-                                     'S': '_key',
-                                 },
-                                 'response': {
-                                     'S': json.dumps(keys_dict),
-                                 }})
+    try:
+        result = deadline.call(
+            database_timeout,
+            database_client.batch_get_item,
+            RequestItems={'nutrition_cache': {
+                'Keys': [{'initial_phrase': {'S': k}} for k in keys_to_read]
+            }})
+    except (ConnectTimeout, ReadTimeout):
+        print('Timeout during food items cache request')
+        return found
+    for item in result.get('Responses', {}).get('nutrition_cache', []):
+        food = decode_cache_record(item)
+        food_cache_l1.put(item['initial_phrase']['S'], food)
+        found[item['initial_phrase']['S']] = copy.deepcopy(food)
+    return found
+
+
+def write_food_items_to_cache_table(
+        *,
+        items: typing.Dict[str, dict],
+        lambda_mode: bool,
+) -> None:
+    """
+    :param items: key -> food (one element of food_dict['foods'])
+    :param lambda_mode:
+    """
+    items = {key: compact_food(food) for key, food in items.items()}
+    for key, food in items.items():
+        food_cache_l1.put(key, food)
+        write_behind.put_item(
+            table='nutrition_cache',
+            item={'initial_phrase': {'S': key}, **encode_cache_record(food)},
+            deferrable=True,
+        )
+
+
+def translation_cache_key(phrase: str) -> str:
+    # Translations are kept in the same table as foods, '_' prefix the same
+    # as for '_key' row, so they don't clash with phrases
+    return f'_translation_{phrase}'
+
+
+@timeit
+def get_translation_from_cache_table(
+        *,
+        phrase: str,
+        lambda_mode: bool,
+        deadline: Deadline = no_deadline,
+) -> typing.Optional[str]:
+    database_client = get_dynamo_client(lambda_mode=lambda_mode)
+    try:
+        result = deadline.call(
+            database_timeout,
+            database_client.get_item,
+            TableName='nutrition_cache',
+            Key={'initial_phrase': {'S': translation_cache_key(phrase)}},
+        )
+    except (ConnectTimeout, ReadTimeout):
+        print('Timeout during translation cache request')
+        return None
+    if 'Item' not in result:
+        return None
+    return result['Item']['translation']['S']
+
+
+def write_translation_to_cache_table(
+        *,
+        phrase: str,
+        translation: str,
+        lambda_mode: bool,
+) -> None:
+    write_behind.put_item(table='nutrition_cache',
+                          item={
+                              'initial_phrase': {
+                                  'S': translation_cache_key(phrase),
+                              },
+                              'translation': {
+                                  'S': translation,
+                              }},
+                          deferrable=True)
+
+
+def food_cache_keys_to_read(
+        phrase: str,
+        *,
+        read_api_keys: bool,
+) -> typing.List[dict]:
+    """
+    Rows are saved under canonical key, the ones written before that are
+    still read by the phrase itself until migrate_cache_keys is run
+    :param phrase: command of the request
+    :param read_api_keys: whether '_key' row is needed
+    :return: Keys for batch_get_item
+    """
+    cache_keys = [canonical_cache_key(phrase)]
+    if phrase not in cache_keys:
+        cache_keys.append(phrase)
+    if read_api_keys:
+        cache_keys.append('_key')
+    return [{'initial_phrase': {'S': k}} for k in cache_keys]
+
+
+def food_cache_from_items(
+        items: typing.List[dict],
+        *,
+        phrase: str,
+) -> typing.Tuple[dict, typing.Optional[dict]]:
+    """
+    :param items: nutrition_cache rows
+    :param phrase: command of the request
+    :return: (food_dict, keys_dict), keys_dict is None if not in items
+    """
+    rows = {i['initial_phrase']['S']: i for i in items}
+    food_row = rows.get(canonical_cache_key(phrase)) or rows.get(phrase)
+    food_dict = (decode_cache_record(food_row) if food_row else None) or {}
+    keys_dict = decode_cache_record(rows['_key']) if '_key' in rows else None
+    for key in (keys_dict or {}).get('keys', []):
+        # Usages kept here before key_scheduler, not needed anymore
+        key.pop('dates', None)
+    return food_dict, keys_dict
+
+
+def food_cache_from_l1(phrase: str) -> typing.Tuple[
+        typing.Optional[dict], typing.Optional[dict]]:
+    """
+    Copies are returned, because food_dict and keys_dict are changed by
+    the intents
+    :param phrase:
+    :return: (food_dict, keys_dict), None for what is not in L1
+    """
+    return copy.deepcopy(food_cache_l1.get(canonical_cache_key(phrase))), \
+        copy.deepcopy(food_cache_l1.get('_key'))
+
+
+def food_in_l1(phrase: str) -> bool:
+    """
+    Like food_cache_from_l1, but nothing is copied
+    """
+    return food_cache_l1.get(canonical_cache_key(phrase)) is not None
+
+
+def put_into_food_cache_l1(
+        *,
+        phrase: typing.Optional[str] = None,
+        food_dict: typing.Optional[dict] = None,
+        keys_dict: typing.Optional[dict] = None,
+) -> None:
+    # Phrases not found in the table are not remembered: they are likely to
+    # be written soon by this or another container
+    if phrase and food_dict:
+        food_cache_l1.put(
+            canonical_cache_key(phrase),
+            compact_food_dict(food_dict),
+        )
+    if keys_dict:
+        food_cache_l1.put(
+            '_key',
+            copy.deepcopy(keys_dict),
+            ttl_seconds=api_keys_ttl_seconds,
+        )
 
 
 @timeit
 def get_from_cache_table(*, yandex_requext: YandexRequest) -> YandexRequest:
-    keys_dict = {}
-    food_dict = {}
     if not yandex_requext.command:
         print('Empty Yandex command passed, nothing to search')
-        yandex_requext = replace(yandex_requext, error='Empty Yandex request')
+        yandex_requext = yandex_requext.replace(error='Empty Yandex request')
         return yandex_requext
+    prefetched = yandex_requext.prefetched
+    if yandex_requext.command in prefetched.food_cache and \
+            prefetched.api_keys is not None:
+        print(f'"{yandex_requext.command}" was prefetched from cache table')
+        count('phrase_cache.prefetched'
+              if prefetched.food_cache[yandex_requext.command]
+              else 'phrase_cache.prefetched_miss')
+        return apply_food_cache_item(
+            yandex_request=yandex_requext,
+            food_dict=prefetched.food_cache[yandex_requext.command],
+            keys_dict=prefetched.api_keys,
+        )
+    food_dict, l1_keys_dict = food_cache_from_l1(yandex_requext.command)
+    if food_dict:  # keys are not needed if the food is known
+        print(f'"{yandex_requext.command}" found in memory cache')
+        count('phrase_cache.l1')
+        return apply_food_cache_item(
+            yandex_request=yandex_requext,
+            food_dict=food_dict,
+            keys_dict={},
+        )
+    keys_to_read = food_cache_keys_to_read(
+        yandex_requext.command,
+        read_api_keys=l1_keys_dict is None,
+    )
     try:
         print(f'Searching for "{yandex_requext.command}" in cache table')
         database_client = get_dynamo_client(
                 lambda_mode=yandex_requext.aws_lambda_mode)
-        items = database_client.batch_get_item(
-                RequestItems={
-                    'nutrition_cache': {
-                        'Keys': [
-                            {
-                                'initial_phrase': {
-                                    'S': '_key'},
-                            },
-                            {
-                                'initial_phrase': {
-                                    'S': yandex_requext.command},
-                            }
-                        ]}})
+        items = yandex_requext.deadline.call(
+            database_timeout,
+            database_client.batch_get_item,
+            RequestItems={'nutrition_cache': {'Keys': keys_to_read}},
+        )
     except (ConnectTimeout, ReadTimeout):
         print('Timeout during Food Cache table request')
+        count('phrase_cache.timeout')
         return yandex_requext
 
-    for item in items['Responses']['nutrition_cache']:
-        if item['initial_phrase']['S'] == '_key':
-            keys_dict = json.loads(item['response']['S'])
-        if item['initial_phrase']['S'] == yandex_requext.command:
-            food_dict = json.loads(item['response']['S'])
+    food_dict, keys_dict = food_cache_from_items(
+        items['Responses']['nutrition_cache'],
+        phrase=yandex_requext.command,
+    )
+    if l1_keys_dict is not None:
+        keys_dict = l1_keys_dict
+    keys_dict = keys_dict or {}
+    count('phrase_cache.l2' if food_dict else 'phrase_cache.miss')
+    put_into_food_cache_l1(
+        phrase=yandex_requext.command,
+        food_dict=food_dict,
+        keys_dict=keys_dict if l1_keys_dict is None else None,
+    )
+
+    return apply_food_cache_item(
+        yandex_request=yandex_requext,
+        food_dict=food_dict,
+        keys_dict=keys_dict,
+    )
+
+
+def apply_food_cache_item(
+        *,
+        yandex_request: YandexRequest,
+        food_dict: dict,
+        keys_dict: dict,
+) -> YandexRequest:
     if food_dict and ('foods' in food_dict or 'message' in food_dict):
-        print(f'"{yandex_requext.command}" FOUND in cache!')
-        yandex_requext = yandex_requext.set_food_dict(food_dict=food_dict)
-        yandex_requext = yandex_requext.set_food_already_in_cache()
+        print(f'"{yandex_request.command}" FOUND in cache!')
+        yandex_request = yandex_request.set_food_dict(food_dict=food_dict)
+        yandex_request = yandex_request.set_food_already_in_cache()
     else:
-        yandex_requext = yandex_requext.set_api_keys(keys_dict)
+        yandex_request = yandex_request.set_api_keys(keys_dict)
 
-    return yandex_requext
+    return yandex_request
+
+
+@timeit
+def prefetch_request_items(
+        *,
+        yandex_request: YandexRequest,
+        read_context: bool,
+        read_food_cache: bool,
+        read_user_day: bool,
+) -> YandexRequest:
+    """
+    Loads everything the request might need (session context, cached food
+    with API keys, today's foods of the user) with one batch_get_item
+    across the tables instead of a separate request for each of them.
+    Results are memoized in yandex_request.prefetched, whatever was not
+    loaded (timeout, unprocessed keys) will be requested later as usual
+    :param yandex_request:
+    :param read_context: nutrition_sessions row
+    :param read_food_cache: phrase and '_key' rows of nutrition_cache
+    :param read_user_day: today's meals from nutrition_users
+    :return:
+    """
+    prefetched = yandex_request.prefetched
+    if prefetched.attempted:
+        return yandex_request
+    prefetched.attempted = True
+
+    read_food_cache = read_food_cache and bool(yandex_request.command) and \
+        yandex_request.use_food_cache
+    today = str(datetime.datetime.now().date())
+    request_items = {}
+    if read_context and prefetched.context_stored is False:
+        set_empty_context(prefetched)
+        read_context = False
+    if read_context:
+        request_items['nutrition_sessions'] = {
+            'Keys': [{'id': {'S': yandex_request.session_id}}]}
+    l1_keys_dict = None
+    if read_food_cache:
+        l1_food_dict, l1_keys_dict = food_cache_from_l1(
+            yandex_request.command)
+        if l1_food_dict:
+            print(f'"{yandex_request.command}" found in memory cache')
+            prefetched.food_cache[yandex_request.command] = l1_food_dict
+            prefetched.api_keys = l1_keys_dict or {}
+            read_food_cache = False
+    if read_food_cache:
+        request_items['nutrition_cache'] = {
+            'Keys': food_cache_keys_to_read(
+                yandex_request.command,
+                read_api_keys=l1_keys_dict is None,
+            )}
+    user_day_future = None
+    if read_user_day:
+        # Meals are read by Query, which can't be a part of batch, so it
+        # goes in parallel
+        user_day_future = io_pipeline.submit(
+            query_user_day,
+            date=today,
+            user_id=yandex_request.user_guid,
+            lambda_mode=yandex_request.aws_lambda_mode,
+            prefetched=prefetched,
+            deadline=yandex_request.deadline,
+        )
+    deadline = yandex_request.deadline
+    if not request_items:
+        wait_for_user_day(user_day_future, deadline=deadline)
+        return yandex_request
+
+    try:
+        database_client = get_dynamo_client(
+                lambda_mode=yandex_request.aws_lambda_mode)
+        result = deadline.call(
+            database_timeout,
+            database_client.batch_get_item,
+            RequestItems=request_items,
+        )
+    except (ConnectTimeout, ReadTimeout):
+        print('Timeout during prefetch request')
+        if read_context:
+            # Not to wait for the same timeout again in every intent
+            prefetched.context_status = 'timeout'
+        wait_for_user_day(user_day_future, deadline=deadline)
+        return yandex_request
+
+    unprocessed = result.get('UnprocessedKeys') or {}
+    responses = result.get('Responses', {})
+    if read_context and 'nutrition_sessions' not in unprocessed:
+        items = responses.get('nutrition_sessions', [])
+        prefetched.context = context_from_session_item(
+            items[0] if items else None)
+        prefetched.context_status = 'hit' if items and \
+            not session_item_expired(items[0]) else 'miss'
+        prefetched.context_stored = prefetched.context_status == 'hit'
+        yandex_request = yandex_request.set_context(prefetched.context)
+
+    if read_food_cache and 'nutrition_cache' not in unprocessed:
+        food_dict, keys_dict = food_cache_from_items(
+            responses.get('nutrition_cache', []),
+            phrase=yandex_request.command,
+        )
+        if l1_keys_dict is not None:
+            keys_dict = l1_keys_dict
+        keys_dict = keys_dict or {}
+        put_into_food_cache_l1(
+            phrase=yandex_request.command,
+            food_dict=food_dict,
+            keys_dict=keys_dict if l1_keys_dict is None else None,
+        )
+        prefetched.food_cache[yandex_request.command] = food_dict
+        prefetched.api_keys = keys_dict
+
+    wait_for_user_day(user_day_future, deadline=deadline)
+    return yandex_request
+
+
+def wait_for_user_day(
+        user_day_future: typing.Optional[concurrent.futures.Future],
+        *,
+        deadline: Deadline,
+) -> None:
+    """
+    query_user_day saves the day into prefetched itself, here we only wait
+    for it
+    """
+    if user_day_future is None:
+        return
+    try:
+        deadline.wait(user_day_future, stage='user day')
+    except (ConnectTimeout, ReadTimeout):
+        print('Timeout during user day prefetch')
+
+
+def load_context(*, yandex_request: YandexRequest) -> YandexRequest:
+    """
+    Request-scoped accessor of the session context. nutrition_sessions is
+    read at most once per request (or not at all if the context was
+    prefetched), all the intents get the same DialogContext. Whether it was
+    a hit, a miss or a timeout is kept in prefetched.context_status
+    :param yandex_request:
+    :return: request with context set (None if loading timed out)
+    """
+    prefetched = yandex_request.prefetched
+    if not prefetched.context_status and prefetched.context_stored is False:
+        set_empty_context(prefetched)
+    if not prefetched.context_status:
+        context = fetch_context_from_dynamo_database(
+            session_id=yandex_request.session_id,
+            lambda_mode=yandex_request.aws_lambda_mode,
+            deadline=yandex_request.deadline,
+        )
+        if context is None:
+            prefetched.context_status = 'timeout'
+        elif context.intent_originator_name == 'Empty context':
+            prefetched.context_status = 'miss'
+        else:
+            prefetched.context_status = 'hit'
+        prefetched.context = context
+        if context is not None:
+            prefetched.context_stored = prefetched.context_status == 'hit'
+        print(f'Context loaded: {prefetched.context_status}')
+
+    if yandex_request.context is prefetched.context:
+        return yandex_request
+    return yandex_request.set_context(prefetched.context)
+
+
+def set_empty_context(prefetched: PrefetchedItems) -> None:
+    print('No context stored for the session, not reading it')
+    prefetched.context = DialogContext.empty_context()
+    prefetched.context_status = 'miss'
+
+
+def known_context_stored(
+        *,
+        session_id: str,
+        message_id: int,
+) -> typing.Optional[bool]:
+    """
+    :return: whether nutrition_sessions row of the session exists, None if
+    unknown
+    """
+    previous = session_rows_l1.get(session_id)
+    if previous is None or previous[0] != message_id - 1:
+        return None  # the previous message went to another container
+    return previous[1]
+
+
+def remember_context_stored(
+        *,
+        session_id: str,
+        message_id: int,
+        stored: typing.Optional[bool],
+) -> None:
+    if stored is None:
+        session_rows_l1.delete(session_id)
+    else:
+        session_rows_l1.put(session_id, (message_id, stored))
 
 
 @timeit
@@ -202,23 +707,41 @@ def fetch_context_from_dynamo_database(
         *,
         session_id: str,
         lambda_mode: bool,
+        deadline: Deadline = no_deadline,
 ) -> typing.Optional[DialogContext]:
     database_client = get_dynamo_client(lambda_mode=lambda_mode)
     try:
-        result = database_client.get_item(
-                TableName='nutrition_sessions',
-                Key={'id': {'S': session_id}})
+        result = deadline.call(
+            database_timeout,
+            database_client.get_item,
+            TableName='nutrition_sessions',
+            Key={'id': {'S': session_id}},
+        )
 
     except (ConnectTimeout, ReadTimeout):
         print('Timeout when tried to load context')
         return None
 
-    if 'Item' not in result:
+    return context_from_session_item(result.get('Item'))
+
+
+def context_from_session_item(
+        item: typing.Optional[dict],
+) -> DialogContext:
+    """
+    Converts nutrition_sessions row into DialogContext
+    :param item: row or None if not found
+    :return:
+    """
+    if item is None:
         print('No context found')
         return DialogContext.empty_context()
+    elif session_item_expired(item):
+        print('Context expired')
+        return DialogContext.empty_context()
     else:
         try:
-            json_dict = json.loads(result['Item']['value']['S'])
+            json_dict = json.loads(item['value']['S'])
             food_data = json_dict.get('foods', {})
             intent_originator_name = json_dict.get(
                     'intent_originator_name',
@@ -253,11 +776,9 @@ def save_context(
         table_name: str = 'nutrition_sessions',
         event_time: datetime.datetime = datetime.datetime.now()
 ) -> YandexResponse:
-    client = get_dynamo_client(
-        lambda_mode=response.initial_request.aws_lambda_mode)
-    client.put_item(
-            TableName=table_name,
-            Item={
+    write_behind.put_item(
+            table=table_name,
+            item={
                 'id': {
                     'S': response.initial_request.session_id,
                 },
@@ -274,7 +795,12 @@ def save_context(
                         'matching_intents_names':
                             response.context_to_write.matching_intents_names,
                     }),
-                }})
+                },
+                **session_expiry(),
+            },
+            deferrable=False,
+    )
+    response.initial_request.prefetched.context_stored = True
     return response
 
 
@@ -284,15 +810,12 @@ def clear_context(
         session_id: str,
         lambda_mode: bool,
 ) -> None:
-    database_client = get_dynamo_client(lambda_mode=lambda_mode)
-    try:
-        database_client.delete_item(TableName='nutrition_sessions',
-                                    Key={
-                                        'id': {
-                                            'S': session_id,
-                                        }, })
-    except (ReadTimeout, ConnectTimeout):
-        pass
+    write_behind.delete_item(table='nutrition_sessions',
+                             key={
+                                 'id': {
+                                     'S': session_id,
+                                 }, },
+                             deferrable=False)
 
 
 @timeit
@@ -304,46 +827,229 @@ def delete_food(*,
                 # that exist in database
                 user_id: str,
                 lambda_mode: bool,
-                ) -> str:
+                prefetched: typing.Optional[PrefetchedItems] = None,
+                deadline: Deadline = no_deadline,
+                ) -> None:
+    """
+    Deletes rows of the meals. If both lists are empty, all the food of the
+    day is deleted. Meals saved in the row of the whole day (before every
+    meal got its own row) are deleted by rewriting that row. Rows are
+    deleted only if they still exist, so a meal deleted by two requests at
+    once is subtracted from the totals once
+    """
+    if prefetched is None:
+        prefetched = PrefetchedItems()
+    database_client = get_dynamo_client(lambda_mode=lambda_mode)
+    delete_all = not list_of_food_to_delete_dicts and \
+        not list_of_all_food_dicts
+    meals, sort_keys = query_user_day(
+        date=date,
+        user_id=user_id,
+        lambda_mode=lambda_mode,
+        prefetched=prefetched,
+        deadline=deadline,
+    )
+
+    kept_meals = []
+    kept_keys = []
+    deleted_meals = []
+    keys_to_delete = []
+    day_row_meals = []
+    day_row_changed = False
+    for meal, sort_key in zip(meals, sort_keys):
+        should_delete = delete_all or meal in list_of_food_to_delete_dicts
+        if sort_key == str(date):
+            day_row_changed = day_row_changed or should_delete
+            if not should_delete:
+                day_row_meals.append(meal)
+        elif should_delete:
+            keys_to_delete.append(sort_key)
+        if should_delete:
+            deleted_meals.append((meal, sort_key))
+        else:
+            kept_meals.append(meal)
+            kept_keys.append(sort_key)
+    if not deleted_meals:
+        return
+    # Meals of the row of the whole day were never added to the totals by
+    # update_user_table, they are there only if repair_day_totals counted
+    # them, then the totals match all the meals
+    totals = prefetched.user_day_totals.get(str(date))
+    legacy_in_totals = totals is not None and \
+        totals['meals_count'] == len(meals)
+
+    # Transaction is limited by 100 items, one of them is the day row
+    day_key = {'id': {'S': user_id}, 'date': {'S': str(date)}}
+    chunk_size = 99
+    for start in range(0, len(deleted_meals), chunk_size):
+        chunk = deleted_meals[start:start + chunk_size]
+        # Meals saved in the row of the whole day before
+        rewrite_day_row = day_row_changed and start == 0
+        totals_expression, values = add_totals_expression(
+            sum_totals(meal_totals(m) for m, k in chunk
+                       if k != str(date) or legacy_in_totals),
+            sign=-1,
+            date=str(date),
+            also_set=('#value = :value',) if rewrite_day_row else (),
+        )
+        day_row_update = {
+            'TableName': 'nutrition_users',
+            'Key': day_key,
+            'UpdateExpression': totals_expression,
+            'ExpressionAttributeValues': values,
+        }
+        if rewrite_day_row:
+            day_row_update['ExpressionAttributeNames'] = {'#value': 'value'}
+            values[':value'] = {'S': json.dumps(day_row_meals)}
+        try:
+            database_client.transact_write_items(TransactItems=[
+                {'Update': day_row_update},
+                *[{'Delete': {
+                    'TableName': 'nutrition_users',
+                    'Key': {'id': {'S': user_id}, 'date': {'S': k}},
+                    'ConditionExpression': 'attribute_exists(meal)',
+                }} for _, k in chunk if k != str(date)],
+            ])
+        except database_client.exceptions.TransactionCanceledException:
+            # Another request deleted some of the meals first
+            print(f'Meals of {date} were changed meanwhile, not deleted')
+            count('delete_food.conflict')
+            prefetched.user_days.pop(str(date), None)
+            prefetched.user_day_keys.pop(str(date), None)
+            prefetched.user_day_totals.pop(str(date), None)
+            return
+
+    prefetched.user_days[str(date)] = kept_meals
+    prefetched.user_day_keys[str(date)] = kept_keys
+    prefetched.user_day_totals.pop(str(date), None)
+
+
+def query_user_day(
+        *,
+        date: typing.Union[datetime.date, str],
+        user_id: str,
+        lambda_mode: bool,
+        prefetched: typing.Optional[PrefetchedItems] = None,
+        deadline: Deadline = no_deadline,
+) -> typing.Tuple[typing.List[dict], typing.List[str]]:
+    """
+    All meals saved by the user for the date with one Query: the row of
+    the whole day (old format) and rows of separate meals, see
+    meal_sort_key. Taken from prefetched items if the day was already
+    loaded during the request
+    :return: (meals, date key of the row of every meal)
+    """
+    date = str(date)
+    if prefetched is not None and date in prefetched.user_days:
+        return prefetched.user_days[date], prefetched.user_day_keys[date]
 
     database_client = get_dynamo_client(lambda_mode=lambda_mode)
-    # Filtering list of existing food leaving only food that NOT
-    # specified in list_of_food_to_delete_dicts
-    result_list = [d for d in list_of_all_food_dicts if
-                   d not in list_of_food_to_delete_dicts]
-
-    # Saving new food list
-    result = database_client.put_item(TableName='nutrition_users',
-                                      Item={
-                                          'id': {
-                                              'S': user_id,
-                                          },
-                                          'date': {'S': str(date)},
-                                          'value': {
-                                              'S': json.dumps(result_list),
-                                          }})
-    return result
+    query_kwargs = {
+        'TableName': 'nutrition_users',
+        'KeyConditionExpression': '#id = :id AND begins_with(#date, :date)',
+        'ExpressionAttributeNames': {'#id': 'id', '#date': 'date'},
+        'ExpressionAttributeValues': {
+            ':id': {'S': user_id},
+            ':date': {'S': date},
+        },
+    }
+    meals = []
+    sort_keys = []
+    totals = None
+    while True:
+        result = deadline.call(
+            database_timeout,
+            database_client.query,
+            **query_kwargs,
+        )
+        for item in result.get('Items', []):
+            if item['date']['S'] == date:
+                totals = totals_from_item(item)
+            if 'meal' in item:
+                row_meals = [json.loads(item['meal']['S'])]
+            elif 'value' in item:
+                row_meals = json.loads(item['value']['S'])
+            else:
+                continue
+            meals += row_meals
+            sort_keys += [item['date']['S']] * len(row_meals)
+        if 'LastEvaluatedKey' not in result:
+            break
+        query_kwargs['ExclusiveStartKey'] = result['LastEvaluatedKey']
 
+    if prefetched is not None:
+        prefetched.user_days[date] = meals
+        prefetched.user_day_keys[date] = sort_keys
+        prefetched.user_day_totals[date] = totals
+    return meals, sort_keys
 
-def find_food_by_name_and_day(
+
+def read_user_day(
         *,
         date: datetime.date,
-        food_name_to_find: str,
         user_id: str,
         lambda_mode: bool,
+        prefetched: typing.Optional[PrefetchedItems] = None,
+        deadline: Deadline = no_deadline,
 ) -> typing.List[dict]:
-    database_client = get_dynamo_client(lambda_mode=lambda_mode)
-    result = database_client.get_item(
-            TableName='nutrition_users',
-            Key={
-                'id': {'S': user_id},
-                'date': {'S': str(date)},
-            })
+    """
+    All foods saved by the user for the date
+    """
+    meals, _ = query_user_day(
+        date=date,
+        user_id=user_id,
+        lambda_mode=lambda_mode,
+        prefetched=prefetched,
+        deadline=deadline,
+    )
+    return meals
+
+
+def read_user_day_totals(
+        *,
+        date: datetime.date,
+        user_id: str,
+        lambda_mode: bool,
+        prefetched: typing.Optional[PrefetchedItems] = None,
+        deadline: Deadline = no_deadline,
+) -> typing.Optional[typing.Dict[str, float]]:
+    """
+    Running totals of the day, see day_totals. They are read by the same
+    Query as the meals
+    :return: None if the totals don't match the meals (days saved before
+    totals were introduced and not repaired with repair_day_totals)
+    """
+    if prefetched is None:
+        prefetched = PrefetchedItems()
+    meals, _ = query_user_day(
+        date=date,
+        user_id=user_id,
+        lambda_mode=lambda_mode,
+        prefetched=prefetched,
+        deadline=deadline,
+    )
+    totals = prefetched.user_day_totals.get(str(date))
+    if totals is None or totals['meals_count'] != len(meals):
+        return None
+    return totals
 
-    if 'Item' not in result:
-        return []
 
-    items: typing.List[dict] = json.loads(result['Item']['value']['S'])
+def find_food_by_name_and_day(
+        *,
+        date: datetime.date,
+        food_name_to_find: str,
+        user_id: str,
+        lambda_mode: bool,
+        prefetched: typing.Optional[PrefetchedItems] = None,
+        deadline: Deadline = no_deadline,
+) -> typing.List[dict]:
+    items = read_user_day(
+        date=date,
+        user_id=user_id,
+        lambda_mode=lambda_mode,
+        prefetched=prefetched,
+        deadline=deadline,
+    )
     found_items = []
 
     for item in items:
@@ -359,19 +1065,16 @@ def find_all_food_names_for_day(
         date: datetime.date,
         user_id: str,
         lambda_mode: bool,
+        prefetched: typing.Optional[PrefetchedItems] = None,
+        deadline: Deadline = no_deadline,
 ) -> typing.List[dict]:
-    database_client = get_dynamo_client(lambda_mode=lambda_mode)
-    result = database_client.get_item(
-            TableName='nutrition_users',
-            Key={
-                'id': {'S': user_id},
-                'date': {'S': str(date)},
-            })
-
-    if 'Item' not in result:
-        return []
-
-    items: typing.List[dict] = json.loads(result['Item']['value']['S'])
+    items = read_user_day(
+        date=date,
+        user_id=user_id,
+        lambda_mode=lambda_mode,
+        prefetched=prefetched,
+        deadline=deadline,
+    )
     return [i for i in items if 'foods' in i and 'error' not in i['foods']]
     # found_items = []
     #
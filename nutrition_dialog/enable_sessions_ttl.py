@@ -0,0 +1,31 @@
+"""
+Turns on DynamoDB TTL of nutrition_sessions on the attribute saved with
+every context (see session_expiry in dynamodb_functions), so rows of ended
+sessions are deleted by DynamoDB itself. Needed once per table.
+
+Usage: python enable_sessions_ttl.py [profile]
+"""
+import sys
+from dynamodb_functions import get_dynamo_client, session_ttl_attribute
+
+
+def enable_sessions_ttl(*, database_client) -> dict:
+    description = database_client.describe_time_to_live(
+        TableName='nutrition_sessions')['TimeToLiveDescription']
+    if description.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+        return description
+    return database_client.update_time_to_live(
+        TableName='nutrition_sessions',
+        TimeToLiveSpecification={
+            'Enabled': True,
+            'AttributeName': session_ttl_attribute,
+        },
+    )['TimeToLiveSpecification']
+
+
+if __name__ == '__main__':
+    client = get_dynamo_client(
+        lambda_mode=False,
+        profile_name=sys.argv[1] if len(sys.argv) > 1 else 'kreodont',
+    )
+    print(enable_sessions_ttl(database_client=client))
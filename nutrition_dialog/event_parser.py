@@ -0,0 +1,95 @@
+import functools
+import typing
+
+# Fields of Yandex event are described once with their paths like
+# 'meta -> interfaces -> screen', the paths are split at import. The event
+# is read in one pass which collects all the errors instead of stopping at
+# the first one
+
+
+class EventField(typing.NamedTuple):
+    name: str
+    path: typing.Tuple[str, ...]  # see compile_path
+    required: bool = False  # error if missing
+    default: typing.Any = None  # if missing and not required
+    value_type: typing.Optional[typing.Union[type, tuple]] = None  # error
+    # if the value is of another type
+
+
+@functools.lru_cache(maxsize=256)
+def compile_path(path: str) -> typing.Tuple[str, ...]:
+    """
+    :param path: 'meta -> interfaces -> screen'
+    :return: ('meta', 'interfaces', 'screen')
+    """
+    return tuple(t.strip() for t in path.split('->'))
+
+
+def event_field(
+        name: str,
+        path: str,
+        *,
+        required: bool = False,
+        default: typing.Any = None,
+        value_type: typing.Optional[typing.Union[type, tuple]] = None,
+) -> EventField:
+    return EventField(
+        name=name,
+        path=compile_path(path),
+        required=required,
+        default=default,
+        value_type=value_type,
+    )
+
+
+def value_by_path(
+        event_dict: typing.Any,
+        path: typing.Tuple[str, ...],
+) -> typing.Optional[typing.Any]:
+    """
+    :return: None if any level is missing or is not a dict
+    """
+    value = event_dict
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def parse_event(
+        event_dict: typing.Any,
+        fields: typing.Iterable[EventField],
+) -> typing.Tuple[typing.Dict[str, typing.Any], typing.List[str]]:
+    """
+    :param event_dict: event from Yandex
+    :param fields:
+    :return: (field name -> value, errors of all the fields)
+    """
+    values = {}
+    errors = []
+    for field in fields:
+        value = value_by_path(event_dict, field.path)
+        if value is None:
+            if field.required:
+                errors.append(f'{field.name} is None')
+            value = field.default
+        elif field.value_type is not None and \
+                not isinstance(value, field.value_type):
+            errors.append(f'{field.name} is {type(value).__name__}')
+        values[field.name] = value
+    return values, errors
+
+
+def fetch_one_value_from_event_dict(
+        *,
+        event_dict: dict,
+        path: str) -> typing.Optional[typing.Any]:
+    """
+    To extract data from multilevel dictionary using the following syntax:
+    'meta -> interfaces -> screen'
+    :param event_dict:
+    :param path:
+    :return:
+    """
+    return value_by_path(event_dict, compile_path(path))
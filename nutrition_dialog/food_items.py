@@ -0,0 +1,99 @@
+import copy
+import typing
+from cache_keys import phrase_words, split_into_items, \
+    canonical_food_and_quantity
+
+# Phrase "борщ, хлеб и чай с сахаром" is cached not only as a whole, but
+# also food by food, so "хлеб и борщ" is answered without API. Foods weighed
+# in grams are saved also per 100 grams, so "гречка 300 грамм" is answered
+# from "гречка 200 грамм"
+
+item_key_prefix = '_item_'  # '_' the same as for '_key' row
+grams_in_unit = {'г': 1, 'кг': 1000}
+
+
+class FoodItem(typing.NamedTuple):
+    words: typing.List[str]  # as user said them
+    key: str  # nutrition_cache key of exactly this food and quantity
+    per_100_grams_key: str  # key of the food weighing 100 grams
+    grams: typing.Optional[float]  # None if quantity is not in grams
+
+
+def split_into_food_items(phrase: str) -> typing.List[FoodItem]:
+    """
+    :param phrase: 'гречка 200 грамм и банан'
+    :return: [FoodItem(words=['гречка', '200', 'грамм'],
+                       key='_item_гречк 200 г',
+                       per_100_grams_key='_item_гречк 100 г', grams=200),
+              FoodItem(words=['банан'], key='_item_банан',
+                       per_100_grams_key='_item_банан 100 г', grams=None)]
+    """
+    food_items = []
+    for words in split_into_items(phrase_words(phrase)):
+        food, quantity = canonical_food_and_quantity(words)
+        if not food:
+            continue
+        grams = None
+        if len(quantity) == 2 and quantity[1] in grams_in_unit:
+            grams = float(quantity[0]) * grams_in_unit[quantity[1]]
+            grams = int(grams) if grams == int(grams) else grams
+        food_items.append(FoodItem(
+            words=words,
+            key=item_key_prefix + ' '.join(food + quantity),
+            per_100_grams_key=item_key_prefix + ' '.join(food + ['100', 'г']),
+            grams=grams,
+        ))
+    return food_items
+
+
+def scale_food(food: dict, grams: float) -> dict:
+    """
+    :param food: one element of food_dict['foods']
+    :param grams: new weight
+    :return: copy of the food with nutrients for the new weight
+    """
+    coef = grams / food['serving_weight_grams']
+    scaled = copy.deepcopy(food)
+    for key, value in food.items():
+        if key.startswith('nf_') and isinstance(value, (int, float)):
+            scaled[key] = value * coef
+    for nutrient in scaled.get('full_nutrients') or []:
+        if isinstance(nutrient.get('value'), (int, float)):
+            nutrient['value'] *= coef
+    scaled['serving_weight_grams'] = grams
+    scaled['serving_qty'] = grams
+    scaled['serving_unit'] = 'g'
+    return scaled
+
+
+def find_cached_food(
+        food_item: FoodItem,
+        cached: typing.Dict[str, dict],
+) -> typing.Optional[dict]:
+    if food_item.key in cached:
+        return cached[food_item.key]
+    if food_item.grams and food_item.per_100_grams_key in cached:
+        return scale_food(cached[food_item.per_100_grams_key],
+                          food_item.grams)
+    return None
+
+
+def foods_to_cache(
+        food_items: typing.List[FoodItem],
+        foods: typing.List[dict],
+) -> typing.Dict[str, dict]:
+    """
+    API returns foods in the order they were said, but only if their number
+    is the same as the number of items we can tell which food is which
+    :param food_items: the ones sent to API
+    :param foods: food_dict['foods'] returned by API
+    :return: key -> food for write_food_items_to_cache_table
+    """
+    if len(food_items) != len(foods):
+        return {}
+    items = {}
+    for food_item, food in zip(food_items, foods):
+        items[food_item.key] = copy.deepcopy(food)
+        if food.get('serving_weight_grams'):
+            items[food_item.per_100_grams_key] = scale_food(food, 100)
+    return items
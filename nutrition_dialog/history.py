@@ -0,0 +1,103 @@
+import datetime
+import json
+import typing
+from day_totals import totals_attributes, totals_from_item, totals_date, \
+    totals_index
+from dynamodb_functions import get_dynamo_client
+
+
+class UserDay(typing.NamedTuple):
+    date: datetime.date
+    meals: typing.List[dict]  # empty if only totals were requested
+    totals: typing.Optional[typing.Dict[str, float]]  # see day_totals, None
+    # if they were never saved for the day
+
+
+def iterate_user_days(
+        *,
+        user_id: str,
+        date_from: datetime.date,
+        date_to: datetime.date,
+        lambda_mode: bool,
+        totals_only: bool = False,
+        page_size: typing.Optional[int] = None,
+) -> typing.Iterator[UserDay]:
+    """
+    Days of the user one by one, read with paginated Query by date range,
+    so any period takes as much memory as one page. Days when nothing was
+    saved are skipped
+    :param user_id:
+    :param date_from: including
+    :param date_to: including
+    :param lambda_mode:
+    :param totals_only: read only the running totals of days, without
+    meals, from totals_index: the rows of meals are not read at all. Days
+    saved before totals or totals_date were introduced have to be fixed
+    with repair_day_totals first
+    :param page_size: rows in one Query, DynamoDB limit (1 MB) if not set
+    :return:
+    """
+    database_client = get_dynamo_client(lambda_mode=lambda_mode)
+    query_kwargs = {
+        'TableName': 'nutrition_users',
+        # Rows of meals are '2019-05-12#...', '$' goes right after '#'
+        'KeyConditionExpression':
+            '#id = :id AND #date BETWEEN :date_from AND :date_to',
+        'ExpressionAttributeNames': {'#id': 'id', '#date': 'date'},
+        'ExpressionAttributeValues': {
+            ':id': {'S': user_id},
+            ':date_from': {'S': str(date_from)},
+            ':date_to': {'S': f'{date_to}$'},
+        },
+    }
+    if totals_only:
+        query_kwargs.update({
+            'IndexName': totals_index,
+            'ExpressionAttributeNames': {'#id': 'id', '#date': totals_date},
+            'ProjectionExpression': ', '.join(
+                ('#date',) + totals_attributes),
+        })
+        query_kwargs['ExpressionAttributeValues'][':date_to'] = \
+            {'S': str(date_to)}
+    if page_size:
+        query_kwargs['Limit'] = page_size
+
+    current_date = None
+    meals = []
+    totals = None
+    while True:
+        result = database_client.query(**query_kwargs)
+        for item in result.get('Items', []):
+            if totals_only:
+                yield UserDay(
+                    date=datetime.date.fromisoformat(
+                        item[totals_date]['S']),
+                    meals=[],
+                    totals=totals_from_item(item),
+                )
+                continue
+            date = item['date']['S'][:10]
+            if date != current_date:
+                if current_date is not None:
+                    yield UserDay(
+                        date=datetime.date.fromisoformat(current_date),
+                        meals=meals,
+                        totals=totals,
+                    )
+                current_date, meals, totals = date, [], None
+            if item['date']['S'] == date:
+                totals = totals_from_item(item)
+            if 'meal' in item:
+                meals.append(json.loads(item['meal']['S']))
+            elif 'value' in item:
+                meals += json.loads(item['value']['S'])
+        if 'LastEvaluatedKey' not in result:
+            break
+        query_kwargs['ExclusiveStartKey'] = result['LastEvaluatedKey']
+
+    if current_date is not None:
+        yield UserDay(
+            date=datetime.date.fromisoformat(current_date),
+            meals=meals,
+            totals=totals,
+        )
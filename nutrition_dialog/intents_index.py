@@ -0,0 +1,112 @@
+import typing
+from yandex_types import YandexRequest
+
+
+def request_phrases(request: YandexRequest) -> typing.Tuple[str, str]:
+    """
+    Normalized whole phrases of the request which are compared with
+    intents trigger_phrases. Both original utterance and command are used,
+    because Yandex removes punctuation from the command
+    :param request:
+    :return: ('сбросить всё!', 'сбросить всё') for example
+    """
+    return (
+        (request.original_utterance or '').lower().strip(),
+        (request.command or '').lower().strip(),
+    )
+
+
+def request_haystack(request: YandexRequest) -> str:
+    """
+    Text in which intents trigger_parts are searched: lowercased original
+    utterance and all the tokens
+    :param request:
+    :return:
+    """
+    return (request.original_utterance or '').lower() + '\n' + \
+        ' '.join(request.tokens).lower()
+
+
+def fits_triggers(intent, request: YandexRequest) -> bool:
+    """
+    Checks declarative rules of the intent: at least one of trigger tokens,
+    phrases or parts is in the request and none of blocking tokens is
+    :param intent: DialogIntent subclass
+    :param request:
+    :return:
+    """
+    tokens = request.tokens
+    if any(t in tokens for t in intent.blocking_tokens):
+        return False
+    if any(t in tokens for t in intent.trigger_tokens):
+        return True
+    if any(p in intent.trigger_phrases for p in request_phrases(request)):
+        return True
+    if intent.trigger_parts:
+        haystack = request_haystack(request)
+        return any(p in haystack for p in intent.trigger_parts)
+    return False
+
+
+class IntentsIndex:
+    """
+    Inverted index of intents trigger rules, compiled once when the module
+    is loaded. For each request it returns only those intents which can fit
+    it (in the order they should be evaluated), so there is no need to call
+    evaluate of every intent one by one.
+    """
+
+    def __init__(self, *, intents: typing.Iterable):
+        # it is always better to evaluate the quickest intents first
+        self.ordered_intents = tuple(sorted(
+            intents,
+            key=lambda x: x.time_to_evaluate,
+        ))
+        self.rank = {intent: number for number, intent in
+                     enumerate(self.ordered_intents)}
+        self.by_token: typing.Dict[str, typing.Set] = {}
+        self.by_phrase: typing.Dict[str, typing.Set] = {}
+        self.by_part: typing.List[typing.Tuple[str, typing.Set]] = []
+        self.always_evaluated = frozenset(
+            i for i in self.ordered_intents if i.always_evaluate)
+        self.blocking_tokens = {
+            i: frozenset(i.blocking_tokens) for i in self.ordered_intents
+            if i.blocking_tokens}
+
+        parts: typing.Dict[str, typing.Set] = {}
+        for intent in self.ordered_intents:
+            for token in intent.trigger_tokens:
+                self.by_token.setdefault(token, set()).add(intent)
+            for phrase in intent.trigger_phrases:
+                self.by_phrase.setdefault(phrase, set()).add(intent)
+            for part in intent.trigger_parts:
+                parts.setdefault(part, set()).add(intent)
+        self.by_part = list(parts.items())
+
+    def candidates(self, request: YandexRequest) -> list:
+        """
+        Intents that can fit the request, sorted by time_to_evaluate
+        :param request:
+        :return:
+        """
+        found = set(self.always_evaluated)
+        tokens = set(request.tokens)
+        for token in tokens:
+            if token in self.by_token:
+                found |= self.by_token[token]
+
+        for phrase in request_phrases(request):
+            if phrase in self.by_phrase:
+                found |= self.by_phrase[phrase]
+
+        if self.by_part:
+            haystack = request_haystack(request)
+            for part, part_intents in self.by_part:
+                if part in haystack:
+                    found |= part_intents
+
+        for intent, blocking in self.blocking_tokens.items():
+            if intent in found and not tokens.isdisjoint(blocking):
+                found.discard(intent)
+
+        return sorted(found, key=self.rank.__getitem__)
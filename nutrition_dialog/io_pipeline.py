@@ -0,0 +1,85 @@
+import concurrent.futures
+import os
+import threading
+import typing
+
+# Like global_client in dynamodb_functions, the pool is kept by AWS lambda
+# between calls, so threads are not created for every request
+global_executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+global_executor_lock = threading.Lock()
+
+# Tasks started with run_in_background during the current request
+background_tasks: typing.List[concurrent.futures.Future] = []
+
+# Whether translation is requested at the same time as cache lookup,
+# before we know that the food is not in cache
+speculative_translation = os.getenv('SpeculativeTranslation', '1') == '1'
+
+
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global global_executor
+
+    with global_executor_lock:
+        if global_executor is None:
+            global_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=int(os.getenv('IoThreads', '4')),
+                thread_name_prefix='io',
+            )
+    return global_executor
+
+
+def submit(
+        target_function: typing.Callable,
+        *args,
+        **kwargs,
+) -> concurrent.futures.Future:
+    """
+    Starts I/O function (HTTP or database request) in a separate thread, the
+    result is taken later with future.result()
+    """
+    return get_executor().submit(target_function, *args, **kwargs)
+
+
+def run_in_background(
+        target_function: typing.Callable,
+        *args,
+        **kwargs,
+) -> concurrent.futures.Future:
+    """
+    For writes the response doesn't depend on. They go in parallel with
+    building the response and with each other, handler waits for all of
+    them with wait_for_background_tasks before returning
+    """
+    future = submit(target_function, *args, **kwargs)
+    background_tasks.append(future)
+    return future
+
+
+def add_background_task(future: concurrent.futures.Future) -> None:
+    """
+    For a task started with submit whose result is not needed anymore: it
+    is waited for with wait_for_background_tasks like the writes
+    """
+    background_tasks.append(future)
+
+
+def wait_for_background_tasks(
+        *,
+        timeout: typing.Optional[float] = None,
+) -> None:
+    """
+    AWS lambda freezes the container as soon as the handler returns, so
+    all the background writes have to be finished before that
+    :param timeout: seconds, None means wait as long as needed
+    """
+    tasks = list(background_tasks)
+    background_tasks.clear()
+    if not tasks:
+        return
+    done, not_done = concurrent.futures.wait(tasks, timeout=timeout)
+    for future in done:
+        exception = future.exception()
+        if exception:
+            print(f'Background task failed: {exception}')
+    if not_done:
+        print(f'{len(not_done)} background tasks are not finished in time')
@@ -0,0 +1,213 @@
+import itertools
+import os
+import random
+import threading
+import time
+import typing
+from LruCache import LruCache
+from dynamodb_functions import get_dynamo_client
+
+# Usage of every Nutritionix key is kept in nutrition_cache rows
+# '_key_usage_<name>#<shard>' as 24 hourly buckets: b0..b23 are counters
+# and s0..s23 are the absolute hours they were counted in, so a bucket left
+# from yesterday is recognized and started again. Rows never grow, usage
+# is added with atomic ADD instead of rewriting the '_key' row. Every usage
+# goes to a random shard, so concurrent lambdas don't write the same row,
+# the shards are summed when read
+usage_key_prefix = '_key_usage_'
+shards_count = int(os.getenv('KeyUsageShards', '4'))
+buckets_count = 24
+bucket_seconds = 3600
+exhausted_seconds = 3600  # a key refused by API is not used so long
+usage_ttl_seconds = 30  # other containers use the keys too
+unprocessed_retries = 3  # of batch_get_item, like in write_behind
+
+key_usages_l1 = LruCache(max_items=100, ttl_seconds=usage_ttl_seconds)
+round_robin_counter = itertools.count()
+usages_lock = threading.Lock()
+
+
+class KeyUsage(typing.NamedTuple):
+    usages: int  # for last 24 hours
+    exhausted_until: float  # unix time, 0 if the key is fine
+
+
+def current_bucket(now: typing.Optional[float] = None) -> int:
+    """
+    :param now: unix time, current if not set
+    :return: absolute hour, bucket index is its remainder of buckets_count
+    """
+    return int((time.time() if now is None else now) // bucket_seconds)
+
+
+def usage_row_key(key_name: str, shard: int) -> dict:
+    return {'initial_phrase': {'S': f'{usage_key_prefix}{key_name}#{shard}'}}
+
+
+def key_name_of_row(item: dict) -> str:
+    """
+    :param item: usage row or its key
+    """
+    return item['initial_phrase']['S'][
+        len(usage_key_prefix):].rsplit('#', 1)[0]
+
+
+def usage_from_items(
+        items: typing.Iterable[dict],
+        *,
+        bucket: int,
+) -> KeyUsage:
+    """
+    :param items: '_key_usage_<name>#<shard>' rows of one key
+    :param bucket: current_bucket
+    :return:
+    """
+    usages = 0
+    exhausted_until = 0.0
+    for item in items:
+        for i in range(buckets_count):
+            if f's{i}' in item and f'b{i}' in item and \
+                    int(item[f's{i}']['N']) > bucket - buckets_count:
+                usages += int(item[f'b{i}']['N'])
+        if 'exhausted_until' in item:
+            exhausted_until = max(
+                exhausted_until, float(item['exhausted_until']['N']))
+    return KeyUsage(usages=usages, exhausted_until=exhausted_until)
+
+
+def read_key_usages(
+        *,
+        key_names: typing.List[str],
+        lambda_mode: bool,
+) -> typing.Dict[str, KeyUsage]:
+    """
+    :param key_names:
+    :param lambda_mode:
+    :return: key name -> usage, taken from memory if read recently. If
+    some rows of a key are not read after retries, its usage is counted by
+    the rows which were read (zero if none) and is read again next time
+    """
+    usages = {n: key_usages_l1.get(n) for n in key_names}
+    missing = [n for n, u in usages.items() if u is None]
+    if not missing:
+        return usages
+    database_client = get_dynamo_client(lambda_mode=lambda_mode)
+    row_keys = [usage_row_key(n, s)
+                for n in missing for s in range(shards_count)]
+    items = {n: [] for n in missing}
+    unread = set()  # names of keys with rows left unprocessed
+    while row_keys:
+        # batch_get_item takes up to 100 keys
+        request_items = {'nutrition_cache': {'Keys': row_keys[:100]}}
+        row_keys = row_keys[100:]
+        for attempt in range(unprocessed_retries + 1):
+            if attempt:
+                time.sleep(0.01 * 2 ** (attempt - 1))
+            result = database_client.batch_get_item(
+                RequestItems=request_items)
+            for item in result['Responses']['nutrition_cache']:
+                items[key_name_of_row(item)].append(item)
+            request_items = result.get('UnprocessedKeys')
+            if not request_items:
+                break
+        else:
+            unread.update(key_name_of_row(k)
+                          for k in request_items['nutrition_cache']['Keys'])
+    if unread:
+        print(f'Usages of keys {sorted(unread)} are not read completely')
+    bucket = current_bucket()
+    for name in missing:
+        usages[name] = usage_from_items(items[name], bucket=bucket)
+        if name not in unread:
+            key_usages_l1.put(name, usages[name])
+    return usages
+
+
+def choose_key(
+        keys_dict: dict,
+        *,
+        lambda_mode: bool,
+) -> typing.Tuple[str, str]:
+    """
+    The least used key for last 24 hours, keys used equally are taken in
+    turn. Exhausted keys are skipped while there are others
+    :param keys_dict: '_key' row, {'link': ..., 'keys': [{'name': 'xxxx',
+    'pass': 'xxxx'}, ...]}
+    :param lambda_mode:
+    :return: (login, password)
+    """
+    keys = keys_dict['keys']
+    usages = read_key_usages(
+        key_names=[k['name'] for k in keys],
+        lambda_mode=lambda_mode,
+    )
+    now = time.time()
+    available = [k for k in keys if usages[k['name']].exhausted_until < now]
+    if not available:
+        print('All API keys are exhausted, using the one to be restored '
+              'first')
+        available = [min(
+            keys, key=lambda k: usages[k['name']].exhausted_until)]
+    least_usages = min(usages[k['name']].usages for k in available)
+    least_used = [k for k in available
+                  if usages[k['name']].usages == least_usages]
+    key = least_used[next(round_robin_counter) % len(least_used)]
+    with usages_lock:  # counted now for parallel requests of the container
+        usage = key_usages_l1.get(key['name']) or usages[key['name']]
+        key_usages_l1.put(key['name'], usage._replace(
+            usages=usage.usages + 1))
+    print(f"Key {key['name']} with {least_usages} usages for last 24 hours")
+    return key['name'], key['pass']
+
+
+def record_key_usage(*, key_name: str, lambda_mode: bool) -> None:
+    """
+    Adds 1 to the bucket of current hour in a random shard, the bucket is
+    started again if it was counted in another hour
+    """
+    database_client = get_dynamo_client(lambda_mode=lambda_mode)
+    hour = current_bucket()
+    index = hour % buckets_count
+    row_key = usage_row_key(key_name, random.randrange(shards_count))
+    values = {':one': {'N': '1'}, ':hour': {'N': str(hour)}}
+    for _ in range(3):  # the bucket can be started by other container
+        try:
+            database_client.update_item(
+                TableName='nutrition_cache',
+                Key=row_key,
+                UpdateExpression=f'ADD b{index} :one',
+                ConditionExpression=f's{index} = :hour',
+                ExpressionAttributeValues=values,
+            )
+            return
+        except database_client.exceptions.ConditionalCheckFailedException:
+            pass
+        try:
+            database_client.update_item(
+                TableName='nutrition_cache',
+                Key=row_key,
+                UpdateExpression=f'SET b{index} = :one, s{index} = :hour',
+                ConditionExpression=f'attribute_not_exists(s{index}) OR '
+                                    f's{index} < :hour',
+                ExpressionAttributeValues=values,
+            )
+            return
+        except database_client.exceptions.ConditionalCheckFailedException:
+            pass
+
+
+def mark_key_exhausted(*, key_name: str, lambda_mode: bool) -> None:
+    exhausted_until = time.time() + exhausted_seconds
+    print(f'API key {key_name} is exhausted')
+    with usages_lock:
+        usage = key_usages_l1.get(key_name) or KeyUsage(
+            usages=0, exhausted_until=0.0)
+        key_usages_l1.put(key_name, usage._replace(
+            exhausted_until=exhausted_until))
+    database_client = get_dynamo_client(lambda_mode=lambda_mode)
+    database_client.update_item(
+        TableName='nutrition_cache',
+        Key=usage_row_key(key_name, 0),  # the latest of all shards is used
+        UpdateExpression='SET exhausted_until = :until',
+        ExpressionAttributeValues={':until': {'N': repr(exhausted_until)}},
+    )
@@ -0,0 +1,67 @@
+"""
+Adds together the metrics printed by request_metrics for every invocation
+and prints how often every intent was chosen, the counters and the
+percentiles of every timing, the longest in total first. Lines of the logs
+which are not metrics records are skipped.
+
+Usage: python merge_metrics.py [log file ...], stdin if no files
+"""
+import fileinput
+import json
+import typing
+from request_metrics import Histogram, no_intent
+
+
+def merge_records(
+        lines: typing.Iterable[str],
+) -> typing.Tuple[typing.Dict[str, int], typing.Dict[str, int],
+                  typing.Dict[str, Histogram]]:
+    """
+    :param lines: CloudWatch logs, the record can follow a prefix
+    :return: (intent -> times chosen, counters, histograms)
+    """
+    intents: typing.Dict[str, int] = {}
+    counters: typing.Dict[str, int] = {}
+    histograms: typing.Dict[str, Histogram] = {}
+    for line in lines:
+        if '"Histograms"' not in line:
+            continue
+        try:
+            record = json.loads(line[line.index('{'):])
+        except ValueError:
+            continue
+        intent = record.get('Intent') or no_intent
+        intents[intent] = intents.get(intent, 0) + 1
+        for name, value in record.get('Counters', {}).items():
+            counters[name] = counters.get(name, 0) + value
+        for name, encoded in record['Histograms'].items():
+            histogram = Histogram.decode(encoded)
+            if name in histograms:
+                histograms[name].merge(histogram)
+            else:
+                histograms[name] = histogram
+    return intents, counters, histograms
+
+
+def print_report(
+        intents: typing.Dict[str, int],
+        counters: typing.Dict[str, int],
+        histograms: typing.Dict[str, Histogram],
+) -> None:
+    print('Chosen intents:')
+    for intent, times in sorted(intents.items(), key=lambda i: -i[1]):
+        print(f'{intent:50} {times:8}')
+    print('\nCounters:')
+    for name, value in sorted(counters.items()):
+        print(f'{name:50} {value:8}')
+    print(f'\n{"Timing, ms":50} {"count":>8} {"total":>10} {"p50":>8} '
+          f'{"p95":>8} {"p99":>8} {"max":>8}')
+    for name, h in sorted(histograms.items(), key=lambda i: -i[1].total):
+        print(f'{name:50} {h.count:8} {h.total / 1000:10.1f} '
+              f'{h.percentile(50) / 1000:8.2f} '
+              f'{h.percentile(95) / 1000:8.2f} '
+              f'{h.percentile(99) / 1000:8.2f} {h.max / 1000:8.2f}')
+
+
+if __name__ == '__main__':
+    print_report(*merge_records(fileinput.input()))
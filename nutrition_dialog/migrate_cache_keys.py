@@ -0,0 +1,84 @@
+"""
+Copies rows of nutrition_cache written before canonical keys were
+introduced under their canonical keys, so they are found by
+get_from_cache_table without reading the old key too.
+
+Usage: python migrate_cache_keys.py [--apply] [--delete-old] [profile]
+Without --apply only prints what would be done
+"""
+import sys
+import typing
+from cache_keys import canonical_cache_key
+from dynamodb_functions import get_dynamo_client
+
+
+def scan_cache_table(database_client) -> typing.Iterator[dict]:
+    scan_kwargs = {'TableName': 'nutrition_cache'}
+    while True:
+        page = database_client.scan(**scan_kwargs)
+        yield from page.get('Items', [])
+        if 'LastEvaluatedKey' not in page:
+            return
+        scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def migrate_cache_keys(
+        *,
+        database_client,
+        apply: bool,
+        delete_old: bool,
+) -> typing.Dict[str, int]:
+    """
+    :param database_client:
+    :param apply: False means dry run
+    :param delete_old: delete the row under old key after it is copied
+    :return: counters of what was done
+    """
+    stats = {'scanned': 0, 'copied': 0, 'already_canonical': 0,
+             'canonical_exists': 0, 'deleted': 0}
+    for item in scan_cache_table(database_client):
+        stats['scanned'] += 1
+        old_key = item['initial_phrase']['S']
+        if old_key.startswith('_') or \
+                ('response' not in item and 'data' not in item):
+            continue  # '_key' and translations
+        new_key = canonical_cache_key(old_key)
+        if new_key == old_key:
+            stats['already_canonical'] += 1
+            continue
+        print(f'"{old_key}" -> "{new_key}"')
+        if not apply:
+            continue
+
+        new_item = dict(item, initial_phrase={'S': new_key})
+        try:
+            # Row already saved under canonical key is newer, keeping it
+            database_client.put_item(
+                TableName='nutrition_cache',
+                Item=new_item,
+                ConditionExpression='attribute_not_exists(initial_phrase)',
+            )
+            stats['copied'] += 1
+        except database_client.exceptions.ConditionalCheckFailedException:
+            stats['canonical_exists'] += 1
+
+        if delete_old:
+            database_client.delete_item(
+                TableName='nutrition_cache',
+                Key={'initial_phrase': {'S': old_key}},
+            )
+            stats['deleted'] += 1
+    return stats
+
+
+if __name__ == '__main__':
+    arguments = [a for a in sys.argv[1:] if not a.startswith('--')]
+    client = get_dynamo_client(
+        lambda_mode=False,
+        profile_name=arguments[0] if arguments else 'kreodont',
+    )
+    print(migrate_cache_keys(
+        database_client=client,
+        apply='--apply' in sys.argv,
+        delete_old='--delete-old' in sys.argv,
+    ))
@@ -0,0 +1,73 @@
+"""
+Rewrites food rows of nutrition_cache saved as full Nutritionix JSON
+('response' attribute) into the compact compressed format of
+cache_records. Rows can be migrated while the skill works, both formats
+are read.
+
+Usage: python migrate_cache_records.py [--apply] [profile]
+Without --apply only prints what would be done
+"""
+import json
+import sys
+import typing
+from cache_records import compact_food, compact_food_dict, \
+    encode_cache_record
+from dynamodb_functions import get_dynamo_client
+from food_items import item_key_prefix
+from migrate_cache_keys import scan_cache_table
+
+
+def migrate_cache_records(
+        *,
+        database_client,
+        apply: bool,
+) -> typing.Dict[str, int]:
+    """
+    :param database_client:
+    :param apply: False means dry run
+    :return: counters of what was done and sizes in bytes before and after
+    """
+    stats = {'scanned': 0, 'rewritten': 0, 'changed_meanwhile': 0,
+             'bytes_before': 0, 'bytes_after': 0}
+    for item in scan_cache_table(database_client):
+        stats['scanned'] += 1
+        key = item['initial_phrase']['S']
+        if 'response' not in item or \
+                (key.startswith('_') and not key.startswith(item_key_prefix)):
+            continue  # already compact, '_key' or translation
+
+        value = json.loads(item['response']['S'])
+        if key.startswith(item_key_prefix):
+            value = compact_food(value)
+        else:
+            value = compact_food_dict(value)
+        new_attributes = encode_cache_record(value)
+        stats['bytes_before'] += len(item['response']['S'].encode('utf-8'))
+        stats['bytes_after'] += len(new_attributes['data']['B'])
+        if not apply:
+            continue
+
+        try:
+            # If the row was saved again in new format, it is not touched
+            database_client.put_item(
+                TableName='nutrition_cache',
+                Item={'initial_phrase': {'S': key}, **new_attributes},
+                ConditionExpression='attribute_exists(#response)',
+                ExpressionAttributeNames={'#response': 'response'},
+            )
+            stats['rewritten'] += 1
+        except database_client.exceptions.ConditionalCheckFailedException:
+            stats['changed_meanwhile'] += 1
+    return stats
+
+
+if __name__ == '__main__':
+    arguments = [a for a in sys.argv[1:] if not a.startswith('--')]
+    client = get_dynamo_client(
+        lambda_mode=False,
+        profile_name=arguments[0] if arguments else 'kreodont',
+    )
+    print(migrate_cache_records(
+        database_client=client,
+        apply='--apply' in sys.argv,
+    ))
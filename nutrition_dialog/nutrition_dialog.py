@@ -1,21 +1,47 @@
-from DialogIntents import intents, DialogIntent, Intent99999Default
-from yandex_types import YandexRequest, \
+from DialogIntents import compiled_intents_index, Intent99999Default, \
+    DialogIntent, TIER_CONTEXT, start_translation, finish_translations
+from yandex_types import YandexRequest, YandexResponse, \
     transform_event_dict_to_yandex_request_object, \
-    transform_yandex_response_to_output_result_dict
+    transform_yandex_response_to_output_result_dict, \
+    construct_yandex_response_from_yandex_request
 # import mockers
 import typing
-from dynamodb_functions import clear_context, save_context, write_to_cache_table
+from dynamodb_functions import clear_context, save_context, \
+    write_to_cache_table, prefetch_request_items, known_context_stored, \
+    remember_context_stored, get_dynamo_client
 import datetime
-from dataclasses import replace
-from decorators import timeit
+import os
+import http_sessions
+import io_pipeline
+import time
+import write_behind
+from tracing import traced_invocation
+from request_metrics import measured_invocation, record_evaluated, \
+    record_chosen_intent, timed, count
+from Deadline import Deadline, DeadlineExceeded, response_seconds, \
+    no_deadline
+from CircuitBreaker import CircuitOpen, global_breakers
 
+# Whole events are long, they are printed only if LogEvents=1
+log_events = os.getenv('LogEvents', '1') == '1'
+# Said when the request can't be answered before the deadline. Whatever was
+# found by then is cached, so the next try is quicker
+deadline_fallback_text = 'Не успела посчитать, повторите позже'
+# Said when translation or nutrients API is down and the food isn't cached
+upstream_fallback_text = 'Не получается посчитать, повторите позже'
 
-@timeit
+
+@traced_invocation
+@measured_invocation
 def nutrition_dialog(event, context):
-    print(f'Request: {event}')
+    if log_events:
+        print(f'Request: {event}')
     request: YandexRequest = transform_event_dict_to_yandex_request_object(
         event_dict=event,
         aws_lambda_mode=bool(context),
+        # Only in AWS, local runs wait for API as long as needed
+        deadline=Deadline(seconds=response_seconds, lambda_context=context)
+        if context else no_deadline,
     )
     if (request.user.id ==
             'BC8947C16A1442363544358F1761EA15BD1C81EF522C43D9CE69B9B874DC86D5'):
@@ -25,25 +51,35 @@ def nutrition_dialog(event, context):
         request_str += ' (auth)'
     request_str += f': {request.original_utterance}'
     print(request_str)
-    available_intents: typing.List[DialogIntent] = intents()
-    request = choose_the_best_intent(available_intents, request)
-    if not request.chosen_intent:
-        print('ERROR! No intent was chosen! Setting to default not to crash')
-        request = replace(request, chosen_intent=Intent99999Default)
-
-    print(f'{request.chosen_intent.__name__} has been chosen')
-    response = request.chosen_intent.respond(request=request)
-
-    if response.should_clear_context:
-        print('Clearing previous context from database')
-        clear_context(
+    if request.is_new_session:
+        # Rows are saved by session id, a new session has none yet
+        request.prefetched.context_stored = False
+    else:
+        request.prefetched.context_stored = known_context_stored(
             session_id=request.session_id,
-            lambda_mode=request.aws_lambda_mode,
+            message_id=request.message_id,
+        )
+    try:
+        response = choose_intent_and_respond(request)
+    except DeadlineExceeded as e:
+        print(f'Deadline exceeded: {e}')
+        count('deadline_exceeded')
+        response = construct_yandex_response_from_yandex_request(
+            yandex_request=request,
+            text=deadline_fallback_text,
+        )
+    except CircuitOpen as e:
+        print(f'Failing fast: {e}')
+        response = construct_yandex_response_from_yandex_request(
+            yandex_request=request,
+            text=upstream_fallback_text,
         )
 
-    if response.context_to_write:
-        print(f'Saving new context to database: {response.context_to_write}')
-        save_context(
+    # The response is ready, writes are queued (see write_behind) and are
+    # flushed below
+    if response.context_to_write or response.should_clear_context and \
+            response.initial_request.prefetched.context_stored is not False:
+        write_context(
             response=response,
             event_time=datetime.datetime.now(),
         )
@@ -53,6 +89,35 @@ def nutrition_dialog(event, context):
             response.initial_request.food_already_in_cache:
         write_to_cache_table(yandex_response=response)
 
+    finish_translations(yandex_request=request)
+    database_client = get_dynamo_client(lambda_mode=request.aws_lambda_mode)
+    defer_cache = request.deadline.expired()
+    # Inline: the handler has nothing else to do. Background tasks still
+    # running (API key usage, speculative translation) go on in their
+    # threads meanwhile
+    write_behind.flush_before_response(
+        database_client, defer_cache=defer_cache)
+    io_pipeline.wait_for_background_tasks()
+    # Whatever background tasks queued meanwhile
+    write_behind.flush_before_response(
+        database_client, defer_cache=defer_cache)
+    session_key = {'id': {'S': request.session_id}}
+    if not write_behind.was_written('nutrition_sessions', session_key):
+        response.initial_request.prefetched.context_stored = None
+    remember_context_stored(
+        session_id=request.session_id,
+        message_id=request.message_id,
+        stored=response.initial_request.prefetched.context_stored,
+    )
+    write_behind.flush_after_response(
+        database_client, defer_cache=defer_cache)
+    print(f'Write-behind: {write_behind.stats}')
+    if http_sessions.pool_stats:
+        print(f'HTTP connections reuse: {http_sessions.pool_stats}')
+    unavailable = [n for n, b in global_breakers.items()
+                   if b.state() != 'closed']
+    if unavailable:
+        print(f'Unavailable upstreams: {unavailable}')
     print(f'НАВЫК_{response.initial_request.user.log_hash}_Ответ_'
           f'{response.initial_request.message_id}'
           f':____________________'
@@ -61,29 +126,103 @@ def nutrition_dialog(event, context):
         yandex_response=response)
 
 
+def choose_intent_and_respond(request: YandexRequest) -> YandexResponse:
+    """
+    :raises DeadlineExceeded: if the deadline of the request is exceeded
+    """
+    request = choose_the_best_intent(
+        compiled_intents_index.candidates(request),
+        request,
+    )
+    if not request.chosen_intent:
+        print('ERROR! No intent was chosen! Setting to default not to crash')
+        request = request.replace(chosen_intent=Intent99999Default)
+
+    print(f'{request.chosen_intent.__name__} has been chosen')
+    record_chosen_intent(request.chosen_intent.__name__)
+    with timed(f'respond.{request.chosen_intent.__name__}'):
+        return request.chosen_intent.respond(request=request)
+
+
+def write_context(
+        *,
+        response: YandexResponse,
+        event_time: datetime.datetime,
+) -> None:
+    """
+    Saved context replaces the old one, so it is cleared only if nothing
+    is saved. Rows left by sessions which just ended expire by TTL
+    """
+    if response.should_clear_context and not response.context_to_write:
+        print('Clearing previous context from database')
+        clear_context(
+            session_id=response.initial_request.session_id,
+            lambda_mode=response.initial_request.aws_lambda_mode,
+        )
+        response.initial_request.prefetched.context_stored = False
+
+    if response.context_to_write:
+        print(f'Saving new context to database: {response.context_to_write}')
+        save_context(
+            response=response,
+            event_time=event_time,
+        )
+
+
 def choose_the_best_intent(
         intents_list: typing.List[DialogIntent],
         request: YandexRequest,
 ) -> YandexRequest:
+    """
+    :param intents_list: intents which can fit the request (see
+    IntentsIndex.candidates), already sorted by time_to_evaluate
+    :param request:
+    :return:
+    """
     if len(intents_list) < 1:
         raise Exception('No intents defined in DialogIntents.py '
                         'Please add at least one')
 
-    intents_sorted_by_time_to_evaluate = sorted(
-        intents_list,
-        key=lambda x: x.time_to_evaluate,
-    )  # it is always better to evaluate the quickest intents first
-
-    for intent in intents_sorted_by_time_to_evaluate:
+    for number, intent in enumerate(intents_list):
+        if intent.time_to_evaluate >= TIER_CONTEXT and \
+                not request.prefetched.attempted:
+            # All the quick intents didn't fit, so now loading everything
+            # the rest of them might need with one database request
+            request.deadline.check('prefetch')
+            request = prefetch_for_intents(intents_list[number:], request)
+        start_ns = time.perf_counter_ns()
         request = intent.evaluate(request=request)
+        record_evaluated(intent.__name__, time.perf_counter_ns() - start_ns)
         if intent in request.intents_matching_dict and \
                 request.intents_matching_dict[intent] >= 100:
-            request = replace(request, chosen_intent=intent)
+            request = request.replace(chosen_intent=intent)
             break
 
     return request
 
 
+def prefetch_for_intents(
+        intents_list: typing.List[DialogIntent],
+        request: YandexRequest,
+) -> YandexRequest:
+    read_context = any(i.should_read_context for i in intents_list)
+    read_food_cache = any(i.should_read_food_cache for i in intents_list)
+    if read_food_cache and not read_context and request.command and \
+            request.use_food_cache and io_pipeline.speculative_translation:
+        # Nothing but food search can fit, so translation goes in parallel
+        # with the database request. If the food is found in the table,
+        # it is just not used
+        start_translation(yandex_request=request)
+
+    return prefetch_request_items(
+        yandex_request=request,
+        read_context=read_context,
+        read_food_cache=read_food_cache,
+        read_user_day=request.user.authentificated and any(
+            i.should_read_user_day for i in intents_list),
+    )
+
+
 # def log_hash(request: YandexRequest) -> str:
 #     """
 #     Generates a random 3 digits number for one dialog
@@ -0,0 +1,110 @@
+"""
+Recomputes running totals of days (see day_totals) from the saved meals and
+writes them into the rows of the whole day. Needed once for days saved
+before totals were introduced or before totals_date (see day_totals), and
+whenever totals are suspected to be wrong.
+
+Usage: python repair_day_totals.py [--apply] [user_id] [profile]
+Without user_id all the users are repaired, without --apply only prints
+what would be changed
+"""
+import json
+import sys
+import typing
+from day_totals import meal_totals, sum_totals, totals_from_item, \
+    totals_attributes, totals_date
+from dynamodb_functions import get_dynamo_client
+
+
+def read_users_rows(
+        database_client,
+        *,
+        user_id: typing.Optional[str],
+) -> typing.Iterator[dict]:
+    if user_id:
+        kwargs = {
+            'TableName': 'nutrition_users',
+            'KeyConditionExpression': '#id = :id',
+            'ExpressionAttributeNames': {'#id': 'id'},
+            'ExpressionAttributeValues': {':id': {'S': user_id}},
+        }
+        method = database_client.query
+    else:
+        kwargs = {'TableName': 'nutrition_users'}
+        method = database_client.scan
+    while True:
+        page = method(**kwargs)
+        yield from page.get('Items', [])
+        if 'LastEvaluatedKey' not in page:
+            return
+        kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def repair_day_totals(
+        *,
+        database_client,
+        apply: bool,
+        user_id: typing.Optional[str] = None,
+) -> typing.Dict[str, int]:
+    """
+    :param database_client:
+    :param apply: False means dry run
+    :param user_id: only this user if set
+    :return: counters of what was done
+    """
+    meals_totals: typing.Dict[typing.Tuple[str, str], list] = {}
+    saved_totals: typing.Dict[typing.Tuple[str, str], dict] = {}
+    indexed = set()  # days with totals_date
+    for item in read_users_rows(database_client, user_id=user_id):
+        day = (item['id']['S'], item['date']['S'][:10])
+        meals_totals.setdefault(day, [])
+        if item['date']['S'] == day[1]:
+            saved_totals[day] = totals_from_item(item)
+            if totals_date in item:
+                indexed.add(day)
+        if 'meal' in item:
+            meals = [json.loads(item['meal']['S'])]
+        elif 'value' in item:
+            meals = json.loads(item['value']['S'])
+        else:
+            meals = []
+        meals_totals[day] += [meal_totals(m) for m in meals]
+
+    stats = {'days': 0, 'correct': 0, 'repaired': 0}
+    for (day_user_id, date), totals_list in meals_totals.items():
+        stats['days'] += 1
+        totals = sum_totals(totals_list)
+        saved = saved_totals.get((day_user_id, date))
+        if saved is not None and (day_user_id, date) in indexed and all(
+                abs(saved[n] - totals[n]) < 0.001 for n in totals_attributes):
+            stats['correct'] += 1
+            continue
+        print(f'{day_user_id} {date}: {saved} -> {totals}')
+        stats['repaired'] += 1
+        if not apply:
+            continue
+        database_client.update_item(
+            TableName='nutrition_users',
+            Key={'id': {'S': day_user_id}, 'date': {'S': date}},
+            UpdateExpression='SET ' + ', '.join(
+                f'{n} = :{n}' for n in totals_attributes + (totals_date,)),
+            ExpressionAttributeValues={
+                f':{totals_date}': {'S': date},
+                **{f':{n}': {'N': repr(totals[n])}
+                   for n in totals_attributes},
+            },
+        )
+    return stats
+
+
+if __name__ == '__main__':
+    arguments = [a for a in sys.argv[1:] if not a.startswith('--')]
+    client = get_dynamo_client(
+        lambda_mode=False,
+        profile_name=arguments[1] if len(arguments) > 1 else 'kreodont',
+    )
+    print(repair_day_totals(
+        database_client=client,
+        apply='--apply' in sys.argv,
+        user_id=arguments[0] if arguments else None,
+    ))
@@ -0,0 +1,296 @@
+import functools
+import json
+import os
+import threading
+import time
+import typing
+from tracing import add_record
+
+# What happened during one invocation: the chosen intent, the intents
+# evaluated before it, timings of evaluate and respond, cache outcomes,
+# HTTP and database calls. Timings are kept in histograms, which are
+# printed when the handler returns in CloudWatch Embedded Metric Format,
+# as part of the trace record if the invocation is traced (see tracing) or
+# as a line of its own. The histograms of many lines are added together by
+# merge_metrics.py, so percentiles can be found for any period.
+# RequestMetrics=0 turns it off, then every call here is one global lookup
+metrics_enabled = os.getenv('RequestMetrics', '1') == '1'
+namespace = os.getenv('TraceNamespace', 'NutritionDialog')
+
+# HDR-style buckets: values below 2 ** sub_bucket_bits are counted exactly,
+# above that every power of two is split into 2 ** (sub_bucket_bits - 1)
+# buckets, so a value is known with 3% precision whatever its magnitude
+sub_bucket_bits = 5
+sub_buckets = 2 ** sub_bucket_bits
+max_value = 2 ** 36 - 1  # microseconds, 19 hours. Longer are counted so
+
+# Intent dimension of invocations which failed before an intent was chosen,
+# CloudWatch doesn't accept an empty dimension value
+no_intent = 'None'
+
+
+def bucket_index(value: int) -> int:
+    if value < sub_buckets:
+        return value
+    shift = value.bit_length() - sub_bucket_bits
+    return (shift << (sub_bucket_bits - 1)) + (value >> shift)
+
+
+def bucket_range(index: int) -> typing.Tuple[int, int]:
+    """
+    :return: the lowest and the highest values of the bucket
+    """
+    if index < sub_buckets:
+        return index, index
+    shift = (index >> (sub_bucket_bits - 1)) - 1
+    lowest = (index - (shift << (sub_bucket_bits - 1))) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class Histogram:
+    """
+    Counts of values by bucket_index. Not more than bucket_index(max_value)
+    buckets whatever is recorded, histograms are merged by adding counts
+    """
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts: typing.Dict[int, int] = {}  # bucket index -> count
+        self.count = 0
+        self.total = 0
+        self.min = max_value
+        self.max = 0
+
+    def record(self, value: int) -> None:
+        value = min(max(value, 0), max_value)
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'Histogram') -> None:
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent: float) -> int:
+        """
+        :param percent: 0..100
+        :return: middle of the bucket, 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                lowest, highest = bucket_range(index)
+                return min(max((lowest + highest) // 2, self.min), self.max)
+        return self.max
+
+    def encode(self) -> dict:
+        return {
+            'n': self.count,
+            'sum': self.total,
+            'min': self.min,
+            'max': self.max,
+            'b': sorted(self.counts.items()),  # [[bucket index, count]]
+        }
+
+    @staticmethod
+    def decode(encoded: dict) -> 'Histogram':
+        histogram = Histogram()
+        histogram.counts = {int(i): int(c) for i, c in encoded['b']}
+        histogram.count = encoded['n']
+        histogram.total = encoded['sum']
+        histogram.min = encoded['min']
+        histogram.max = encoded['max']
+        return histogram
+
+
+class InvocationMetrics:
+    def __init__(self):
+        self.chosen_intent = no_intent
+        self.evaluated: typing.List[str] = []  # intent names in order
+        self.histograms: typing.Dict[str, Histogram] = {}  # microseconds
+        self.counters: typing.Dict[str, int] = {}
+        self.lock = threading.Lock()  # io_pipeline threads record too
+
+
+current: typing.Optional[InvocationMetrics] = None
+
+
+def observe(
+        name: str,
+        microseconds: int,
+        *,
+        metrics: typing.Optional[InvocationMetrics] = None,
+) -> None:
+    """
+    :param name: 'evaluate.Intent00001Hello', 'dynamodb.query'...
+    :param microseconds:
+    :param metrics: the current invocation if not set
+    """
+    metrics = metrics or current
+    if metrics is None:
+        return
+    with metrics.lock:
+        histogram = metrics.histograms.get(name)
+        if histogram is None:
+            histogram = metrics.histograms[name] = Histogram()
+        histogram.record(microseconds)
+
+
+def count(name: str, *, metrics: typing.Optional[InvocationMetrics] = None):
+    """
+    :param name: 'food_source.api', 'phrase_cache.l1'...
+    :param metrics: the current invocation if not set
+    """
+    metrics = metrics or current
+    if metrics is None:
+        return
+    with metrics.lock:
+        metrics.counters[name] = metrics.counters.get(name, 0) + 1
+
+
+class Timer:
+    """
+    with timed('http.translate.yandex.net'):
+        ...
+    The time goes to the invocation which was current when the timer was
+    created, failures are counted as '<name>.errors'
+    """
+    __slots__ = ('name', 'metrics', 'start_ns')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.metrics = current
+        self.start_ns = 0
+
+    def __enter__(self):
+        if self.metrics is not None:
+            self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if self.metrics is None:
+            return
+        observe(
+            self.name,
+            (time.perf_counter_ns() - self.start_ns) // 1000,
+            metrics=self.metrics,
+        )
+        if exc_type is not None:
+            count(f'{self.name}.errors', metrics=self.metrics)
+
+
+def timed(name: str) -> Timer:
+    return Timer(name)
+
+
+def record_evaluated(intent_name: str, nanoseconds: int) -> None:
+    if current is None:
+        return
+    current.evaluated.append(intent_name)
+    observe(f'evaluate.{intent_name}', nanoseconds // 1000)
+
+
+def record_chosen_intent(intent_name: str) -> None:
+    if current is not None:
+        current.chosen_intent = intent_name
+
+
+class MeteredClient:
+    """
+    Database client (boto3 or storage_backends) whose calls are counted
+    and timed as 'dynamodb.<method>'. Anything else is taken from the
+    client as is
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.client, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def metered(*args, **kwargs):
+            with Timer(f'dynamodb.{name}'):
+                return attribute(*args, **kwargs)
+
+        self.__dict__[name] = metered  # not to come here next time
+        return metered
+
+
+def milliseconds_total(metrics: InvocationMetrics, prefix: str) -> float:
+    return round(sum(h.total for n, h in metrics.histograms.items()
+                     if n.startswith(prefix)) / 1000, 2)
+
+
+def calls_count(metrics: InvocationMetrics, prefix: str) -> int:
+    return sum(h.count for n, h in metrics.histograms.items()
+               if n.startswith(prefix))
+
+
+def invocation_record(metrics: InvocationMetrics) -> dict:
+    values = {
+        'RespondMs': milliseconds_total(metrics, 'respond.'),
+        'EvaluateMs': milliseconds_total(metrics, 'evaluate.'),
+        'DynamoDBMs': milliseconds_total(metrics, 'dynamodb.'),
+        'HttpMs': milliseconds_total(metrics, 'http.'),
+        'DynamoDBCalls': calls_count(metrics, 'dynamodb.'),
+        'HttpCalls': calls_count(metrics, 'http.'),
+    }
+    return {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [['Intent']],
+                'Metrics': [
+                    {'Name': name,
+                     'Unit': 'Milliseconds' if name.endswith('Ms')
+                     else 'Count'}
+                    for name in values],
+            }],
+        },
+        'Intent': metrics.chosen_intent,
+        **values,
+        'Evaluated': metrics.evaluated,
+        'Counters': metrics.counters,
+        'Histograms': {name: h.encode()
+                       for name, h in metrics.histograms.items()},
+    }
+
+
+def measured_invocation(handler: typing.Callable) -> typing.Callable:
+    """
+    For the lambda handler, inside traced_invocation: collects the metrics
+    of every call and prints them with the trace when the handler returns
+    """
+    @functools.wraps(handler)
+    def measured(*args, **kwargs):
+        global current
+
+        if not metrics_enabled:
+            return handler(*args, **kwargs)
+        metrics = current = InvocationMetrics()
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            current = None
+            with metrics.lock:
+                record = invocation_record(metrics)
+            if not add_record(record):
+                print(json.dumps(record, ensure_ascii=False,
+                                 separators=(',', ':')))
+
+    return measured
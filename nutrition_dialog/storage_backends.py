@@ -0,0 +1,563 @@
+import abc
+import base64
+import copy
+import json
+import re
+import sqlite3
+import threading
+import typing
+
+# Backends which can be used instead of DynamoDB, see get_dynamo_client.
+# They take the same calls as boto3 DynamoDB client with the same item
+# format ({'S': ...}, {'N': ...}, {'B': ...}), so none of the functions
+# using the client has to know which storage is behind it. Only the
+# expressions used in this package are supported
+
+# table name -> (partition key, sort key or None)
+table_keys = {
+    'nutrition_sessions': ('id', None),
+    'nutrition_cache': ('initial_phrase', None),
+    'nutrition_users': ('id', 'date'),
+}
+# (table name, index name) -> (partition key, sort key) of global secondary
+# indexes, see day_totals. Items without the sort key are not in the index
+table_indexes = {
+    ('nutrition_users', 'totals_by_date'): ('id', 'totals_date'),
+}
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class TransactionCanceledException(Exception):
+    pass
+
+
+class StorageExceptions:
+    # the same names as database_client.exceptions of boto3
+    ConditionalCheckFailedException = ConditionalCheckFailedException
+    TransactionCanceledException = TransactionCanceledException
+
+
+def attribute_value(value: dict) -> typing.Any:
+    """
+    :param value: {'N': '12.5'}
+    :return: 12.5, numbers are compared as numbers
+    """
+    if 'N' in value:
+        return float(value['N'])
+    return next(iter(value.values()))
+
+
+def format_number(number: float) -> str:
+    return str(int(number)) if number == int(number) else repr(number)
+
+
+def resolve_name(name: str, names: dict) -> str:
+    name = name.strip()
+    return names.get(name, name)
+
+
+def evaluate_condition(
+        expression: typing.Optional[str],
+        item: typing.Optional[dict],
+        *,
+        names: dict,
+        values: dict,
+) -> bool:
+    """
+    :param expression: comparisons and attribute_exists/attribute_not_exists
+    joined with OR and AND (without parentheses)
+    :param item: None if the item doesn't exist
+    :param names: ExpressionAttributeNames
+    :param values: ExpressionAttributeValues
+    :return:
+    """
+    if not expression:
+        return True
+    item = item or {}
+    for alternative in re.split(r'\s+OR\s+', expression.strip()):
+        if all(evaluate_comparison(c, item, names=names, values=values)
+               for c in re.split(r'\s+AND\s+', alternative)):
+            return True
+    return False
+
+
+def evaluate_comparison(
+        comparison: str,
+        item: dict,
+        *,
+        names: dict,
+        values: dict,
+) -> bool:
+    comparison = comparison.strip()
+    function_match = re.fullmatch(
+        r'(attribute_exists|attribute_not_exists)\((.+)\)', comparison)
+    if function_match:
+        exists = resolve_name(function_match.group(2), names) in item
+        return exists == (function_match.group(1) == 'attribute_exists')
+    name, operator, value_name = re.fullmatch(
+        r'(\S+)\s*(<>|<=|>=|=|<|>)\s*(:\w+)', comparison).groups()
+    name = resolve_name(name, names)
+    if name not in item:
+        return operator == '<>'
+    left = attribute_value(item[name])
+    right = attribute_value(values[value_name])
+    return {
+        '=': left == right,
+        '<>': left != right,
+        '<': left < right,
+        '<=': left <= right,
+        '>': left > right,
+        '>=': left >= right,
+    }[operator]
+
+
+def apply_update(
+        item: dict,
+        expression: str,
+        *,
+        names: dict,
+        values: dict,
+) -> None:
+    """
+    :param item: changed in place
+    :param expression: SET a = :a, ... ADD b :b, ... REMOVE c, ...
+    :param names: ExpressionAttributeNames
+    :param values: ExpressionAttributeValues
+    """
+    clauses = re.findall(
+        r'(SET|ADD|REMOVE)\s+(.*?)(?=\s+(?:SET|ADD|REMOVE)\s|$)',
+        expression.strip())
+    for clause, body in clauses:
+        for action in [a.strip() for a in body.split(',') if a.strip()]:
+            if clause == 'SET':
+                name, value_name = action.split('=')
+                item[resolve_name(name, names)] = copy.deepcopy(
+                    values[value_name.strip()])
+            elif clause == 'ADD':
+                name, value_name = action.split()
+                name = resolve_name(name, names)
+                current = float(item[name]['N']) if name in item else 0.0
+                item[name] = {'N': format_number(
+                    current + float(values[value_name]['N']))}
+            else:
+                item.pop(resolve_name(action, names), None)
+
+
+def project(item: dict, expression: typing.Optional[str], *, names: dict):
+    if not expression:
+        return item
+    attributes = [resolve_name(n, names) for n in expression.split(',')]
+    return {n: item[n] for n in attributes if n in item}
+
+
+class ItemStorage(abc.ABC):
+    """
+    DynamoDB client calls on top of plain key-value storage of the
+    subclasses. All the calls are done under one lock, so conditional
+    writes and transactions are atomic like in DynamoDB
+    """
+    exceptions = StorageExceptions
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    # Storage of subclasses, items are dicts in DynamoDB format
+    @abc.abstractmethod
+    def _get(self, table: str, key: typing.Tuple[str, str]) \
+            -> typing.Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    def _put(self, table: str, key: typing.Tuple[str, str], item: dict):
+        ...
+
+    @abc.abstractmethod
+    def _delete(self, table: str, key: typing.Tuple[str, str]):
+        ...
+
+    @abc.abstractmethod
+    def _range(self, table: str, partition: str, sort_from: str) \
+            -> typing.Iterator[dict]:
+        """
+        Items of the partition with sort key >= sort_from, sorted by it
+        """
+
+    @abc.abstractmethod
+    def _all(self, table: str) -> typing.Iterator[dict]:
+        ...
+
+    def _transaction(self) -> typing.ContextManager:
+        return self._lock
+
+    @staticmethod
+    def _key(table: str, key_or_item: dict) -> typing.Tuple[str, str]:
+        partition_key, sort_key = table_keys[table]
+        return (
+            attribute_value(key_or_item[partition_key]),
+            attribute_value(key_or_item[sort_key]) if sort_key else '',
+        )
+
+    def get_item(self, *, TableName: str, Key: dict, **_) -> dict:
+        with self._lock:
+            item = self._get(TableName, self._key(TableName, Key))
+        return {'Item': item} if item is not None else {}
+
+    def put_item(
+            self,
+            *,
+            TableName: str,
+            Item: dict,
+            ConditionExpression: typing.Optional[str] = None,
+            ExpressionAttributeNames: typing.Optional[dict] = None,
+            ExpressionAttributeValues: typing.Optional[dict] = None,
+            **_,
+    ) -> dict:
+        key = self._key(TableName, Item)
+        with self._transaction():
+            self._check(TableName, key, ConditionExpression,
+                        ExpressionAttributeNames, ExpressionAttributeValues)
+            self._put(TableName, key, Item)
+        return {}
+
+    def delete_item(
+            self,
+            *,
+            TableName: str,
+            Key: dict,
+            ConditionExpression: typing.Optional[str] = None,
+            ExpressionAttributeNames: typing.Optional[dict] = None,
+            ExpressionAttributeValues: typing.Optional[dict] = None,
+            **_,
+    ) -> dict:
+        key = self._key(TableName, Key)
+        with self._transaction():
+            self._check(TableName, key, ConditionExpression,
+                        ExpressionAttributeNames, ExpressionAttributeValues)
+            self._delete(TableName, key)
+        return {}
+
+    def update_item(self, **kwargs) -> dict:
+        with self._transaction():
+            self._update(**kwargs)
+        return {}
+
+    def batch_get_item(self, *, RequestItems: dict, **_) -> dict:
+        responses = {}
+        with self._lock:
+            for table, request in RequestItems.items():
+                items = (self._get(table, self._key(table, k))
+                         for k in request['Keys'])
+                responses[table] = [i for i in items if i is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, *, RequestItems: dict, **_) -> dict:
+        with self._transaction():
+            for table, requests in RequestItems.items():
+                for request in requests:
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        self._put(table, self._key(table, item), item)
+                    else:
+                        self._delete(table, self._key(
+                            table, request['DeleteRequest']['Key']))
+        return {'UnprocessedItems': {}}
+
+    def transact_write_items(self, *, TransactItems: list, **_) -> dict:
+        with self._transaction():
+            for action in TransactItems:
+                (operation, request), = action.items()
+                key = self._key(
+                    request['TableName'],
+                    request.get('Key') or request.get('Item'))
+                try:
+                    self._check(
+                        request['TableName'],
+                        key,
+                        request.get('ConditionExpression'),
+                        request.get('ExpressionAttributeNames'),
+                        request.get('ExpressionAttributeValues'),
+                    )
+                except ConditionalCheckFailedException:
+                    raise TransactionCanceledException(operation)
+            for action in TransactItems:
+                (operation, request), = action.items()
+                table = request['TableName']
+                if operation == 'Put':
+                    item = request['Item']
+                    self._put(table, self._key(table, item), item)
+                elif operation == 'Delete':
+                    self._delete(table, self._key(table, request['Key']))
+                elif operation == 'Update':
+                    self._update(**{k: v for k, v in request.items()
+                                    if k != 'ConditionExpression'})
+        return {}
+
+    def query(
+            self,
+            *,
+            TableName: str,
+            KeyConditionExpression: str,
+            ExpressionAttributeValues: dict,
+            ExpressionAttributeNames: typing.Optional[dict] = None,
+            FilterExpression: typing.Optional[str] = None,
+            ProjectionExpression: typing.Optional[str] = None,
+            Limit: typing.Optional[int] = None,
+            ExclusiveStartKey: typing.Optional[dict] = None,
+            IndexName: typing.Optional[str] = None,
+            **_,
+    ) -> dict:
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues
+        partition_key, table_sort_key = table_keys[TableName]
+        sort_key = table_sort_key
+        if IndexName:
+            partition_key, sort_key = table_indexes[(TableName, IndexName)]
+        # '#id = :id' and optionally '#date = :date',
+        # 'begins_with(#date, :date)' or '#date BETWEEN :from AND :to'
+        partition_condition, sort_condition = (re.split(
+            r'\s+AND\s+', KeyConditionExpression.strip(), maxsplit=1)
+            + [''])[:2]
+        partition = values[partition_condition.split('=')[1].strip()]
+        sort_from, sort_to, prefix = '', None, None
+        between = re.fullmatch(
+            r'\S+\s+BETWEEN\s+(:\w+)\s+AND\s+(:\w+)', sort_condition)
+        begins = re.fullmatch(
+            r'begins_with\(\s*\S+\s*,\s*(:\w+)\s*\)', sort_condition)
+        equals = re.fullmatch(r'\S+\s*=\s*(:\w+)', sort_condition)
+        if between:
+            sort_from = values[between.group(1)]['S']
+            sort_to = values[between.group(2)]['S']
+        elif begins:
+            sort_from = prefix = values[begins.group(1)]['S']
+        elif equals:
+            sort_from = sort_to = values[equals.group(1)]['S']
+        if ExclusiveStartKey:
+            sort_from = ExclusiveStartKey[sort_key]['S'] + '\0'
+
+        items = []
+        last_key = None
+        with self._lock:
+            items_range = self._range(
+                TableName, attribute_value(partition),
+                '' if IndexName else sort_from)
+            if IndexName:
+                items_range = sorted(
+                    (i for i in items_range
+                     if sort_key in i and i[sort_key]['S'] >= sort_from),
+                    key=lambda i: i[sort_key]['S'])
+            for item in items_range:
+                sort_value = item[sort_key]['S'] if sort_key else ''
+                if sort_to is not None and sort_value > sort_to or \
+                        prefix is not None and \
+                        not sort_value.startswith(prefix):
+                    break
+                if Limit and len(items) == Limit:
+                    last_key = {partition_key: partition}
+                    last_key[sort_key] = items[-1][sort_key]
+                    if table_sort_key:
+                        last_key[table_sort_key] = items[-1][table_sort_key]
+                    break
+                items.append(item)
+        items = [project(i, ProjectionExpression, names=names)
+                 for i in items
+                 if evaluate_condition(FilterExpression, i,
+                                       names=names, values=values)]
+        result = {'Items': items, 'Count': len(items)}
+        if last_key:
+            result['LastEvaluatedKey'] = last_key
+        return result
+
+    def scan(self, *, TableName: str, **_) -> dict:
+        with self._lock:
+            items = list(self._all(TableName))
+        return {'Items': items, 'Count': len(items)}
+
+    def _check(
+            self,
+            table: str,
+            key: typing.Tuple[str, str],
+            expression: typing.Optional[str],
+            names: typing.Optional[dict],
+            values: typing.Optional[dict],
+    ) -> None:
+        if expression and not evaluate_condition(
+                expression, self._get(table, key),
+                names=names or {}, values=values or {}):
+            raise ConditionalCheckFailedException(expression)
+
+    def _update(
+            self,
+            *,
+            TableName: str,
+            Key: dict,
+            UpdateExpression: str,
+            ConditionExpression: typing.Optional[str] = None,
+            ExpressionAttributeNames: typing.Optional[dict] = None,
+            ExpressionAttributeValues: typing.Optional[dict] = None,
+            **_,
+    ) -> None:
+        key = self._key(TableName, Key)
+        self._check(TableName, key, ConditionExpression,
+                    ExpressionAttributeNames, ExpressionAttributeValues)
+        item = self._get(TableName, key) or copy.deepcopy(Key)
+        apply_update(
+            item,
+            UpdateExpression,
+            names=ExpressionAttributeNames or {},
+            values=ExpressionAttributeValues or {},
+        )
+        self._put(TableName, key, item)
+
+
+class MemoryStorage(ItemStorage):
+    """
+    Keeps tables in the memory of the process. For tests and load testing
+    without AWS
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._tables: typing.Dict[str, typing.Dict[tuple, dict]] = {
+            t: {} for t in table_keys}
+
+    def _get(self, table, key):
+        return copy.deepcopy(self._tables[table].get(key))
+
+    def _put(self, table, key, item):
+        self._tables[table][key] = copy.deepcopy(item)
+
+    def _delete(self, table, key):
+        self._tables[table].pop(key, None)
+
+    def _range(self, table, partition, sort_from):
+        keys = sorted(k for k in self._tables[table]
+                      if k[0] == partition and k[1] >= sort_from)
+        for key in keys:
+            yield copy.deepcopy(self._tables[table][key])
+
+    def _all(self, table):
+        return [copy.deepcopy(i) for i in self._tables[table].values()]
+
+
+def encode_item(item: dict) -> str:
+    # Binary attributes (see cache_records) are kept as base64
+    return json.dumps({
+        name: {'B64': base64.b64encode(value['B']).decode('ascii')}
+        if 'B' in value else value
+        for name, value in item.items()})
+
+
+def decode_item(text: str) -> dict:
+    return {
+        name: {'B': base64.b64decode(value['B64'])}
+        if 'B64' in value else value
+        for name, value in json.loads(text).items()}
+
+
+class SqliteStorage(ItemStorage):
+    """
+    Keeps tables in SQLite database file in WAL mode, so it can be read by
+    other processes while written. Can be used for self-hosted deployment
+    or to compare DynamoDB latency with. Statements have parameters, so
+    sqlite3 prepares them once and keeps in its statement cache
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._connection = sqlite3.connect(
+            path,
+            check_same_thread=False,  # io_pipeline threads, under the lock
+            isolation_level=None,  # transactions are started explicitly
+            cached_statements=32,
+        )
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            'table_name TEXT NOT NULL, '
+            'partition_key TEXT NOT NULL, '
+            'sort_key TEXT NOT NULL, '
+            'item TEXT NOT NULL, '
+            'PRIMARY KEY (table_name, partition_key, sort_key)'
+            ') WITHOUT ROWID')
+        self._transaction_depth = 0
+
+    def _transaction(self) -> typing.ContextManager:
+        return SqliteTransaction(self)
+
+    def _get(self, table, key):
+        row = self._connection.execute(
+            'SELECT item FROM items WHERE table_name = ? '
+            'AND partition_key = ? AND sort_key = ?',
+            (table, *key)).fetchone()
+        return decode_item(row[0]) if row else None
+
+    def _put(self, table, key, item):
+        self._connection.execute(
+            'INSERT OR REPLACE INTO items '
+            '(table_name, partition_key, sort_key, item) VALUES (?, ?, ?, ?)',
+            (table, *key, encode_item(item)))
+
+    def _delete(self, table, key):
+        self._connection.execute(
+            'DELETE FROM items WHERE table_name = ? '
+            'AND partition_key = ? AND sort_key = ?',
+            (table, *key))
+
+    def _range(self, table, partition, sort_from):
+        rows = self._connection.execute(
+            'SELECT item FROM items WHERE table_name = ? '
+            'AND partition_key = ? AND sort_key >= ? ORDER BY sort_key',
+            (table, partition, sort_from)).fetchall()
+        return (decode_item(r[0]) for r in rows)
+
+    def _all(self, table):
+        rows = self._connection.execute(
+            'SELECT item FROM items WHERE table_name = ?',
+            (table,)).fetchall()
+        return [decode_item(r[0]) for r in rows]
+
+
+class SqliteTransaction:
+    """
+    The lock of the storage plus SQLite transaction, so all the writes of
+    one call are committed together or not at all
+    """
+
+    def __init__(self, storage: SqliteStorage):
+        self.storage = storage
+
+    def __enter__(self):
+        self.storage._lock.acquire()
+        self.storage._transaction_depth += 1
+        if self.storage._transaction_depth == 1:
+            self.storage._connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.storage._transaction_depth -= 1
+        try:
+            if self.storage._transaction_depth == 0:
+                self.storage._connection.execute(
+                    'ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.storage._lock.release()
+
+
+def create_storage(
+        backend: str,
+        *,
+        sqlite_path: str = '/tmp/nutrition.sqlite3',
+) -> ItemStorage:
+    """
+    :param backend: 'memory' or 'sqlite'
+    :param sqlite_path: database file of sqlite backend
+    :return:
+    """
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sqlite':
+        return SqliteStorage(sqlite_path)
+    raise ValueError(f'Unknown storage backend "{backend}"')
@@ -0,0 +1,37 @@
+import pytest
+from cache_keys import canonical_cache_key
+
+# Phrases which must be one row of nutrition_cache
+same_food = [
+    ('гречки 200 грамм', '200 грамм гречки', 'гречка двести грамм',
+     'Гречка 200 г'),
+    ('банан и гречка 200 грамм', 'гречки 200 грамм, банан'),
+    ('два банана', '2 банана', 'бананов 2'),
+    ('яблоко', 'яблока', 'Яблоко'),
+    ('мороженое', 'мороженого'),
+    ('молоко 3.2%', 'молоко 3,2 процента'),
+    ('ёжевика', 'ежевика'),
+]
+
+# Phrases which must not: a wrong row is worse than a cache miss
+different_food = [
+    ('сало', 'салями'),
+    ('суп из сыра', 'сыр из супа'),
+    ('кофе', 'кофи'),
+    ('молоко 3.2%', 'молоко 3.2'),
+    ('молоко 3.2%', 'молоко 3.2 грамма'),
+    ('гречка 200 грамм', 'гречка 200 килограмм'),
+    ('гречка 200 грамм', 'гречка 300 грамм'),
+    ('курица с рисом', 'рис с курицей 100 грамм'),
+]
+
+
+@pytest.mark.parametrize('phrases', same_food)
+def test_same_food(phrases):
+    keys = {canonical_cache_key(phrase) for phrase in phrases}
+    assert len(keys) == 1, keys
+
+
+@pytest.mark.parametrize('first,second', different_food)
+def test_different_food(first, second):
+    assert canonical_cache_key(first) != canonical_cache_key(second)
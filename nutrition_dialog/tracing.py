@@ -0,0 +1,219 @@
+import functools
+import json
+import os
+import random
+import threading
+import time
+import typing
+
+# Timings of one invocation. Spans are opened with span() or with
+# decorators.timeit, spans opened inside another span of the same thread
+# are its children, spans of io_pipeline threads are children of the root.
+# Nothing is printed during the invocation, finish_trace prints one line
+# in CloudWatch Embedded Metric Format: total milliseconds of every span
+# name become metrics, the spans themselves go as a property to be read in
+# logs. Records of other modules (request_metrics) are added to the same
+# line with add_record. Invocations which are not sampled (TraceSampleRate, 0 disables
+# tracing) cost one global lookup per decorated call
+sample_rate = float(os.getenv('TraceSampleRate', '1'))
+namespace = os.getenv('TraceNamespace', 'NutritionDialog')
+max_spans = 200  # not to print a huge line if something is called in a loop
+
+
+class SpanTiming:
+    __slots__ = ('name', 'parent', 'start_ns', 'duration_ns')
+
+    def __init__(self, name: str, parent: int, start_ns: int):
+        self.name = name
+        self.parent = parent  # index in Trace.spans, -1 for the root
+        self.start_ns = start_ns  # perf_counter_ns
+        self.duration_ns: typing.Optional[int] = None  # None while open
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.spans: typing.List[SpanTiming] = [
+            SpanTiming(name, -1, time.perf_counter_ns())]
+        self.dropped = 0  # spans over max_spans
+        self.records: typing.List[dict] = []  # see add_record
+        self.lock = threading.Lock()
+
+    def open_span(self, name: str, parent: int) -> int:
+        """
+        :return: index of the span, -1 if it is dropped
+        """
+        with self.lock:
+            if len(self.spans) >= max_spans:
+                self.dropped += 1
+                return -1
+            self.spans.append(
+                SpanTiming(name, parent, time.perf_counter_ns()))
+            return len(self.spans) - 1
+
+
+current_trace: typing.Optional[Trace] = None  # None if not sampled
+span_stacks = threading.local()  # .stack: indexes of the open spans
+
+
+def thread_stack() -> typing.List[int]:
+    stack = getattr(span_stacks, 'stack', None)
+    if stack is None:
+        stack = span_stacks.stack = []
+    return stack
+
+
+class Span:
+    __slots__ = ('trace', 'index', 'name')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace = current_trace
+        self.index = -1
+
+    def __enter__(self):
+        if self.trace is None:
+            return self
+        stack = thread_stack()
+        self.index = self.trace.open_span(
+            self.name, stack[-1] if stack else 0)
+        if self.index >= 0:
+            stack.append(self.index)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.index < 0:
+            return
+        opened = self.trace.spans[self.index]
+        opened.duration_ns = time.perf_counter_ns() - opened.start_ns
+        stack = thread_stack()
+        if stack and stack[-1] == self.index:
+            stack.pop()
+
+
+def span(name: str) -> Span:
+    """
+    with span('query_api'):
+        ...
+    Does nothing if the invocation is not traced
+    """
+    return Span(name)
+
+
+def start_trace(name: str) -> typing.Optional[Trace]:
+    """
+    Starts the trace of an invocation if it is sampled
+    :param name: of the root span, handler name
+    :return: None if not sampled
+    """
+    global current_trace
+
+    if sample_rate > 0 and random.random() < sample_rate:
+        current_trace = Trace(name)
+        span_stacks.stack = [0]
+    else:
+        current_trace = None
+    return current_trace
+
+
+def add_record(record: dict) -> bool:
+    """
+    Adds another Embedded Metric Format record to the one of the current
+    trace, so the invocation is printed as one line
+    :param record: its metric directives go next to the one of the trace,
+    other keys become properties
+    :return: False if the invocation is not traced, then the caller prints
+    the record itself
+    """
+    trace = current_trace
+    if trace is None:
+        return False
+    with trace.lock:
+        trace.records.append(record)
+    return True
+
+
+def finish_trace(**properties) -> None:
+    """
+    Closes the root span and prints the record of the invocation. Spans
+    which are still open (writes after the response) are printed without
+    duration
+    :param properties: added to the record as is, to be searched in logs
+    """
+    global current_trace
+
+    trace = current_trace
+    if trace is None:
+        return
+    current_trace = None
+    span_stacks.stack = []
+    root = trace.spans[0]
+    root.duration_ns = time.perf_counter_ns() - root.start_ns
+    print(json.dumps(
+        trace_record(trace, properties),
+        ensure_ascii=False,
+        separators=(',', ':'),
+    ))
+
+
+def milliseconds(nanoseconds: int) -> float:
+    return round(nanoseconds / 1e6, 2)
+
+
+def trace_record(trace: Trace, properties: dict) -> dict:
+    """
+    :return: Embedded Metric Format record, see
+    https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/
+    CloudWatch_Embedded_Metric_Format_Specification.html
+    """
+    totals: typing.Dict[str, int] = {}
+    spans = []
+    root_start = trace.spans[0].start_ns
+    for s in list(trace.spans):
+        duration = s.duration_ns
+        if duration is not None:
+            totals[s.name] = totals.get(s.name, 0) + duration
+        spans.append([
+            s.name,
+            s.parent,
+            milliseconds(s.start_ns - root_start),
+            None if duration is None else milliseconds(duration),
+        ])
+    directives = [{
+        'Namespace': namespace,
+        'Dimensions': [['Handler']],
+        'Metrics': [{'Name': name, 'Unit': 'Milliseconds'}
+                    for name in totals],
+    }]
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': directives,
+        },
+        'Handler': trace.name,
+        'Spans': spans,  # [name, parent index, start ms, duration ms]
+    }
+    if trace.dropped:
+        record['SpansDropped'] = trace.dropped
+    for added in trace.records:
+        directives += added['_aws']['CloudWatchMetrics']
+        record.update((k, v) for k, v in added.items() if k != '_aws')
+    record.update(properties)
+    record.update((name, milliseconds(ns)) for name, ns in totals.items())
+    return record
+
+
+def traced_invocation(handler: typing.Callable) -> typing.Callable:
+    """
+    For the lambda handler: every sampled call is a trace, its record is
+    printed when the handler returns
+    """
+    @functools.wraps(handler)
+    def traced(*args, **kwargs):
+        start_trace(handler.__name__)
+        try:
+            return handler(*args, **kwargs)
+        finally:
+            finish_trace()
+
+    return traced
@@ -0,0 +1,95 @@
+import os
+import typing
+from LruCache import LruCache
+from request_metrics import count
+from Deadline import Deadline, no_deadline
+from dynamodb_functions import get_translation_from_cache_table, \
+    write_translation_to_cache_table
+
+# Translations are stable, so they can live long. Failed translations are
+# remembered only for a short time, not to call Yandex Translate for every
+# retry while it is down, and are never saved into database
+translation_ttl_seconds = 24 * 60 * 60
+failed_translation_ttl_seconds = 60
+# Cached instead of the translation which failed, compared with 'is': no
+# string can be mistaken for it, even an empty translation
+failed_translation = object()
+
+# First level, lives as long as the lambda container
+translations_l1 = LruCache(
+    max_items=int(os.getenv('TranslationCacheSize', '2000')),
+    ttl_seconds=translation_ttl_seconds,
+)
+
+# Second level is nutrition_cache table, see get_translation_from_cache_table
+
+
+def normalize_tokens(tokens: typing.Iterable[str]) -> str:
+    """
+    Key of the translation cache
+    :param tokens: ['Гречка', '200', 'грамм']
+    :return: 'гречка 200 грамм'
+    """
+    return ' '.join(t.lower().strip() for t in tokens if t.strip())
+
+
+def get_translation(
+        *,
+        phrase: str,
+        lambda_mode: bool,
+        deadline: Deadline = no_deadline,
+) -> typing.Union[str, object, None]:
+    """
+    :param phrase: normalized with normalize_tokens
+    :param lambda_mode:
+    :param deadline: of the request
+    :return: translation, failed_translation if the phrase failed to be
+    translated recently or None if nothing is known about the phrase
+    """
+    translation = translations_l1.get(phrase)
+    if translation is not None:
+        count('translation_cache.l1')
+        return translation
+
+    translation = get_translation_from_cache_table(
+        phrase=phrase,
+        lambda_mode=lambda_mode,
+        deadline=deadline,
+    )
+    if translation is None:
+        count('translation_cache.miss')
+        return None
+    count('translation_cache.l2')
+    translations_l1.put(phrase, translation)
+    return translation
+
+
+def translation_in_l1(phrase: str) -> bool:
+    """
+    :param phrase: normalized with normalize_tokens
+    :return: True if the translation or its failure is in memory, then
+    get_translation doesn't read the database
+    """
+    return translations_l1.get(phrase) is not None
+
+
+def save_translation(
+        *,
+        phrase: str,
+        translation: str,
+        lambda_mode: bool,
+) -> None:
+    translations_l1.put(phrase, translation)
+    write_translation_to_cache_table(
+        phrase=phrase,
+        translation=translation,
+        lambda_mode=lambda_mode,
+    )
+
+
+def save_failed_translation(*, phrase: str) -> None:
+    translations_l1.put(
+        phrase,
+        failed_translation,
+        ttl_seconds=failed_translation_ttl_seconds,
+    )
@@ -0,0 +1,170 @@
+import collections
+import os
+import threading
+import time
+import typing
+from botocore.vendored.requests.exceptions import ReadTimeout, ConnectTimeout
+from storage_backends import table_keys
+import io_pipeline
+
+# Puts and deletes the response doesn't depend on are collected here during
+# the request and written together with batch_write_item. Only the last
+# mutation of every key is kept (context cleared and then saved again is
+# one put), so a batch never has the same key twice, and flushes go one
+# after another, so writes of the same key are never reordered.
+#
+# WriteBehindFlush=sync (default) writes everything before the response is
+# returned. With after_response only non-deferrable writes (context, which
+# the next message needs) are written before, the rest (cache) is written
+# in background after the response. AWS lambda freezes the container when
+# the handler returns, so such writes finish during the next call of the
+# container and are lost if it is never called again. When the request
+# deadline is exceeded, deferrable writes are postponed so in any mode
+flush_mode = os.getenv('WriteBehindFlush', 'sync')
+batch_size = 25  # batch_write_item limit
+unprocessed_retries = 3
+
+
+class Mutation(typing.NamedTuple):
+    table: str
+    request: dict  # {'PutRequest': ...} or {'DeleteRequest': ...}
+    deferrable: bool  # can be written after the response
+
+
+# (table, key values) -> the last mutation of the key
+pending: typing.Dict[tuple, Mutation] = collections.OrderedDict()
+pending_lock = threading.Lock()
+flush_lock = threading.Lock()
+failed_keys: typing.Set[tuple] = set()  # not written by the last flushes
+stats = {'queued': 0, 'coalesced': 0, 'written': 0, 'batches': 0,
+         'failed': 0}
+
+
+def mutation_key(table: str, key_or_item: dict) -> tuple:
+    partition_key, sort_key = table_keys[table]
+    return (
+        table,
+        key_or_item[partition_key]['S'],
+        key_or_item[sort_key]['S'] if sort_key else '',
+    )
+
+
+def enqueue(mutation: Mutation, key: tuple) -> None:
+    with pending_lock:
+        stats['queued'] += 1
+        if key in pending:
+            stats['coalesced'] += 1
+            # Deferrable only if both writes are
+            mutation = mutation._replace(
+                deferrable=mutation.deferrable and pending[key].deferrable)
+            del pending[key]  # the newest goes last
+        pending[key] = mutation
+        failed_keys.discard(key)
+
+
+def put_item(*, table: str, item: dict, deferrable: bool) -> None:
+    enqueue(
+        Mutation(table, {'PutRequest': {'Item': item}}, deferrable),
+        mutation_key(table, item),
+    )
+
+
+def delete_item(*, table: str, key: dict, deferrable: bool) -> None:
+    enqueue(
+        Mutation(table, {'DeleteRequest': {'Key': key}}, deferrable),
+        mutation_key(table, key),
+    )
+
+
+def take_pending(*, include_deferrable: bool) -> typing.List[tuple]:
+    with pending_lock:
+        taken = [(k, m) for k, m in pending.items()
+                 if include_deferrable or not m.deferrable]
+        for key, _ in taken:
+            del pending[key]
+    return taken
+
+
+def flush(database_client, *, include_deferrable: bool = True) -> None:
+    """
+    Writes pending mutations with batch_write_item, up to 25 in a batch.
+    Keys which failed are kept in failed_keys
+    :param database_client: see get_dynamo_client
+    :param include_deferrable: False to write only what can't wait
+    """
+    with flush_lock:
+        taken = take_pending(include_deferrable=include_deferrable)
+        if not taken:
+            return
+        for start in range(0, len(taken), batch_size):
+            batch = taken[start:start + batch_size]
+            request_items = collections.defaultdict(list)
+            for _, mutation in batch:
+                request_items[mutation.table].append(mutation.request)
+            try:
+                unprocessed = write_batch(database_client, request_items)
+            except (ConnectTimeout, ReadTimeout) as e:
+                print(f'Timeout when writing {len(batch)} items: {e}')
+                unprocessed = request_items
+            unprocessed_keys = {
+                mutation_key(t, r.get('PutRequest', {}).get('Item') or
+                             r['DeleteRequest']['Key'])
+                for t, requests in unprocessed.items() for r in requests}
+            stats['batches'] += 1
+            stats['written'] += len(batch) - len(unprocessed_keys)
+            stats['failed'] += len(unprocessed_keys)
+            with pending_lock:
+                # unless written again meanwhile
+                failed_keys.update(k for k in unprocessed_keys
+                                   if k not in pending)
+
+
+def write_batch(database_client, request_items: dict) -> dict:
+    """
+    :return: items still unprocessed after retries
+    """
+    for attempt in range(unprocessed_retries + 1):
+        result = database_client.batch_write_item(
+            RequestItems=dict(request_items))
+        request_items = result.get('UnprocessedItems') or {}
+        if not request_items:
+            return {}
+        time.sleep(0.01 * 2 ** attempt)
+    return request_items
+
+
+def flush_before_response(
+        database_client,
+        *,
+        defer_cache: bool = False,
+) -> None:
+    """
+    :param database_client:
+    :param defer_cache: True to leave deferrable writes for after the
+    response whatever the mode is
+    """
+    flush(
+        database_client,
+        include_deferrable=flush_mode != 'after_response' and not defer_cache,
+    )
+
+
+def flush_after_response(
+        database_client,
+        *,
+        defer_cache: bool = False,
+) -> None:
+    """
+    Starts writing deferred mutations without waiting for them
+    :param database_client:
+    :param defer_cache: the same as for flush_before_response
+    """
+    if (flush_mode == 'after_response' or defer_cache) and pending:
+        io_pipeline.submit(flush, database_client)
+
+
+def was_written(table: str, key: dict) -> bool:
+    """
+    :return: False if the last flush of the key failed
+    """
+    return mutation_key(table, key) not in failed_keys
@@ -1,13 +1,14 @@
-from dataclasses import dataclass, replace
+from dataclasses import dataclass
 import typing
-from functools import reduce
 from DialogContext import DialogContext
+from PrefetchedItems import PrefetchedItems
 from User import User
+from Deadline import Deadline, no_deadline
+from event_parser import event_field, parse_event
 import hashlib
 
 
-@dataclass(frozen=True)
-class YandexRequest:
+class YandexRequest(typing.NamedTuple):
     """
     Request example:
     {
@@ -40,6 +41,9 @@ class YandexRequest:
   },
   "version": "1.0"
 }
+    A tuple, so it takes no __dict__ and fields are read as fast as slots.
+    Every set_* returns a shallow copy, the mutable intents_matching_dict
+    and prefetched are shared by all copies of one request
     """
     client_device_id: str  # meta -> client_id
     has_screen: bool  # meta -> interfaces -> screen
@@ -62,6 +66,8 @@ class YandexRequest:
     # loaded from DynamoDB
     food_dict: dict  # Response from the API
     api_keys: dict  # To query API
+    prefetched: PrefetchedItems  # Database items loaded once per request,
+    # shared by all copies
     chosen_intent: typing.Any = None  # Intent which will be executed.
     translated_phrase: str = ''  # Phrase translated into English
     # Can be
@@ -72,6 +78,20 @@ class YandexRequest:
     food_already_in_cache: bool = False  # Not to write it again
     automatic_save: bool = False  # If set yes, don't ask a user if he wants
     # to save the food, save it automatically and don't save context
+    deadline: Deadline = no_deadline  # Time left to answer, shared by all
+    # copies
+
+    def replace(self, **changes) -> 'YandexRequest':
+        """
+        Like dataclasses.replace or _replace, but without building the
+        object field by field
+        :param changes: field -> new value
+        :return: copy with the changes
+        """
+        values = list(self)
+        for name, value in changes.items():
+            values[field_indexes[name]] = value
+        return tuple.__new__(YandexRequest, values)
 
     @staticmethod
     def empty_request(*, aws_lambda_mode: bool, error: str):
@@ -101,34 +121,50 @@ class YandexRequest:
                 translated_phrase='',
                 food_dict={},
                 api_keys={},
+                prefetched=PrefetchedItems(),
                 user=User(authentificated=False, id='empty', log_hash='empty'),
         )
 
     def set_context(self, context: typing.Optional[DialogContext]):
-        return replace(self, context=context)
+        return self.replace(context=context)
 
     def set_chosen_intent(self, chosen_intent):
-        return replace(self, chosen_intent=chosen_intent)
+        return self.replace(chosen_intent=chosen_intent)
 
     def set_translated_phrase(self, translated):
-        return replace(self, translated_phrase=translated)
+        return self.replace(translated_phrase=translated)
 
     def set_original_utterance(self, utterance):
-        return replace(self, original_utterance=utterance)
+        return self.replace(original_utterance=utterance)
 
     def set_food_dict(self, food_dict):
-        return replace(self, food_dict=food_dict)
+        return self.replace(food_dict=food_dict)
 
     def set_api_keys(self, api_keys: dict):
-        return replace(self, api_keys=api_keys)
+        return self.replace(api_keys=api_keys)
 
     def set_food_already_in_cache(self):
-        return replace(self, food_already_in_cache=True)
+        return self.replace(food_already_in_cache=True)
 
     def __repr__(self):
+        # Called by every print of a request, so without food_dict and
+        # context, which can be long. See describe for all the fields
+        chosen_intent = getattr(self.chosen_intent, '__name__', None)
+        return f'YandexRequest(session_id={self.session_id!r}, ' \
+            f'message_id={self.message_id}, command={self.command!r}, ' \
+            f'chosen_intent={chosen_intent})'
+
+    def describe(self) -> str:
+        """
+        :return: all the fields, one per line
+        """
         return '\n'.join(
-                [f'{key:20}: {self.__dict__[key]}' for
-                 key in sorted(self.__dict__.keys())]) + '\n\n'
+                [f'{key:20}: {getattr(self, key)}' for
+                 key in sorted(self._fields)]) + '\n\n'
+
+
+# Field -> index in the tuple, for replace
+field_indexes = {name: i for i, name in enumerate(YandexRequest._fields)}
 
 
 @dataclass(frozen=True)
@@ -148,158 +184,78 @@ class YandexResponse:
                  key in sorted(self.__dict__.keys())])
 
 
+# Read from every event by transform_event_dict_to_yandex_request_object
+request_fields = (
+    event_field('meta', 'meta', required=True, value_type=dict),
+    event_field('client_id', 'meta -> client_id', required=True,
+                value_type=str),
+    event_field('timezone', 'meta -> timezone', required=True,
+                value_type=str),
+    event_field('screen', 'meta -> interfaces -> screen'),
+    event_field('is_new_session', 'session -> new', required=True,
+                value_type=bool),
+    event_field('user_guid', 'session -> user_id', required=True,
+                value_type=str),
+    event_field('version', 'version', default='1.0'),
+    event_field('session_id', 'session -> session_id', required=True,
+                value_type=str),
+    event_field('message_id', 'session -> message_id', required=True,
+                value_type=int),
+    event_field('original_utterance', 'request -> original_utterance',
+                default='', value_type=str),
+    event_field('command', 'request -> command', value_type=str),
+    event_field('tokens', 'request -> nlu -> tokens', value_type=list),
+    event_field('entities', 'request -> nlu -> entities', value_type=list),
+    event_field('authenticated_id', 'session -> user -> user_id'),
+)
+
+
 def transform_event_dict_to_yandex_request_object(
         *,
         event_dict: dict,
         aws_lambda_mode: bool,
+        deadline: Deadline = no_deadline,
 ) -> YandexRequest:
     """
     Reads the dict from yandex and try to construct
     YandexRequest object out of it
     :param event_dict:
     :param aws_lambda_mode:
-    :return:
+    :param deadline: created by the handler
+    :return: empty request with all the errors if the event is invalid
     """
-    meta = fetch_one_value_from_event_dict(
-            event_dict=event_dict,
-            path='meta')
-    if meta is None:
+    values, errors = parse_event(event_dict, request_fields)
+    if errors:
         return YandexRequest.empty_request(
                 aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: meta is None')
-
-    client_device_id = fetch_one_value_from_event_dict(
-            path='meta -> client_id',
-            event_dict=event_dict)
-    if client_device_id is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: client_id is None')
-    # partial_constructor = partial(YandexRequest,
-    #                               client_device_id=client_device_id)
-
-    timezone = fetch_one_value_from_event_dict(
-            path='meta -> timezone',
-            event_dict=event_dict)
-    if timezone is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: timezone is None')
-    # partial_constructor = partial(partial_constructor,
-    #                               timezone=timezone)
-
-    has_screen = fetch_one_value_from_event_dict(
-            path='meta -> interfaces -> screen',
-            event_dict=event_dict)
-    has_screen = False if has_screen is None else True
-    # partial_constructor = partial(partial_constructor,
-    #                               has_screen=has_screen)
-
-    is_new_session = fetch_one_value_from_event_dict(
-            path='session -> new',
-            event_dict=event_dict)
-    if is_new_session is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: is_new_session is None')
-    # partial_constructor = partial(partial_constructor,
-    #                               is_new_session=is_new_session)
-
-    user_guid = fetch_one_value_from_event_dict(
-            path='session -> user_id',
-            event_dict=event_dict)
-
-    if user_guid is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: user_guid is None')
-    # partial_constructor = partial(partial_constructor,
-    #                               user_guid=user_guid)
-
-    version = fetch_one_value_from_event_dict(
-            path='version',
-            event_dict=event_dict)
-    version = '1.0' if version is None else version
-    # partial_constructor = partial(partial_constructor,
-    #                               version=version)
-
-    session_id = fetch_one_value_from_event_dict(
-            path='session -> session_id',
-            event_dict=event_dict)
-    if user_guid is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: session_id is None')
-    # partial_constructor = partial(partial_constructor,
-    #                               session_id=session_id)
-
-    message_id = fetch_one_value_from_event_dict(
-            path='session -> message_id',
-            event_dict=event_dict)
-    if message_id is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: message_id is None')
-    # partial_constructor = partial(partial_constructor,
-    #                               message_id=message_id)
-
-    original_utterance = fetch_one_value_from_event_dict(
-            path='request -> original_utterance',
-            event_dict=event_dict)
-    original_utterance = '' if \
-        original_utterance is None \
-        else original_utterance
-    # partial_constructor = partial(partial_constructor,
-    #                               original_utterance=original_utterance)
-
-    command = fetch_one_value_from_event_dict(
-            path='request -> command',
-            event_dict=event_dict)
-
-    # partial_constructor = partial(
-    #         partial_constructor,
-    #         command=command)
-
-    tokens = fetch_one_value_from_event_dict(
-            path='request -> nlu -> tokens',
-            event_dict=event_dict)
-
-    tokens = [] if tokens is None else tokens
-
-    # partial_constructor = partial(partial_constructor,
-    #                               tokens=tokens)
-
-    entities = fetch_one_value_from_event_dict(
-            path='request -> nlu -> entities',
-            event_dict=event_dict,)
-    entities = [] if entities is None else entities
-    authenticated_id = fetch_one_value_from_event_dict(
-        event_dict=event_dict, path='session -> user -> user_id')
-    if authenticated_id:
-        user_guid = authenticated_id
+                error=f'Invalid request: {", ".join(errors)}')
 
+    user_guid = values['authenticated_id'] or values['user_guid']
     return YandexRequest(
-        client_device_id=client_device_id,
+        client_device_id=values['client_id'],
         api_keys={},
         aws_lambda_mode=aws_lambda_mode,
-        entities=entities,
+        entities=values['entities'] or [],
         context=None,
         intents_matching_dict={},
         food_dict={},
+        prefetched=PrefetchedItems(),
         write_to_food_cache=event_dict.get('write_to_food_cache'),
-        command=command,
-        has_screen=has_screen,
-        is_new_session=is_new_session,
-        message_id=message_id,
-        original_utterance=original_utterance,
-        session_id=session_id,
-        timezone=timezone, tokens=tokens,
+        command=values['command'],
+        has_screen=values['screen'] is not None,
+        is_new_session=values['is_new_session'],
+        message_id=values['message_id'],
+        original_utterance=values['original_utterance'],
+        session_id=values['session_id'],
+        timezone=values['timezone'],
+        tokens=values['tokens'] or [],
         user=User(
             id=user_guid,
-            authentificated=bool(authenticated_id),
+            authentificated=bool(values['authenticated_id']),
             log_hash=log_hash(user_guid)),
         user_guid=user_guid,
-        version=version,
+        version=values['version'],
+        deadline=deadline,
     )
 
 
@@ -312,31 +268,6 @@ def log_hash(user_id: str) -> str:
     return str(shorter_int).zfill(4)
 
 
-def fetch_one_value_from_event_dict(
-        *,
-        event_dict: dict,
-        path: str) -> typing.Optional[typing.Any]:
-    """
-    To extract data from multilevel dictionary using the following syntax:
-    'meta -> interfaces -> screen'
-    :param event_dict:
-    :param path:
-    :return:
-    """
-    if not isinstance(event_dict, dict):
-        return None
-    value = None
-    try:
-        value = reduce(
-                dict.get,
-                [t.strip() for t in path.split('->')],
-                event_dict)
-    except TypeError:
-        pass
-
-    return value
-
-
 def add_button(response: YandexResponse, button_text, button_link) -> \
         YandexResponse:
     response.buttons.append({'text': button_text, 'link': button_link})
@@ -97,6 +97,8 @@ def get_boto3_client(
     return client, False
 
 
+# Retired, see retired_folders in deployer.py: the days of nutrition_users
+# are not a single 'value' list anymore
 @timeit
 def update_user_table(
         *,
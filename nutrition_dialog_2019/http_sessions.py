@@ -0,0 +1,131 @@
+import os
+import threading
+import typing
+import urllib.parse
+import requests
+import requests.adapters
+
+try:  # Only needed for HTTP/2, which is off by default
+    import httpx
+except ImportError:
+    httpx = None
+
+# Settings of upstream hosts. pool_size is how many keep-alive connections
+# are kept for the host (the same as io_pipeline threads is enough),
+# timeout is used if the caller doesn't pass its own
+hosts_settings = {
+    'translate.yandex.net': {'pool_size': 4, 'timeout': 1.0},
+    'trackapi.nutritionix.com': {'pool_size': 4, 'timeout': 0.5},
+}
+default_host_settings = {'pool_size': 2, 'timeout': 1.0}
+
+use_http2 = os.getenv('Http2', '0') == '1' and httpx is not None
+
+# Like global_client in dynamodb_functions: AWS lambda keeps them between
+# calls, so TCP and TLS handshakes are made only once per container
+global_sessions: typing.Dict[str, typing.Any] = {}
+global_sessions_lock = threading.Lock()
+
+# host -> {'requests': ..., 'hits': ..., 'misses': ...}, hit means that
+# already opened connection was reused
+pool_stats: typing.Dict[str, typing.Dict[str, int]] = {}
+
+
+class Http2Response:
+    """
+    The same attributes of httpx response as the ones of requests response
+    used in this project
+    """
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.text = response.text
+        self.reason = response.reason_phrase
+
+    def __bool__(self):
+        return self.status_code < 400
+
+
+def host_settings(host: str) -> dict:
+    return hosts_settings.get(host, default_host_settings)
+
+
+def get_session(host: str):
+    with global_sessions_lock:
+        if host not in global_sessions:
+            pool_size = host_settings(host)['pool_size']
+            if use_http2:
+                session = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=pool_size,
+                        max_keepalive_connections=pool_size,
+                    ),
+                )
+            else:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=pool_size,
+                    max_retries=0,
+                )
+                session.mount(f'https://{host}', adapter)
+                session.mount(f'http://{host}', adapter)
+            global_sessions[host] = session
+            pool_stats[host] = {'requests': 0, 'hits': 0, 'misses': 0}
+    return global_sessions[host]
+
+
+def _opened_connections(session, url: str) -> int:
+    pools = session.get_adapter(url).poolmanager.pools
+    return sum(pools[key].num_connections for key in pools.keys())
+
+
+def request(
+        method: str,
+        url: str,
+        *,
+        timeout: typing.Optional[float] = None,
+        **kwargs,
+):
+    """
+    The same as requests.request, but with keep-alive connection reused from
+    the pool of the host
+    :param method: 'GET', 'POST'
+    :param url:
+    :param timeout: seconds, default for the host if not set
+    :param kwargs: params, data, headers
+    :return: response
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    if timeout is None:
+        timeout = host_settings(host)['timeout']
+    session = get_session(host)
+    stats = pool_stats[host]
+    stats['requests'] += 1
+
+    if use_http2:
+        try:
+            return Http2Response(
+                session.request(method, url, timeout=timeout, **kwargs))
+        except httpx.TimeoutException as e:
+            raise requests.ReadTimeout(str(e))
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e))
+
+    opened_before = _opened_connections(session, url)
+    try:
+        return session.request(method, url, timeout=timeout, **kwargs)
+    finally:
+        if _opened_connections(session, url) > opened_before:
+            stats['misses'] += 1
+        else:
+            stats['hits'] += 1
+
+
+def get(url: str, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs):
+    return request('POST', url, **kwargs)
@@ -5,6 +5,7 @@ import re
 from decorators import timeit
 from botocore.vendored.requests.exceptions import ReadTimeout, ConnectTimeout
 import requests
+import http_sessions
 import boto3
 from yandex_types import YandexRequest
 from dataclasses import replace
@@ -34,12 +35,15 @@ def translate_text_from_russian_to_english_with_yandex(
         russian_text: str,
         api_key: str,
 ) -> str:
-    response = requests.get(
-            'https://translate.yandex.net/api/v1.5/tr.json/translate',
-            params={'key': api_key,
-                    'text': russian_text,
-                    'lang': 'ru-en'
-                    })
+    try:
+        response = http_sessions.get(
+                'https://translate.yandex.net/api/v1.5/tr.json/translate',
+                params={'key': api_key,
+                        'text': russian_text,
+                        'lang': 'ru-en'
+                        })
+    except requests.Timeout:
+        return 'Error: timeout'
     json_dict = json.loads(response.text)
     full_phrase_translated = json_dict['text'][0]
 
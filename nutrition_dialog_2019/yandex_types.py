@@ -1,7 +1,6 @@
 from dataclasses import dataclass
 import typing
-from decorators import timeit
-from functools import partial, reduce
+from event_parser import event_field, parse_event
 import hashlib
 
 
@@ -67,145 +66,57 @@ class YandexResponse:
                  key in sorted(self.__dict__.keys())])
 
 
+# Read from every event by transform_event_dict_to_yandex_request_object
+request_fields = (
+    event_field('meta', 'meta', required=True, value_type=dict),
+    event_field('client_id', 'meta -> client_id', required=True,
+                value_type=str),
+    event_field('timezone', 'meta -> timezone', required=True,
+                value_type=str),
+    event_field('screen', 'meta -> interfaces -> screen'),
+    event_field('is_new_session', 'session -> new', required=True,
+                value_type=bool),
+    event_field('user_guid', 'session -> user_id', required=True,
+                value_type=str),
+    event_field('version', 'version', default='1.0'),
+    event_field('session_id', 'session -> session_id', required=True,
+                value_type=str),
+    event_field('message_id', 'session -> message_id', required=True,
+                value_type=int),
+    event_field('original_utterance', 'request -> original_utterance',
+                default='', value_type=str),
+    event_field('command', 'request -> command', value_type=str),
+    event_field('tokens', 'request -> nlu -> tokens', value_type=list),
+    event_field('entities', 'request -> nlu -> entities', value_type=list),
+)
+
+
 def transform_event_dict_to_yandex_request_object(
         *,
         event_dict: dict,
         aws_lambda_mode: bool,
 ) -> YandexRequest:
-    meta = fetch_one_value_from_event_dict(
-            event_dict=event_dict,
-            path='meta')
-    if meta is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: meta is None')
-
-    client_device_id = fetch_one_value_from_event_dict(
-            path='meta -> client_id',
-            event_dict=event_dict)
-    if client_device_id is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: client_id is None')
-    partial_constructor = partial(YandexRequest,
-                                  client_device_id=client_device_id)
-
-    timezone = fetch_one_value_from_event_dict(
-            path='meta -> timezone',
-            event_dict=event_dict)
-    if timezone is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: timezone is None')
-    partial_constructor = partial(partial_constructor,
-                                  timezone=timezone)
-
-    has_screen = fetch_one_value_from_event_dict(
-            path='meta -> interfaces -> screen',
-            event_dict=event_dict)
-    has_screen = False if has_screen is None else True
-    partial_constructor = partial(partial_constructor,
-                                  has_screen=has_screen)
-
-    is_new_session = fetch_one_value_from_event_dict(
-            path='session -> new',
-            event_dict=event_dict)
-    if is_new_session is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: is_new_session is None')
-    partial_constructor = partial(partial_constructor,
-                                  is_new_session=is_new_session)
-
-    user_guid = fetch_one_value_from_event_dict(
-            path='session -> user_id',
-            event_dict=event_dict)
-
-    if user_guid is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: user_guid is None')
-    partial_constructor = partial(partial_constructor,
-                                  user_guid=user_guid)
-
-    version = fetch_one_value_from_event_dict(
-            path='version',
-            event_dict=event_dict)
-    version = '1.0' if version is None else version
-    partial_constructor = partial(partial_constructor,
-                                  version=version)
-
-    session_id = fetch_one_value_from_event_dict(
-            path='session -> session_id',
-            event_dict=event_dict)
-    if user_guid is None:
+    values, errors = parse_event(event_dict, request_fields)
+    if errors:
         return YandexRequest.empty_request(
                 aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: session_id is None')
-    partial_constructor = partial(partial_constructor,
-                                  session_id=session_id)
-
-    message_id = fetch_one_value_from_event_dict(
-            path='session -> message_id',
-            event_dict=event_dict)
-    if message_id is None:
-        return YandexRequest.empty_request(
-                aws_lambda_mode=aws_lambda_mode,
-                error='Invalid request: message_id is None')
-    partial_constructor = partial(partial_constructor,
-                                  message_id=message_id)
-
-    original_utterance = fetch_one_value_from_event_dict(
-            path='request -> original_utterance',
-            event_dict=event_dict)
-    original_utterance = '' if \
-        original_utterance is None \
-        else original_utterance
-    partial_constructor = partial(partial_constructor,
-                                  original_utterance=original_utterance)
-
-    command = fetch_one_value_from_event_dict(
-            path='request -> command',
-            event_dict=event_dict)
-
-    partial_constructor = partial(
-            partial_constructor,
-            command=command)
-
-    tokens = fetch_one_value_from_event_dict(
-            path='request -> nlu -> tokens',
-            event_dict=event_dict)
-
-    tokens = [] if tokens is None else tokens
-
-    partial_constructor = partial(partial_constructor,
-                                  tokens=tokens)
-
-    entities = fetch_one_value_from_event_dict(
-            path='request -> nlu -> entities',
-            event_dict=event_dict)
-    entities = [] if entities is None else entities
-    full_yandex_request_constructor = partial(partial_constructor,
-                                              entities=entities)
-
-    return full_yandex_request_constructor(aws_lambda_mode=aws_lambda_mode)
-
-
-def fetch_one_value_from_event_dict(
-        *,
-        event_dict: dict,
-        path: str) -> typing.Optional[typing.Any]:
-    if not isinstance(event_dict, dict):
-        return None
-    value = None
-    try:
-        value = reduce(
-                dict.get, [t.strip() for t in path.split('->')],
-                event_dict)
-    except TypeError:
-        pass
-
-    return value
+                error=f'Invalid request: {", ".join(errors)}')
+
+    return YandexRequest(
+        client_device_id=values['client_id'],
+        timezone=values['timezone'],
+        has_screen=values['screen'] is not None,
+        is_new_session=values['is_new_session'],
+        user_guid=values['user_guid'],
+        version=values['version'],
+        session_id=values['session_id'],
+        message_id=values['message_id'],
+        original_utterance=values['original_utterance'],
+        command=values['command'],
+        tokens=values['tokens'] or [],
+        entities=values['entities'] or [],
+        aws_lambda_mode=aws_lambda_mode,
+    )
 
 
 def transform_yandex_response_to_output_result_dict(
@@ -490,6 +490,8 @@ def choose_key(keys_dict):
     return min_usage_key['name'], min_usage_key['pass'], keys_dict
 
 
+# Retired, see retired_folders in deployer.py: the days of nutrition_users
+# are not a single 'value' list anymore
 @timeit
 def update_user_table(
         *,
@@ -6,6 +6,7 @@ import typing
 from fpdf import FPDF
 import requests
 import time
+from history import iterate_user_days
 t1 = time.time()
 str_time = '2019-01-28 15:13:57.226218'
 d = datetime.datetime.strptime(str_time.split('.')[0], '%Y-%m-%d %H:%M:%S')
@@ -230,7 +231,7 @@ def draw_daily_table(*,
 
 def report(
         *,
-        database_client,
+        lambda_mode: bool = False,
         date_from: typing.Optional[datetime.date]=None,
         date_to: typing.Optional[datetime.date]=None,
         user_id: str,
@@ -255,23 +256,19 @@ def report(
         return 'Максимальный размер отчета один месяц'
 
     week_days = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье', ]
-    impacted_days = [str(d) for d in [date_from + datetime.timedelta(days=i) for
-                                      i in range((date_to-date_from).days + 1)]]
 
     pdf = FPDF(orientation='P', unit='mm', format='A4')
     pdf.add_page()
     pdf.add_font('FreeSans', '', 'FreeSans.ttf', uni=True)
     pdf.set_font('FreeSans')
 
-    items = database_client.batch_get_item(
-            RequestItems={
-                'nutrition_users': {
-                    'Keys': [{'id': {'S': user_id}, 'date': {'S': d}} for d in impacted_days]}})
-    for item in sorted(items['Responses']['nutrition_users'], key=lambda x: x['date']['S']):
-        date = dateutil.parser.parse(item['date']['S']).date()
-        print(f'\n{date} ({week_days[date.isoweekday() - 1]})')
-        food_list = json.loads(item['value']['S'])
-        draw_daily_table(date=date, foods_list=food_list, pdf_object=pdf, current_timezone=current_timezone)
+    for day in iterate_user_days(
+            user_id=user_id,
+            date_from=date_from,
+            date_to=date_to,
+            lambda_mode=lambda_mode):
+        print(f'\n{day.date} ({week_days[day.date.isoweekday() - 1]})')
+        draw_daily_table(date=day.date, foods_list=day.meals, pdf_object=pdf, current_timezone=current_timezone)
     if filename is None:
         filename = f'{date_from}_{date_to}.pdf'
     pdf.output(filename)
@@ -285,7 +282,6 @@ if __name__ == '__main__':
     print(response.text)
     # print(
     #         report(
-    #                 database_client=client,
     #                 # date_from=datetime.date.today() - datetime.timedelta(days=7),
     #                 # date_to=datetime.date.today(),
     #                 user_id='C7661DB7B22C25BC151DBC1DB202B5624348B30B4325F2A67BB0721648216065',
@@ -3,8 +3,7 @@ from botocore.vendored import requests
 import json
 import random
 import os
-import typing
-from functools import reduce
+from event_parser import fetch_one_value_from_event_dict
 
 
 def construct_response(*,
@@ -57,22 +56,6 @@ def _make_request_to_kodi(*, endpoint: str, user_id: str) -> None:
         pass
 
 
-def fetch_one_value_from_event_dict(
-        *,
-        event_dict: dict,
-        path: str) -> typing.Optional[typing.Any]:
-    if not isinstance(event_dict, dict):
-        return None
-    value = None
-    try:
-        value = reduce(
-                dict.get, [t.strip() for t in path.split('->')],
-                event_dict)
-    except TypeError:
-        pass
-
-    return value
-
 def get_help_text(*, user_id, short_version=False, input_text=''):
     help_text = 'Я могу запустить видео, остановить его, или поставить на паузу. В данный ' \
                 'момент навык является приватным. Чтобы выйти из навыка, скажите Выход.'